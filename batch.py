@@ -0,0 +1,447 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import texture
+from drawing_utils import BufferPool
+from export import DEFAULT_DPI, PAPER_SIZES, export_size, use_strips
+from landscape import (
+    COLOR_PALETTES,
+    MARGIN_OPTIONS,
+    LandscapeConfig,
+    save_landscape,
+)
+from writers import COMPRESSION_LEVEL, DEFAULT_QUALITY, EncodeOptions
+
+# File of the finished jobs of a batch, one JSON record per line
+MANIFEST_NAME = "manifest.jsonl"
+
+# Jobs submitted ahead of the finished ones, per worker
+JOBS_PER_WORKER = 2
+
+# Settings that a batch varies, which are removed from its base settings
+COLOR_SETTINGS = ("sky_color", "sun_color", "land_color")
+
+# State of a worker process: its buffers and the shared memory it attached
+__worker = {}
+
+
+class SharedTexture:
+    """
+    The decoded texture of a batch, and its mask resized to the size of the
+    batch, placed once in shared memory for every worker to read instead of
+    decoding and resizing the file in each of them.
+    """
+
+    def __init__(self, texture_path, width, height):
+        """
+        Attributes:
+            texture_path (str): Path to the texture file.
+            shapes (List[Tuple]): The shape of each shared array, the texture
+                and then its mask if the batch is not rendered by strips.
+            __memory (SharedMemory): The memory holding the arrays.
+
+        Args:
+            texture_path (str): Path to the texture file.
+            width (int): The width of the images of the batch.
+            height (int): The height of the images of the batch.
+        """
+        arrays = [texture.load_texture(texture_path)]
+
+        # Strips blend bands of the texture, not the whole resized mask
+        if not use_strips(width, height):
+            arrays.append(texture.texture_mask(texture_path, width, height))
+
+        self.texture_path = texture_path
+        self.shapes = [array.shape for array in arrays]
+        self.__memory = shared_memory.SharedMemory(
+            create=True, size=sum(array.nbytes for array in arrays)
+        )
+        for shared, array in zip(
+            attach_arrays(self.__memory, self.shapes), arrays
+        ):
+            shared[:] = array
+
+    @property
+    def spec(self):
+        """
+        Tuple: What a worker needs to attach the texture, the arguments of
+        `init_worker`.
+        """
+        return self.texture_path, self.__memory.name, self.shapes
+
+    def close(self):
+        """
+        Releases the shared memory, once every worker has exited.
+        """
+        self.__memory.close()
+        self.__memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def attach_arrays(memory, shapes):
+    """
+    Views a block of shared memory as consecutive uint8 arrays.
+
+    Args:
+        memory (SharedMemory): The shared memory.
+        shapes (List[Tuple]): The shape of each array.
+
+    Returns:
+        List[np.ndarray]: The arrays, backed by the shared memory.
+    """
+    arrays = []
+    offset = 0
+    for shape in shapes:
+        array = np.ndarray(shape, np.uint8, memory.buf, offset)
+        offset += array.nbytes
+        arrays.append(array)
+
+    return arrays
+
+
+def init_worker(texture_path, memory_name, shapes):
+    """
+    Prepares a worker process: attaches the shared texture and puts it in
+    the texture caches of the worker.
+
+    Args:
+        texture_path (str): Path to the texture file.
+        memory_name (str): The name of the shared memory of the texture.
+        shapes (List[Tuple]): The shape of each shared array.
+    """
+    memory = shared_memory.SharedMemory(memory_name)
+    shared_texture, *masks = attach_arrays(memory, shapes)
+    texture.share_texture(texture_path, shared_texture, masks)
+
+    __worker["memory"] = memory
+    __worker["buffers"] = BufferPool()
+
+
+def render_job(name, config, path, options=None):
+    """
+    Renders and encodes one image of a batch in a worker process. The image
+    is written under a temporary name first, so that an interrupted job
+    never leaves a file that looks finished.
+
+    Args:
+        name (str): The name of the job.
+        config (LandscapeConfig): The settings of the image.
+        path (str): The path of the image.
+        options (EncodeOptions, optional): The settings of the encoder.
+
+    Returns:
+        Dict[str, Any]: The record of the job for the manifest.
+    """
+    start = time.perf_counter()
+    root, extension = os.path.splitext(path)
+    partial_path = root + ".partial" + extension
+    stats = save_landscape(
+        config, partial_path, __worker.get("buffers"), options=options
+    )
+    os.replace(partial_path, path)
+
+    return {
+        "name": name,
+        "file": os.path.basename(path),
+        "format": stats.format,
+        "bytes": stats.bytes,
+        "seconds": round(time.perf_counter() - start, 3),
+        "encode_seconds": round(stats.seconds, 3),
+        "config": config.to_dict(),
+    }
+
+
+def batch_jobs(base, seeds, palettes, margins, extension=".png"):
+    """
+    Creates a job for every combination of seed, palette and margin.
+
+    Args:
+        base (Dict[str, Any]): The settings shared by every image. Its
+            colors are ignored, each image takes those of its palette.
+        seeds (Iterable[int]): The seeds of the mountains.
+        palettes (List[str]): The color palettes.
+        margins (List[str]): The margins.
+        extension (str): The extension of the images.
+
+    Returns:
+        List[Tuple[str, str, LandscapeConfig]]: The name, the file name and
+        the settings of each job.
+    """
+    base = {
+        key: value for key, value in base.items() if key not in COLOR_SETTINGS
+    }
+    jobs = []
+    for seed, palette, margin in itertools.product(seeds, palettes, margins):
+        name = "{}_{}_{}".format(seed, palette, margin).replace(" ", "")
+        config = LandscapeConfig.from_dict(
+            dict(base, seed=seed, palette=palette, margin=margin)
+        )
+        jobs.append((name, name + extension, config))
+
+    return jobs
+
+
+def read_manifest(path):
+    """
+    Reads the records of the finished jobs of a batch. A last line cut by an
+    interruption is ignored.
+
+    Args:
+        path (str): The path of the manifest.
+
+    Returns:
+        Dict[str, Dict]: The records, by job name.
+    """
+    records = {}
+    if not os.path.exists(path):
+        return records
+
+    with open(path) as manifest:
+        for line in manifest:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record["name"]] = record
+
+    return records
+
+
+def __is_finished(record, output_dir, file_name, config):
+    """
+    Tells whether a job was already rendered with the same settings. A job
+    rendered with other settings, such as another config or paper size, is
+    rendered again.
+
+    Args:
+        record (Dict): The record of the job in the manifest, or None.
+        output_dir (str): The directory of the images.
+        file_name (str): The name of the image of the job.
+        config (LandscapeConfig): The settings of the job.
+
+    Returns:
+        bool: True if the image exists and was rendered from the config.
+    """
+    if record is None:
+        return False
+
+    # The manifest holds the config as JSON, where tuples become lists
+    return record.get("config") == json.loads(
+        json.dumps(config.to_dict())
+    ) and os.path.exists(os.path.join(output_dir, file_name))
+
+
+def __ends_with_newline(path):
+    """
+    Tells whether a non empty file ends with a line break.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        bool: True if the last byte of the file is a line break.
+    """
+    with open(path, "rb") as file:
+        file.seek(-1, os.SEEK_END)
+        return file.read(1) == b"\n"
+
+
+def run_batch(jobs, output_dir, workers=None, log=print, options=None):
+    """
+    Renders jobs across a pool of processes, each one encoding and writing
+    its images. Finished jobs are appended to the manifest of the output
+    directory as they complete, and jobs already in the manifest with the
+    same config are skipped, so an interrupted batch continues where it
+    stopped.
+
+    Args:
+        jobs (List[Tuple[str, str, LandscapeConfig]]): The jobs, as returned
+            by `batch_jobs`, sharing the same texture and size.
+        output_dir (str): The directory of the images and the manifest.
+        workers (int, optional): The number of processes. One per CPU if
+            None.
+        log (Callable): The function printing the progress.
+        options (EncodeOptions, optional): The settings of the encoder. As
+            the workers already run in parallel, each one compresses with a
+            single thread by default.
+
+    Returns:
+        Tuple[int, int, int]: The number of jobs rendered, skipped and
+        failed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    finished = read_manifest(manifest_path)
+    pending = [
+        job
+        for job in jobs
+        if not __is_finished(finished.get(job[0]), output_dir, *job[1:])
+    ]
+    skipped = len(jobs) - len(pending)
+    rendered = failed = 0
+    if not pending:
+        return rendered, skipped, failed
+
+    # A record cut by an interruption must not swallow the next one
+    if finished and not __ends_with_newline(manifest_path):
+        with open(manifest_path, "a") as manifest:
+            manifest.write("\n")
+
+    workers = workers or os.cpu_count()
+    options = options or EncodeOptions(threads=1)
+    config = pending[0][2]
+    with SharedTexture(
+        config.texture, config.width, config.height
+    ) as shared, open(manifest_path, "a") as manifest, ProcessPoolExecutor(
+        workers, initializer=init_worker, initargs=shared.spec
+    ) as executor:
+        # Submit a few jobs ahead of the finished ones only, so that the
+        # queue does not hold every config of the batch
+        queue = iter(pending)
+        running = {}
+        while True:
+            for name, file_name, config in itertools.islice(
+                queue, workers * JOBS_PER_WORKER - len(running)
+            ):
+                future = executor.submit(
+                    render_job,
+                    name,
+                    config,
+                    os.path.join(output_dir, file_name),
+                    options,
+                )
+                running[future] = name
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    record = future.result()
+                except Exception as error:
+                    failed += 1
+                    log("Failed {}: {}".format(name, error))
+                    continue
+
+                manifest.write(json.dumps(record) + "\n")
+                manifest.flush()
+                rendered += 1
+                log(
+                    "[{}/{}] {} in {:.2f} s".format(
+                        skipped + rendered + failed,
+                        len(jobs),
+                        name,
+                        record["seconds"],
+                    )
+                )
+
+    return rendered, skipped, failed
+
+
+def main(argv=None):
+    """
+    Renders a batch of landscapes from the command line.
+
+    Args:
+        argv (List[str], optional): The arguments. Those of the process if
+            None.
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m batch",
+        description="Renders every combination of seeds, palettes and "
+        "margins of a landscape, resuming an interrupted batch.",
+    )
+    parser.add_argument(
+        "output_dir", help="The directory of the images and the manifest."
+    )
+    parser.add_argument(
+        "--config", help="A JSON file with the settings of every image."
+    )
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--seeds", type=int, default=1, help="Seed count.")
+    parser.add_argument(
+        "--palettes",
+        nargs="+",
+        choices=COLOR_PALETTES,
+        default=list(COLOR_PALETTES),
+    )
+    parser.add_argument(
+        "--margins", nargs="+", choices=MARGIN_OPTIONS, default=MARGIN_OPTIONS
+    )
+    parser.add_argument("--paper", choices=PAPER_SIZES)
+    parser.add_argument("--dpi", type=int, default=DEFAULT_DPI)
+    parser.add_argument(
+        "--format", choices=["png", "tif", "jpg", "webp"], default="png"
+    )
+    parser.add_argument(
+        "--quality",
+        type=int,
+        default=DEFAULT_QUALITY,
+        help="The quality of JPEG and WebP images, from 0 to 100.",
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        default=COMPRESSION_LEVEL,
+        help="The deflate level of PNG and TIFF images, from 0 to 9.",
+    )
+    parser.add_argument(
+        "--no-alpha",
+        action="store_true",
+        help="Writes the images without their alpha channel.",
+    )
+    parser.add_argument(
+        "--workers", type=int, help="Number of processes, one per CPU."
+    )
+    args = parser.parse_args(argv)
+
+    base = {}
+    if args.config is not None:
+        with open(args.config) as file:
+            base = json.load(file)
+    if args.paper is not None:
+        base["width"], base["height"] = export_size(args.paper, args.dpi)
+
+    try:
+        options = EncodeOptions(
+            args.quality, args.compression_level, not args.no_alpha, 1
+        )
+        jobs = batch_jobs(
+            base,
+            range(args.first_seed, args.first_seed + args.seeds),
+            args.palettes,
+            args.margins,
+            "." + args.format,
+        )
+    except (TypeError, ValueError) as error:
+        parser.error(str(error))
+
+    start = time.perf_counter()
+    rendered, skipped, failed = run_batch(
+        jobs, args.output_dir, args.workers, options=options
+    )
+    print(
+        "Rendered {}, skipped {} already done, failed {} in {:.1f} s".format(
+            rendered, skipped, failed, time.perf_counter() - start
+        )
+    )
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
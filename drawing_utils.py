@@ -1,30 +1,178 @@
 import cv2
 import numpy as np
 import math
+import os
+import threading
+import tracemalloc
+from collections import OrderedDict
 
 import midpoint_displacement as md
+from heightmap import Heightmap
+from smoothing import Smoother
+import texture
+from terrain_engines import DEFAULT_ENGINE, get_engine
 
+# Mountain renderers. Polygon is the default and the fastest; Columns is a
+# slower reference kept to compare against, and may differ by a pixel along
+# steep edges and contours
+MOUNTAIN_RENDERERS = ["Polygon", "Columns"]
 
-def generate_image(width, height, color):
+# Labels of the scene raster, telling which element owns each pixel. Each
+# mountain layer has its own label, starting at FIRST_LAYER_LABEL
+SKY_LABEL = 0
+SUN_LABEL = 1
+CONTOUR_LABEL = 2
+FIRST_LAYER_LABEL = 3
+
+# Whether the buffer pools trace the peak memory of each render with
+# tracemalloc. Tracing slows down every allocation of the process, so it is
+# only enabled by setting the LANDSCAPE_TRACE_MEMORY environment variable
+TRACE_MEMORY = bool(os.environ.get("LANDSCAPE_TRACE_MEMORY"))
+
+# Memory the margin masks may keep, in bytes. Masks larger than this, such
+# as those of exports close to the memory budget, are not kept
+MARGIN_CACHE_BYTES = 32 * 2**20
+
+# Margin masks, by (margin type, width, height, scale), least recently used
+# first, and the lock of the cache, which the preview and the exports use
+# from different threads
+__margin_masks = OrderedDict()
+__margin_lock = threading.Lock()
+
+# Contour
+CONTOUR_COLOR = (255, 255, 255, 255)
+CONTOUR_THICKNESS = 12
+
+# Rows rasterized around a band of the scene, on top of the contour
+# thickness, so that polygons clipped at the edges of the band are unchanged
+BAND_OVERLAP = 4
+
+# Spacing between the margins and the edges of the image
+MARGIN_SPACING_CIRCLE = 200
+MARGIN_SPACING_WINDOW = 300
+
+# Sizes in pixels, like the constants above, are given for a scale of 1,
+# the resolution of the reference canvas. Drawing at another resolution
+# passes the ratio between its size and the reference size as the scale
+
+
+def contour_thickness(scale=1.0):
     """
-    Creates an image array with the given size and color.
+    Computes the thickness of the contours at a given scale.
 
     Args:
-        width (int): The width of the image.
-        height (int): The height of the image.
-        color (Tuple): The RGBA color tuple to fill the image with.
+        scale (float): The ratio between the resolution of the image and the
+            resolution of the reference canvas.
 
     Returns:
-        np.ndarray: An image of shape (height, width, 4)
+        int: The contour thickness in pixels, at least one.
     """
-    image = np.zeros((height, width, 4), np.uint8)
-    image[:, :] = color
+    return max(round(CONTOUR_THICKNESS * scale), 1)
 
-    return image
+
+class BufferPool:
+    """
+    A pool of reusable destination arrays for the render stages.
+
+    Each stage asks the pool for a named buffer of a given shape, and the
+    buffer is only allocated the first time or when its shape changes, so
+    renders at a steady size do not allocate full frames. The pool counts the
+    bytes of the buffers it allocates during each render.
+
+    The stages still allocate temporaries outside of the pool. To debug
+    them, a pool can also trace the peak memory of each render with
+    tracemalloc, which it starts on the first render. The peak is traced for
+    the whole process: it is only exact for a render running alone, as
+    renders running on other threads at the same time add to it or reset
+    it.
+    """
+
+    def __init__(self, trace=TRACE_MEMORY):
+        """
+        Attributes:
+            __buffers (Dict[str, np.ndarray]): The buffers, by name.
+            __traced_bytes (int): The memory traced when the current render
+                began.
+            trace (bool): Whether the pool traces the peak memory of each
+                render.
+            allocated_bytes (int): The bytes of the pool buffers allocated
+                since the current render began.
+            peak_bytes (int): The peak memory the last render allocated on
+                top of the memory in use when it began, None if the pool
+                does not trace it.
+
+        Args:
+            trace (bool): Whether to trace the peak memory of each render.
+        """
+        self.__buffers = {}
+        self.__traced_bytes = 0
+        self.trace = trace
+        self.allocated_bytes = 0
+        self.peak_bytes = None
+
+    def begin_render(self):
+        """
+        Starts counting the bytes allocated by a new render.
+        """
+        self.allocated_bytes = 0
+        if not self.trace:
+            return
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self.__traced_bytes = tracemalloc.get_traced_memory()[0]
+        self.peak_bytes = None
+
+    def end_render(self):
+        """
+        Stops counting the bytes allocated by the current render, and
+        records its peak memory if the pool traces it.
+        """
+        if self.trace and tracemalloc.is_tracing():
+            self.peak_bytes = max(
+                tracemalloc.get_traced_memory()[1] - self.__traced_bytes, 0
+            )
+
+    def get(self, name, shape, dtype=np.uint8):
+        """
+        Returns the buffer with the given name, allocating it if it does not
+        exist yet or if its shape or type changed. Its content is undefined.
+
+        Args:
+            name (str): The name of the buffer.
+            shape (Tuple[int]): The shape of the buffer.
+            dtype (np.dtype): The type of the buffer.
+
+        Returns:
+            np.ndarray: The buffer.
+        """
+        buffer = self.__buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype)
+            self.__buffers[name] = buffer
+            self.allocated_bytes += buffer.nbytes
+
+        return buffer
+
+    @property
+    def pooled_bytes(self):
+        """
+        int: The size of all the buffers held by the pool.
+        """
+        return sum(buffer.nbytes for buffer in self.__buffers.values())
 
 
 def draw_sun(
-    image, radius, center_x, center_y, color, white_contour, sky_element
+    image,
+    radius,
+    center_x,
+    center_y,
+    color,
+    white_contour,
+    sky_element,
+    contour_color=CONTOUR_COLOR,
+    scale=1.0,
 ):
     """
     Adds a sun or moon to the given image with a specific center and radius,
@@ -42,62 +190,107 @@ def draw_sun(
             white.
         sky_element (str): Either "Sun" or "Moon", to specify whether to draw
             a sun or moon.
+        contour_color (tuple): The color of the contour. Drawing labels
+            instead of colors on a single channel raster is also supported.
+        scale (float): The scale of the image, which scales the thickness of
+            the contour.
     """
-    # Set the color for the contour
-    contour_color = (255, 255, 255, 255)
+    if radius <= 0:
+        return
+    thickness = contour_thickness(scale)
+
+    # Only work inside the bounding box of the sun or moon and its contour
+    region = sky_element_region(
+        image.shape[1], image.shape[0], radius, center_x, center_y, scale
+    )
+    if region is None:
+        return
+    x0, y0, x1, y1 = region
+    roi = image[y0:y1, x0:x1]
 
     # Draw the sun or moon
-    center = (center_x, center_y)
-    if radius > 0:
-        if sky_element == "Sun":
-            cv2.circle(
-                image, center, radius, color, thickness=-1, lineType=8, shift=0
-            )
-            if white_contour:
-                cv2.circle(
-                    image,
-                    center,
-                    radius,
-                    contour_color,
-                    thickness=12,
-                    lineType=8,
-                    shift=0,
-                )
-        elif sky_element == "Moon":
-            # Draw a moon instead of a sun
-            inner_center = (
-                center_x + int(radius / 3),
-                center_y - int(radius / 3),
-            )
-            mask = np.zeros((image.shape[0], image.shape[1], 4), np.uint8)
-            filling = mask.copy()
-            filling[:, :] = color
+    center = (center_x - x0, center_y - y0)
+    if sky_element == "Sun":
+        cv2.circle(
+            roi, center, radius, color, thickness=-1, lineType=8, shift=0
+        )
+        if white_contour:
             cv2.circle(
-                mask, center, radius, (255, 255, 255, 255), thickness=-1
+                roi,
+                center,
+                radius,
+                contour_color,
+                thickness=thickness,
+                lineType=8,
+                shift=0,
             )
-            cv2.circle(
-                mask,
-                inner_center,
-                math.floor(radius / 1.2),
-                (0, 0, 0, 255),
-                thickness=-1,
+    elif sky_element == "Moon":
+        # Draw a moon instead of a sun
+        inner_center = (
+            center[0] + int(radius / 3),
+            center[1] - int(radius / 3),
+        )
+        mask = np.zeros(roi.shape[:2], np.uint8)
+        cv2.circle(mask, center, radius, 255, thickness=-1)
+        cv2.circle(
+            mask,
+            inner_center,
+            math.floor(radius / 1.2),
+            0,
+            thickness=-1,
+        )
+        roi[mask == 255] = color
+        if white_contour:
+            contours, _ = cv2.findContours(
+                mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE
             )
-            image[mask == 255] = filling[mask == 255]
-            if white_contour:
-                imgray = cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY)
-                ret, thresh = cv2.threshold(imgray, 127, 255, 0)
-                contours, _ = cv2.findContours(
-                    thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE
-                )
-                cv2.drawContours(image, contours, -1, contour_color, 12)
+            cv2.drawContours(roi, contours, -1, contour_color, thickness)
+
+
+def sky_element_region(width, height, radius, center_x, center_y, scale=1.0):
+    """
+    Computes the bounding box of a sun or moon and its contour, clipped to
+    the image.
+
+    Args:
+        width (int): The width of the image.
+        height (int): The height of the image.
+        radius (int): The radius of the sun or moon.
+        center_x (int): The x-coordinate of the center of the sun or moon.
+        center_y (int): The y-coordinate of the center of the sun or moon.
+        scale (float): The scale of the image, which scales the thickness of
+            the contour.
+
+    Returns:
+        Tuple[int, int, int, int]: The (x0, y0, x1, y1) corners of the box,
+        with x1 and y1 excluded, or None if the box is outside the image.
+    """
+    # Half the contour thickness plus a pixel, so that the contour is drawn
+    # entirely and the moon mask is surrounded by empty pixels
+    extent = radius + contour_thickness(scale) // 2 + 1
+    x0 = max(center_x - extent, 0)
+    y0 = max(center_y - extent, 0)
+    x1 = min(center_x + extent + 1, width)
+    y1 = min(center_y + extent + 1, height)
+    if x0 >= x1 or y0 >= y1:
+        return None
+
+    return x0, y0, x1, y1
 
 
 def generate_mountains(
-    image, num_layers, roughness, decrease_roughness, weight, height
+    image,
+    num_layers,
+    roughness,
+    decrease_roughness,
+    weight,
+    height,
+    seed=None,
+    engine=DEFAULT_ENGINE,
 ):
     """
     Generates layers of mountain heights with a specific roughness using the
-    midpoint displacement algorithm.
+    given terrain engine, midpoint displacement by default.
 
     Args:
         image (numpy.ndarray): The image on which to generate the mountains.
@@ -109,34 +302,33 @@ def generate_mountains(
         weight (float): The weight of the mountain terrain. A higher weight
             value produces taller mountains.
         height (int): The height of the image.
+        seed (int, optional): The seed of the landscape. Every layer draws from
+            its own random streams derived from this seed, so the same seed and
+            parameters always produce the same mountains. If None, a fresh
+            seed is drawn.
+        engine (str): The name of the registered terrain engine to use.
 
     Returns:
-        List[numpy.ndarray]: A list of arrays representing the layers of
-        mountain heights, ordered from the top layer to the bottom layer.
+        Heightmap: The layers of mountain heights, ordered from the top layer
+        to the bottom layer.
     """
-    mountains = []
-    for layer in range(num_layers):
-        if not decrease_roughness:
-            layer_roughness = roughness
-        else:
-            layer_roughness = roughness // (layer + 1)
-        layer_heights = md.run_midpoint_displacement(
-            layer_roughness, weight, height
-        )
-        mountains.append(layer_heights)
+    if seed is None:
+        seed = md.new_seed()
 
-    return mountains
+    return get_engine(engine).generate(
+        num_layers, roughness, decrease_roughness, weight, height, seed
+    )
 
 
 def normalize_mountains(
     mountains, height, lower_padding, upper_padding, mountain_intersection
 ):
     """
-    Given a list of mountains, it normalizes the highest and lower heights and
-    applies a padding to the range.
+    Given a heightmap, it normalizes the highest and lower heights of every
+    layer and applies a padding to the range.
 
     Args:
-        mountains (list): A list of mountain heights.
+        mountains (Heightmap): The mountain heights.
         height (int): The maximum height of the mountains.
         lower_padding (int): The padding added to the lower end of the range.
         upper_padding (int): The padding added to the upper end of the range.
@@ -144,94 +336,697 @@ def normalize_mountains(
             the mountains.
 
     Returns:
-        list: A list of normalized mountain heights.
-    """
-    num_layers = len(mountains)
-    for layer in range(num_layers):
-        layer_heights = mountains[layer]
-
-        # Calculate the range of heights for the current layer
-        layer_range = (
-            (height - lower_padding - upper_padding) / num_layers * layer
-            + upper_padding,
-            height
-            - lower_padding
-            - (
-                (height - lower_padding - upper_padding)
-                / num_layers
-                * (num_layers - layer - 1)
+        Heightmap: The normalized mountain heights.
+    """
+    num_layers = mountains.num_layers
+    if num_layers == 0:
+        return mountains
+    layers = np.arange(num_layers, dtype=np.float32)
+
+    # Calculate the range of heights for every layer at once
+    layer_height = (height - lower_padding - upper_padding) / num_layers
+    lower_bounds = layer_height * layers + upper_padding
+    upper_bounds = (
+        height
+        - lower_padding
+        - layer_height
+        * (num_layers - layers - 1)
+        * mountain_intersection
+        / 100
+    )
+
+    # Normalize the heights of all the layers using the cached extremes
+    normalized = md.normalize(
+        mountains.heights,
+        lower_bounds[:, np.newaxis],
+        upper_bounds[:, np.newaxis],
+        mountains.minimums[:, np.newaxis],
+        mountains.maximums[:, np.newaxis],
+    )
+
+    return Heightmap(normalized, lower_bounds, upper_bounds)
+
+
+def resample_mountains(mountains, width, scale):
+    """
+    Resamples normalized mountains to draw them at another resolution. The
+    heights are averaged over the columns merged into each new column and
+    scaled to the new image height.
+
+    Args:
+        mountains (Heightmap): The normalized mountain heights.
+        width (int): The width of the new image.
+        scale (float): The ratio between the height of the new image and the
+            height the mountains were normalized to.
+
+    Returns:
+        Heightmap: The mountain heights at the new resolution.
+    """
+    if mountains.width == width and scale == 1:
+        return mountains
+    if mountains.num_layers == 0:
+        return Heightmap.empty(width)
+
+    heights = cv2.resize(
+        mountains.heights,
+        (width, mountains.num_layers),
+        interpolation=cv2.INTER_AREA,
+    )
+    heights *= scale
+
+    return Heightmap(heights)
+
+
+class StripDownsampler:
+    """
+    Downsamples an image by area averaging as its strips are rendered from
+    top to bottom, so that a smaller copy is made without holding the whole
+    image.
+
+    Each strip is first averaged across its columns with OpenCV, then its
+    rows are spread over the rows of the copy they overlap, weighted by the
+    overlap. Only the row of the copy that straddles the end of a strip is
+    kept in floats until the next strip completes it. The copy matches
+    resizing the whole image with INTER_AREA up to one level of rounding.
+    """
+
+    def __init__(self, width, height, copy_width, copy_height):
+        """
+        Attributes:
+            __width (int): The width of the image.
+            __height (int): The height of the image.
+            __rows_written (int): The rows of the image added so far.
+            __carry (np.ndarray): The weighted sum of the row of the copy
+                that the next strip completes, as float32.
+            image (np.ndarray): The BGRA uint8 copy, complete once every row
+                of the image is added.
+
+        Args:
+            width (int): The width of the image.
+            height (int): The height of the image.
+            copy_width (int): The width of the copy, at most the width.
+            copy_height (int): The height of the copy, at most the height.
+        """
+        self.__width = width
+        self.__height = height
+        self.__rows_written = 0
+        self.__carry = np.zeros(copy_width * 4, np.float32)
+        self.image = np.empty((copy_height, copy_width, 4), np.uint8)
+
+    def write(self, strip):
+        """
+        Adds the next strip of the image to the copy.
+
+        Args:
+            strip (np.ndarray): The next rows of the BGRA uint8 image.
+        """
+        rows = strip.shape[0]
+        top = self.__rows_written
+        copy_height, copy_width = self.image.shape[:2]
+        if copy_width != self.__width:
+            strip = cv2.resize(
+                strip, (copy_width, rows), interpolation=cv2.INTER_AREA
             )
-            * mountain_intersection
-            / 100,
-        )
 
-        # Normalize the heights for the current layer using the calculated
-        # range
-        normalized_layer = md.normalize(
-            layer_heights, layer_range[0], layer_range[1]
+        # In units of 1 / height of a copy row, which keeps them exact,
+        # image row r spans [r * copy_height, (r + 1) * copy_height) and
+        # copy row i spans [i * height, (i + 1) * height)
+        starts = np.arange(top, top + rows, dtype=np.int64) * copy_height
+        ends = starts + copy_height
+        indices = starts // self.__height
+        boundaries = (indices + 1) * self.__height
+        first = indices[0]
+        last = -(-ends[-1] // self.__height)
+
+        # The weight of each image row in the one or two copy rows it spans
+        weights = np.zeros((last - first, rows), np.float32)
+        columns = np.arange(rows)
+        weights[indices - first, columns] = (
+            np.minimum(ends, boundaries) - starts
+        ) / self.__height
+        spills = ends > boundaries
+        weights[indices[spills] + 1 - first, columns[spills]] = (
+            ends[spills] - boundaries[spills]
+        ) / self.__height
+
+        sums = weights @ strip.reshape(rows, -1).astype(np.float32)
+        sums[0] += self.__carry
+
+        # Copy rows that end within the strip are complete
+        complete = ends[-1] // self.__height - first
+        np.clip(np.rint(sums[:complete]), 0, 255, out=sums[:complete])
+        self.image[first : first + complete] = sums[:complete].reshape(
+            complete, copy_width, 4
         )
+        if complete < len(sums):
+            self.__carry = sums[complete]
+        else:
+            self.__carry[:] = 0
+        self.__rows_written += rows
+
+
+def mountain_layer_colors(mountain_color, sky_color, num_layers):
+    """
+    Determines the color of each mountain layer. A single mountain color is
+    interpolated towards the sky color, several colors are cycled through.
+
+    Args:
+        mountain_color (tuple): The color or list of colors to use for the
+            mountain layers.
+        sky_color (Tuple[int]): The color to use for the sky.
+        num_layers (int): The number of mountain layers.
+
+    Returns:
+        List[Tuple[int]]: The color of each layer, from the top layer to the
+        bottom layer.
+    """
+    if len(mountain_color) > 1:
+        return [
+            mountain_color[layer % len(mountain_color)]
+            for layer in range(num_layers)
+        ]
 
-        mountains[layer] = normalized_layer
+    # Interpolate colors if a single mountain color is provided
+    colors = interpolate_colors(mountain_color[0], sky_color, num_layers + 1)
 
-    return mountains
+    return [colors[num_layers - layer - 1] for layer in range(num_layers)]
 
 
-def draw_mountains(
+def __draw_mountain_polygons(
     image,
     mountains,
     imageWidth,
     imageHeight,
-    mountain_color,
-    sky_color,
+    layer_colors,
     white_contour,
+    contour_color=CONTOUR_COLOR,
+    scale=1.0,
+    top=0,
 ):
     """
-    Draw the mountains on the given image using the provided heights and color.
+    Draws each mountain layer as a filled polygon, from the top layer to the
+    bottom layer.
 
     Args:
         image (numpy.ndarray): The image on which to draw the mountains.
-        mountains (List[List[float]]): A list of lists, where each inner list
-            represents the height values for a single mountain layer.
+        mountains (Heightmap): The height values of the mountain layers.
         imageWidth (int): The width of the image in pixels.
         imageHeight (int): The height of the image in pixels.
-        mountain_color (tuple): The color or list of colors to use for the
-            mountain layers.
-        sky_color (Tuple[int]): The color to use for the sky.
+        layer_colors (List[Tuple[int]]): The color of each layer.
         white_contour (bool): Whether or not to draw a white contour around the
             mountains.
+        contour_color (tuple): The color of the contour.
+        scale (float): The scale of the image, which scales the thickness of
+            the contour.
+        top (int): The row of the full image where the given image starts,
+            when drawing a band of the image.
     """
-    # Initialize the contour color to white
-    contour_color = (255, 255, 255, 255)
+    thickness = contour_thickness(scale)
+    heights = mountains.heights[:, :imageWidth].astype(np.int32)
 
-    # Interpolate colors if a single mountain color is provided
-    if len(mountain_color) == 1:
-        colors = interpolate_colors(
-            mountain_color[0], sky_color, len(mountains) + 1
+    # OpenCV outlines the polygons with lines clipped to the image, which
+    # start from where they are clipped. Drawing a band, the edges crossing
+    # its top or bottom row are drawn whole in a taller band, so that their
+    # pixels match those of the whole image, which is clipped to its own
+    # rows only
+    rows = image.shape[0]
+    lows = np.minimum(heights[:, :-1], heights[:, 1:])
+    highs = np.maximum(heights[:, :-1], heights[:, 1:])
+    clipped = ((lows < top) & (highs >= top)) | (
+        (lows < top + rows) & (highs >= top + rows)
+    )
+    band = image
+    band_top = top
+    if clipped.any():
+        band_top = max(min(top, lows[clipped].min()), 0)
+        band_bottom = min(
+            max(top + rows, highs[clipped].max() + 1), imageHeight
+        )
+        band = np.empty(
+            (band_bottom - band_top,) + image.shape[1:], image.dtype
         )
+        band[top - band_top : top - band_top + rows] = image
+
+    # Polygon buffer whose first and last points are the lower corners of the
+    # image, closing the polygon
+    points = np.empty((imageWidth + 2, 1, 2), np.int32)
+    points[0, 0] = (0, imageHeight - band_top)
+    points[-1, 0] = (imageWidth - 1, imageHeight - band_top)
+    points[1:-1, 0, 0] = np.arange(imageWidth)
 
     # Draw each mountain layer as a filled polygon
-    for layer in range(len(mountains)):
-        # Convert the heights into the list of points of a polygon
-        points = [[i, mountains[layer][i]] for i in range(imageWidth)]
-
-        # Add the lower corners of the image to close the polygon
-        points.insert(0, [0, imageHeight])
-        points.append([imageWidth - 1, imageHeight])
-        points = np.array(points, np.int32)
-        points = points.reshape((-1, 1, 2))
-
-        # Determine the layer color
-        if len(mountain_color) > 1:
-            layer_color = mountain_color[layer % len(mountain_color)]
-        else:
-            layer_color = colors[len(mountains) - layer - 1]
+    for layer in range(mountains.num_layers):
+        # Write the heights of the layer into the polygon, relative to the
+        # band once truncated to whole pixels
+        np.subtract(heights[layer], band_top, out=points[1:-1, 0, 1])
 
         # Draw the filled polygon
-        cv2.fillPoly(image, [points], layer_color)
+        cv2.fillPoly(band, [points], layer_colors[layer])
 
         # Draw the white contour if requested
         if white_contour:
-            cv2.polylines(image, [points], True, contour_color, 12)
+            cv2.polylines(band, [points], True, contour_color, thickness)
+
+    if band is not image:
+        image[:] = band[top - band_top : top - band_top + rows]
+
+
+def rasterize_mountains(
+    mountains,
+    width,
+    height,
+    white_contour,
+    out=None,
+    scale=1.0,
+    top=0,
+    rows=None,
+):
+    """
+    Rasterizes all the mountain layers at once into a raster of labels that
+    tells which layer owns each pixel.
+
+    Every layer is a height function of x, so a layer covers a column from its
+    height down to the bottom of the image. Marking where each layer starts
+    and taking the running maximum down the rows gives the last layer covering
+    each pixel, which is the painter's order of the polygon renderer. The
+    white contours are then added as bands around the layer edges, only where
+    no later layer covers them.
+
+    This is a reference renderer to compare against the polygon renderer,
+    which is several times faster. The two may differ by a pixel along steep
+    edges and contours.
+
+    Args:
+        mountains (Heightmap): The height values of the mountain layers.
+        width (int): The width of the image in pixels.
+        height (int): The height of the image in pixels.
+        white_contour (bool): Whether or not to add a contour around the
+            mountains.
+        out (np.ndarray, optional): A uint8 buffer of shape (rows, width)
+            to rasterize into instead of allocating a new raster.
+        scale (float): The scale of the image, which scales the thickness of
+            the contours.
+        top (int): The first row of the image to rasterize, when only a band
+            of the image is rasterized.
+        rows (int, optional): The number of rows to rasterize. Up to the
+            bottom of the image if None.
+
+    Returns:
+        np.ndarray: A uint8 raster of shape (rows, width) holding
+        SKY_LABEL where no mountain is drawn, CONTOUR_LABEL, or
+        FIRST_LAYER_LABEL plus the index of the layer owning each pixel.
+    """
+    if rows is None:
+        rows = height - top
+    columns = np.arange(width)
+
+    # Row where each layer starts in each column. Like the polygon edges, a
+    # steep slope also covers the column up to halfway to its neighbors
+    heights = mountains.heights[:, :width]
+    edges = (heights[:, 1:] + heights[:, :-1]) / 2
+    tops = heights.copy()
+    np.minimum(tops[:, 1:], edges, out=tops[:, 1:])
+    np.minimum(tops[:, :-1], edges, out=tops[:, :-1])
+    starts = tops.astype(np.int64)
+    np.clip(starts, 0, height, out=starts)
+
+    # Layers starting above the band cover it from its first row
+    band_starts = np.clip(starts - top, 0, rows)
+
+    labels = np.empty((rows, width), np.uint8) if out is None else out
+    labels.fill(SKY_LABEL)
+    for layer in range(mountains.num_layers):
+        # Layers starting below the band do not cover the column
+        inside = band_starts[layer] < rows
+        labels[band_starts[layer][inside], columns[inside]] = (
+            layer + FIRST_LAYER_LABEL
+        )
+    np.maximum.accumulate(labels, axis=0, out=labels)
+
+    if white_contour:
+        for layer in range(mountains.num_layers):
+            __rasterize_contour(
+                labels,
+                starts[layer],
+                layer + FIRST_LAYER_LABEL,
+                contour_thickness(scale),
+                top,
+                height,
+            )
+
+    return labels
+
+
+def __rasterize_contour(labels, starts, label, thickness, top, height):
+    """
+    Adds the contour of a mountain layer to a raster of labels, as thick as
+    the polygon contour, where no later layer covers it.
+
+    Args:
+        labels (np.ndarray): The raster of labels to update in place, a band
+            of the image.
+        starts (np.ndarray): The row of the image where the layer starts in
+            each column.
+        label (int): The label of the layer.
+        thickness (int): The thickness of the contour in pixels.
+        top (int): The row of the image where the band starts.
+        height (int): The height of the image.
+    """
+    band_height, width = labels.shape
+    half = thickness // 2
+
+    # A thick line covers, in each column, the rows of the neighboring
+    # columns within half the thickness, widened by half the thickness
+    padded = np.pad(starts, half, mode="edge")
+    lowest = starts.copy()
+    highest = starts.copy()
+    for shift in range(2 * half + 1):
+        neighbors = padded[shift : shift + width]
+        np.minimum(lowest, neighbors, out=lowest)
+        np.maximum(highest, neighbors, out=highest)
+    tops = np.maximum(lowest - half, 0)
+    bottoms = np.minimum(highest + half, height - 1)
+
+    # The sides of the polygon run down to the bottom of the image
+    bottoms[: half + 1] = height - 1
+    bottoms[-half - 1 :] = height - 1
+
+    # Keep the part of the contour inside the band
+    tops = np.maximum(tops - top, 0)
+    bottoms = np.minimum(bottoms - top, band_height - 1)
+
+    # Expand the contour of each column into pixel coordinates
+    lengths = np.maximum(bottoms - tops + 1, 0)
+    columns = np.repeat(np.arange(width), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths
+    )
+    rows = np.repeat(tops, lengths) + offsets
+
+    # Only keep the pixels that no later layer covers
+    visible = labels[rows, columns] <= label
+    labels[rows[visible], columns[visible]] = CONTOUR_LABEL
+
+    # The bottom side of the polygon lies on the lower edge of the image
+    bottom = labels[max(height - half - top, 0) :]
+    bottom[bottom <= label] = CONTOUR_LABEL
+
+
+def rasterize_scene(
+    width,
+    height,
+    sun_radius,
+    center_x,
+    center_y,
+    sky_element,
+    mountains,
+    white_contour,
+    renderer="Polygon",
+    out=None,
+    scale=1.0,
+    top=0,
+    rows=None,
+    sky_element_raster=None,
+):
+    """
+    Rasterizes the geometry of the whole scene into a raster of labels that
+    tells which element owns each pixel: the sky, the sun or moon, a contour
+    or a mountain layer. The raster does not depend on any color, so it can be
+    recolored with `colorize` until the geometry changes.
+
+    A horizontal band of the scene can be rasterized on its own. Extending
+    the band by `band_overlap` rows on each side and dropping them gives the
+    same labels as the same rows of the whole raster.
+
+    Args:
+        width (int): The width of the image in pixels.
+        height (int): The height of the image in pixels.
+        sun_radius (int): The radius of the sun or moon.
+        center_x (int): The x-coordinate of the center of the sun or moon.
+        center_y (int): The y-coordinate of the center of the sun or moon.
+        sky_element (str): Either "Sun" or "Moon".
+        mountains (Heightmap): The normalized height values of the mountain
+            layers.
+        white_contour (bool): Whether or not to draw a white contour around the
+            sun and the mountains.
+        renderer (str): "Polygon" or "Columns", the mountain renderer.
+        out (np.ndarray, optional): A uint8 buffer of shape (rows, width)
+            to rasterize into instead of allocating a new raster.
+        scale (float): The scale of the image, which scales the thickness of
+            the contours. The positions and sizes are given in pixels.
+        top (int): The first row of the band to rasterize.
+        rows (int, optional): The number of rows of the band. Up to the
+            bottom of the image if None.
+        sky_element_raster (Tuple, optional): The sun or moon rasterized
+            by `rasterize_sky_element`, to share it between the bands. Drawn
+            from the other arguments if None.
+
+    Returns:
+        np.ndarray: A uint8 raster of labels of shape (rows, width).
+    """
+    if rows is None:
+        rows = height - top
+
+    # Rasterize the mountains, then the sky element behind them
+    if renderer == "Polygon":
+        labels = np.empty((rows, width), np.uint8) if out is None else out
+        labels.fill(SKY_LABEL)
+        layer_labels = [
+            layer + FIRST_LAYER_LABEL for layer in range(mountains.num_layers)
+        ]
+        __draw_mountain_polygons(
+            labels,
+            mountains,
+            width,
+            height,
+            layer_labels,
+            white_contour,
+            CONTOUR_LABEL,
+            scale,
+            top,
+        )
+    elif renderer == "Columns":
+        labels = rasterize_mountains(
+            mountains, width, height, white_contour, out, scale, top, rows
+        )
+    else:
+        raise ValueError("Unknown mountain renderer: {}".format(renderer))
+
+    if sky_element_raster is None:
+        sky_element_raster = rasterize_sky_element(
+            width,
+            height,
+            sun_radius,
+            center_x,
+            center_y,
+            white_contour,
+            sky_element,
+            scale,
+        )
+    draw_sun_behind(labels, sky_element_raster, top)
+
+    return labels
+
+
+def rasterize_sky_element(
+    width,
+    height,
+    radius,
+    center_x,
+    center_y,
+    white_contour,
+    sky_element,
+    scale=1.0,
+):
+    """
+    Rasterizes the labels of a sun or moon over its bounding box only.
+
+    Args:
+        width (int): The width of the image in pixels.
+        height (int): The height of the image in pixels.
+        radius (int): The radius of the sun or moon.
+        center_x (int): The x-coordinate of the center of the sun or moon.
+        center_y (int): The y-coordinate of the center of the sun or moon.
+        white_contour (bool): If True, add the contour of the sun or moon.
+        sky_element (str): Either "Sun" or "Moon".
+        scale (float): The scale of the image, which scales the thickness of
+            the contour.
+
+    Returns:
+        Tuple[int, int, np.ndarray]: The column and row of the image where the
+        bounding box starts and the uint8 raster of the box, or None if
+        nothing is drawn.
+    """
+    if radius <= 0:
+        return None
+    region = sky_element_region(
+        width, height, radius, center_x, center_y, scale
+    )
+    if region is None:
+        return None
+    x0, y0, x1, y1 = region
+
+    sky = np.full((y1 - y0, x1 - x0), SKY_LABEL, np.uint8)
+    draw_sun(
+        sky,
+        radius,
+        center_x - x0,
+        center_y - y0,
+        SUN_LABEL,
+        white_contour,
+        sky_element,
+        CONTOUR_LABEL,
+        scale,
+    )
+
+    return x0, y0, sky
+
+
+def draw_sun_behind(labels, sky_element_raster, top=0, left=0):
+    """
+    Adds the labels of a sun or moon to a scene raster, only on the pixels
+    that are still sky, so that it stays behind the mountains. Only the
+    bounding box of the sky element is touched.
+
+    Args:
+        labels (np.ndarray): The uint8 raster of labels to update in place,
+            which can be a band or a rectangle of the image.
+        sky_element_raster (Tuple): The sky element, as returned by
+            `rasterize_sky_element`, or None.
+        top (int): The row of the image where the band starts.
+        left (int): The column of the image where the rectangle starts.
+    """
+    if sky_element_raster is None:
+        return
+    x0, y0, sky = sky_element_raster
+
+    # Rows and columns of the sky element inside the band
+    first = max(y0, top)
+    last = min(y0 + sky.shape[0], top + labels.shape[0])
+    first_column = max(x0, left)
+    last_column = min(x0 + sky.shape[1], left + labels.shape[1])
+    if first >= last or first_column >= last_column:
+        return
+
+    roi = labels[
+        first - top : last - top, first_column - left : last_column - left
+    ]
+    np.copyto(
+        roi,
+        sky[first - y0 : last - y0, first_column - x0 : last_column - x0],
+        where=roi == SKY_LABEL,
+    )
+
+
+def sky_element_rect(sky_element_raster):
+    """
+    Returns the bounding box of a rasterized sun or moon in the image.
+
+    Args:
+        sky_element_raster (Tuple): The sky element, as returned by
+            `rasterize_sky_element`, or None.
+
+    Returns:
+        Tuple[int, int, int, int]: The (x0, y0, x1, y1) corners of the box,
+        with x1 and y1 excluded, or None without a sky element.
+    """
+    if sky_element_raster is None:
+        return None
+    x0, y0, sky = sky_element_raster
+
+    return x0, y0, x0 + sky.shape[1], y0 + sky.shape[0]
+
+
+def union_rect(first, second):
+    """
+    Computes the bounding box of two rectangles.
+
+    Args:
+        first (Tuple[int, int, int, int]): The (x0, y0, x1, y1) corners of a
+            rectangle, or None.
+        second (Tuple[int, int, int, int]): The corners of another
+            rectangle, or None.
+
+    Returns:
+        Tuple[int, int, int, int]: The corners of the union, None if both
+        rectangles are None.
+    """
+    if first is None or second is None:
+        return first or second
+
+    return (
+        min(first[0], second[0]),
+        min(first[1], second[1]),
+        max(first[2], second[2]),
+        max(first[3], second[3]),
+    )
+
+
+def band_overlap(scale=1.0):
+    """
+    Computes how many rows to rasterize above and below a band of the scene,
+    so that the polygons and contours clipped at the edges of the band match
+    the whole raster once these rows are dropped.
+
+    Args:
+        scale (float): The scale of the image.
+
+    Returns:
+        int: The number of extra rows on each side of a band.
+    """
+    return contour_thickness(scale) + BAND_OVERLAP
+
+
+def palette_lut(sky_color, sun_color, mountain_color, num_layers):
+    """
+    Creates the lookup table that maps the labels of a scene raster to colors.
+
+    Args:
+        sky_color (Tuple[int]): The color of the sky.
+        sun_color (Tuple[int]): The color of the sun or moon.
+        mountain_color (tuple): The color or list of colors to use for the
+            mountain layers.
+        num_layers (int): The number of mountain layers.
+
+    Returns:
+        np.ndarray: A uint8 table of shape (FIRST_LAYER_LABEL + num_layers, 4)
+        with the BGRA color of each label. Channels out of range saturate,
+        like the drawing functions of OpenCV.
+    """
+    lut = np.zeros((FIRST_LAYER_LABEL + num_layers, 4), np.int64)
+    lut[SKY_LABEL] = sky_color
+    lut[SUN_LABEL] = sun_color
+    lut[CONTOUR_LABEL] = CONTOUR_COLOR
+    if num_layers > 0:
+        lut[FIRST_LAYER_LABEL:] = mountain_layer_colors(
+            mountain_color, sky_color, num_layers
+        )
+
+    return np.clip(lut, 0, 255).astype(np.uint8)
+
+
+def colorize(labels, lut, out=None):
+    """
+    Colors a scene raster with a lookup table, in a single gather of whole
+    BGRA pixels.
+
+    Args:
+        labels (np.ndarray): A uint8 raster of labels of shape
+            (height, width).
+        lut (np.ndarray): A uint8 table of BGRA colors indexed by label.
+        out (np.ndarray, optional): A contiguous uint8 buffer of shape
+            (height, width, 4) to write into instead of allocating a new
+            image.
+
+    Returns:
+        np.ndarray: The colored image, of shape (height, width, 4).
+    """
+    if out is None:
+        out = np.empty(labels.shape + (4,), np.uint8)
+    pixels = np.ascontiguousarray(lut).view(np.uint32)[:, 0]
+    np.take(pixels, labels, out=out.view(np.uint32)[..., 0])
+
+    return out
 
 
 def interpolate_colors(start_color, end_color, num_divisions):
@@ -262,110 +1057,185 @@ def interpolate_colors(start_color, end_color, num_divisions):
     return interpolated_colors
 
 
-def smooth_mountains(mountains, smoothing_range):
+def smooth_mountains(mountains, smoothing_range, kernel="Box"):
     """
     Smoothes the mountain heights given a specific neighborhood range.
 
+    To smooth the same mountains with several ranges, keep a
+    `smoothing.Smoother` instead, which reuses its prefix sums.
+
     Args:
-        mountains (list[list[float]]): A list of lists containing the height
-            values for each layer of the mountains.
+        mountains (Heightmap): The height values of the mountain layers.
         smoothing_range (int): The size of the neighborhood range to consider
             when smoothing the mountain heights.
+        kernel (str): The smoothing kernel, either "Box" or "Gaussian".
 
     Returns:
-        list[list[float]]: A list of lists containing the smoothed height
-            values for each layer of the mountains.
+        Heightmap: The smoothed height values of the mountain layers.
     """
-    smoothed_mountains = []
+    return Smoother(mountains).smooth(smoothing_range, kernel)
 
-    for layer in mountains:
-        smoothed_layer = []
 
-        # Iterate through each height value in the layer
-        for i in range(len(layer)):
-            lower_bound = max(i - smoothing_range, 0)
-            upper_bound = min(i + smoothing_range + 1, len(layer))
-            neighborhood = layer[lower_bound:upper_bound]
-            new_height = sum(neighborhood) / len(neighborhood)
-            smoothed_layer.append(new_height)
+def apply_texture(
+    image, texture_path, alpha, top=0, height=None, left=0, width=None
+):
+    """
+    Given an image and a texture, it merges both in place using the texture
+    as a mask. The texture is decoded and resized only once per size.
 
-        smoothed_mountains.append(smoothed_layer)
+    Args:
+        image (np.array): The input image as a numpy array, or a band or a
+            rectangle of the image.
+        texture_path (str): Path to the texture file.
+        alpha (float): Alpha value for blending the image and texture.
+        top (int): The row of the image where the band starts.
+        height (int, optional): The height of the image. The height of the
+            given image if None.
+        left (int): The column of the image where the rectangle starts.
+        width (int, optional): The width of the image. If given, the band or
+            rectangle is blended with the same pixels as the whole image,
+            otherwise only the rows of the band are resized, which matches
+            the whole image up to one level of rounding.
+
+    Returns:
+        np.ndarray: The blended image, which is the input image.
+    """
+    rows, columns = image.shape[:2]
+    if width is not None:
+        mask = texture.texture_mask(texture_path, width, height)
+        mask = mask[top : top + rows, left : left + columns]
+    elif height is None or (top == 0 and rows == height):
+        mask = texture.texture_mask(texture_path, columns, rows)
+    else:
+        # Only resize the rows of the texture under the band
+        mask = texture.texture_band(texture_path, columns, height, top, rows)
 
-    return smoothed_mountains
+    return texture.blend_texture(image, mask, alpha)
 
 
-def apply_texture(image, texture_path, alpha):
+def draw_margin(
+    image, margin_type, width, height, scale=1.0, top=0, left=0
+):
     """
-    Given an image and a texture, it merges both using the texture as a mask.
+    Draws a circular or rectangular white margin to the given image, in
+    place.
 
     Args:
-        image (np.array): The input image as a numpy array.
-        texture_path (str): Path to the texture file.
-        alpha (float): Alpha value for blending the image and texture.
+        image (np.array): The input image as a numpy array, or a band or a
+            rectangle of the image.
+        margin_type (str): The type of margin to draw - "Circle" or "Window".
+        width (int): The width of the image.
+        height (int): The height of the image.
+        scale (float): The scale of the image, which scales the spacing
+            between the margin and the edges.
+        top (int): The row of the image where the band starts.
+        left (int): The column of the image where the rectangle starts.
 
     Returns:
-        np.ndarray: The blended image.
+        np.array: The image with the white margin added, which is the input
+        image.
     """
-    out = np.ones(image.shape, np.uint8) * 255
-    texture = cv2.imread(texture_path)
-    texture = cv2.resize(texture, image.shape[1::-1])
-    mask = cv2.cvtColor(texture, cv2.COLOR_BGR2GRAY)
-    mask = mask / 255
+    # Paint white every pixel outside the opening of the margin, writing
+    # whole BGRA pixels. Whole images and rectangles use the cached masks
+    rows, columns = image.shape[:2]
+    if (top == 0 and rows == height) or columns != width:
+        outside = margin_mask(margin_type, width, height, scale)
+        outside = outside[top : top + rows, left : left + columns]
+    else:
+        outside = __margin_band_mask(
+            margin_type, width, height, scale, top, image.shape[0]
+        )
+    pixels = image.view(np.uint32)[..., 0]
+    np.copyto(pixels, np.uint32(0xFFFFFFFF), where=outside)
 
-    for channel in range(3):
-        mat = image[:, :, channel] * (1 - mask) + out[:, :, channel] * mask
-        out[:, :, channel] = mat.astype(int)
+    return image
 
-    return out
 
+def margin_mask(margin_type, width, height, scale=1.0):
+    """
+    Computes which pixels of an image are covered by a margin. The masks are
+    cached up to MARGIN_CACHE_BYTES, since they only depend on the margin
+    type and the image size.
+
+    Args:
+        margin_type (str): The type of margin - "Circle" or "Window".
+        width (int): The width of the image.
+        height (int): The height of the image.
+        scale (float): The scale of the image, which scales the spacing
+            between the margin and the edges.
+
+    Returns:
+        np.ndarray: A read-only boolean mask of shape (height, width), True
+        where the margin is drawn.
+    """
+    key = (margin_type, width, height, scale)
+    with __margin_lock:
+        outside = __margin_masks.get(key)
+        if outside is not None:
+            __margin_masks.move_to_end(key)
+            return outside
+
+    outside = __margin_band_mask(margin_type, width, height, scale, 0, height)
+    outside.setflags(write=False)
+    if outside.nbytes > MARGIN_CACHE_BYTES:
+        return outside
+
+    # Forget the least recently used masks until the cache fits
+    with __margin_lock:
+        __margin_masks[key] = outside
+        cached_bytes = sum(mask.nbytes for mask in __margin_masks.values())
+        while cached_bytes > MARGIN_CACHE_BYTES:
+            cached_bytes -= __margin_masks.popitem(last=False)[1].nbytes
+
+    return outside
 
-def draw_margin(image, margin_type, width, height):
+
+def __margin_band_mask(margin_type, width, height, scale, top, rows):
     """
-    Draws a circular or rectangular white margin to the given image.
+    Computes which pixels of a band of an image are covered by a margin.
 
     Args:
-        image (np.array): The input image as a numpy array.
-        margin_type (str): The type of margin to draw - "Circle" or "Window".
+        margin_type (str): The type of margin - "Circle" or "Window".
         width (int): The width of the image.
         height (int): The height of the image.
+        scale (float): The scale of the image, which scales the spacing
+            between the margin and the edges.
+        top (int): The row of the image where the band starts.
+        rows (int): The number of rows of the band.
 
     Returns:
-        np.array: The image with the white margin added.
+        np.ndarray: A boolean mask of shape (rows, width), True where the
+        margin is drawn.
     """
-    spacing_circle = 200
-    spacing_window = 300
+    spacing_circle = round(MARGIN_SPACING_CIRCLE * scale)
+    spacing_window = round(MARGIN_SPACING_WINDOW * scale)
 
-    # Create a blank mask and an output image of white pixels.
-    mask = np.zeros((height, width, 4), np.uint8)
-    out = np.ones((height, width, 4), np.uint8) * 255
-    mask[:, :, 3] = 255
+    # Draw the opening of the margin on a single channel mask
+    mask = np.zeros((rows, width), np.uint8)
 
     # Draw the margin based on the margin_type.
     if margin_type == "Circle":
         # Calculate the center and radius of the circle.
         radius = math.floor(min(width, height) / 2) - spacing_circle
-        center = (math.floor(width / 2), math.floor(height / 2))
+        center = (math.floor(width / 2), math.floor(height / 2) - top)
         # Draw a filled circle on the mask.
-        cv2.circle(mask, center, radius, (255, 255, 255, 255), thickness=-1)
+        cv2.circle(mask, center, radius, 255, thickness=-1)
 
     if margin_type == "Window":
         # Calculate the center and radius of the inner circle.
         radius = math.floor(min(width, height) / 2) - spacing_window
         center = (
             math.floor(width / 2),
-            math.floor(height / 2) - spacing_window,
+            math.floor(height / 2) - spacing_window - top,
         )
         # Draw a filled circle on the mask.
-        cv2.circle(mask, center, radius, (255, 255, 255, 255), thickness=-1)
+        cv2.circle(mask, center, radius, 255, thickness=-1)
         # Draw a filled rectangle on the mask.
         top_left = (center[0] - radius, center[1])
         bottom_right = (
             center[0] + radius,
             center[1] + math.floor(radius * 1.5),
         )
-        cv2.rectangle(mask, top_left, bottom_right, (255, 255, 255, 255), -1)
+        cv2.rectangle(mask, top_left, bottom_right, 255, -1)
 
-    # Copy the input image onto the output image where the mask is white.
-    out[mask == 255] = image[mask == 255]
-
-    return out
+    return mask == 0
@@ -0,0 +1,116 @@
+# Paper sizes in millimeters, in portrait orientation
+PAPER_SIZES = {
+    "A5": (148, 210),
+    "A4": (210, 297),
+    "A3": (297, 420),
+    "A2": (420, 594),
+    "A1": (594, 841),
+    "Letter": (215.9, 279.4),
+    "Tabloid": (279.4, 431.8),
+}
+
+DEFAULT_PAPER = "A4"
+DEFAULT_DPI = 600
+
+# Range of resolutions accepted for an export, in dots per inch
+MIN_DPI = 72
+MAX_DPI = 1200
+
+MM_PER_INCH = 25.4
+
+# Widths in pixels of the smaller copies that can be saved with an export,
+# by the suffix of their file name: a web version and a thumbnail
+COPY_WIDTHS = {"web": 1600, "thumbnail": 400}
+
+
+def export_size(paper, dpi):
+    """
+    Computes the size in pixels of an export printed on a paper size at a
+    given resolution.
+
+    Args:
+        paper (str): The name of the paper size, a key of PAPER_SIZES.
+        dpi (int): The resolution of the print in dots per inch.
+
+    Returns:
+        Tuple[int, int]: The width and height of the export in pixels.
+    """
+    if paper not in PAPER_SIZES:
+        raise ValueError("Unknown paper size: {}".format(paper))
+    if not MIN_DPI <= dpi <= MAX_DPI:
+        raise ValueError(
+            "The resolution must be between {} and {} DPI".format(
+                MIN_DPI, MAX_DPI
+            )
+        )
+
+    width, height = PAPER_SIZES[paper]
+
+    return (
+        round(width / MM_PER_INCH * dpi),
+        round(height / MM_PER_INCH * dpi),
+    )
+
+
+# Memory a whole render may use before exports switch to strips, in bytes
+MEMORY_BUDGET = 512 * 2**20
+
+# Number of rows of each strip of an export rendered by strips
+STRIP_HEIGHT = 256
+
+# Bytes per pixel of a whole render. Coloring gathers the BGRA image (4)
+# from the labels (1) through 8 byte indices (8), and the texture and margin
+# masks and the blend and encoder bands add the rest. The traced peak of a
+# whole A4 render at 600 DPI is 17 bytes per pixel
+RENDER_BYTES_PER_PIXEL = 18
+
+
+def estimate_memory(width, height, strip_height=None):
+    """
+    Estimates the memory needed to render an image, as a whole or by strips.
+
+    Args:
+        width (int): The width of the image.
+        height (int): The height of the image.
+        strip_height (int, optional): The number of rows of each strip. The
+            image is rendered as a whole if None.
+
+    Returns:
+        int: The estimated memory in bytes.
+    """
+    if strip_height is not None:
+        height = min(strip_height, height)
+
+    return width * height * RENDER_BYTES_PER_PIXEL
+
+
+def use_strips(width, height, memory_budget=MEMORY_BUDGET):
+    """
+    Tells whether an image must be rendered by strips to fit in the memory
+    budget.
+
+    Args:
+        width (int): The width of the image.
+        height (int): The height of the image.
+        memory_budget (int): The memory a whole render may use, in bytes.
+
+    Returns:
+        bool: True if rendering the whole image exceeds the budget.
+    """
+    return estimate_memory(width, height) > memory_budget
+
+
+def iter_strips(height, strip_height=STRIP_HEIGHT):
+    """
+    Splits the rows of an image into strips.
+
+    Args:
+        height (int): The height of the image.
+        strip_height (int): The number of rows of each strip.
+
+    Yields:
+        Tuple[int, int]: The first row and the number of rows of each strip,
+        from the top of the image to the bottom.
+    """
+    for top in range(0, height, strip_height):
+        yield top, min(strip_height, height - top)
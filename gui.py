@@ -1,127 +1,43 @@
-import cv2
 import math
+import os
+import threading
+
 import numpy as np
 from PyQt5 import QtCore, QtGui, QtWidgets
 
-from drawing_utils import (
-    apply_texture,
-    generate_image,
-    generate_mountains,
-    smooth_mountains,
-    draw_sun,
-    normalize_mountains,
-    draw_mountains,
-    draw_margin,
+from export import (
+    COPY_WIDTHS,
+    DEFAULT_DPI,
+    DEFAULT_PAPER,
+    MAX_DPI,
+    MIN_DPI,
+    PAPER_SIZES,
+    export_size,
+)
+from landscape import (
+    COLOR_PALETTES,
+    HEIGHT,
+    MARGIN_OPTIONS,
+    SKY_ELEMENT_OPTIONS,
+    TEX,
+    TEX_ALPHA,
+    TEX_LOW,
+    WIDTH,
+    LandscapeConfig,
+    save_pyramid,
 )
+from midpoint_displacement import new_seed
+from preview import PreviewFrame, PreviewRenderer
+from smoothing import SMOOTHING_KERNELS
+from terrain_engines import DEFAULT_ENGINE, ENGINES
+from drawing_utils import MOUNTAIN_RENDERERS, BufferPool
+from writers import COMPRESSION_LEVEL, DEFAULT_QUALITY, EncodeOptions
 
-# Image Resolution
-WIDTH = 2480
-HEIGHT = 3508
-
-# Color Palettes
-COLOR_PALETTES = {
-    "Terracotta": {
-        "sun": (60, 83, 147, 255),
-        "sky": (163, 196, 220, 255),
-        "land": [
-            (106, 122, 171, 255),
-            (100, 100, 100, 255),
-            (25, 34, 44, 255),
-        ],
-    },
-    "Desert": {
-        "sun": (125, 187, 227, 255),
-        "sky": (175, 206, 229, 255),
-        "land": [(44, 67, 129, 255)],
-    },
-    "Retro": {
-        "sun": (201, 222, 237, 255),
-        "sky": (210, 182, 88, 255),
-        "land": [
-            (50, 59, 222, 255),
-            (38, 87, 228, 255),
-            (26, 138, 232, 255),
-            (60, 166, 237, 255),
-        ],
-    },
-    "Candy": {
-        "sun": (194, 176, 187, 255),
-        "sky": (169, 143, 209, 255),
-        "land": [
-            (55, 96, 168, 255),
-            (102, 138, 215, 255),
-            (144, 170, 206, 255),
-            (93, 104, 214, 255),
-            (84, 82, 189, 255),
-        ],
-    },
-    "Gold": {
-        "sun": (58, 148, 201, 255),
-        "sky": (179, 201, 206, 255),
-        "land": [(66, 59, 116, 255), (45, 90, 163, 255), (101, 124, 180, 255)],
-    },
-    "Night": {
-        "sun": (239, 249, 237, 255),
-        "sky": (30, 25, 27, 255),
-        "land": [
-            (149, 140, 142, 255),
-            (207, 220, 246, 255),
-            (74, 76, 86, 255),
-            (138, 150, 206, 255),
-            (240, 245, 248, 255),
-            (207, 215, 186, 255),
-        ],
-    },
-    "Forest": {
-        "sun": (181, 263, 245, 255),
-        "sky": (148, 230, 201, 255),
-        "land": [(37, 30, 15, 255)],
-    },
-    "Vintage": {
-        "sun": (171, 189, 220, 255),
-        "sky": (71, 63, 63, 255),
-        "land": [
-            (60, 170, 242, 255),
-            (171, 189, 220, 255),
-            (74, 88, 82, 255),
-            (103, 141, 173, 255),
-            (57, 114, 196, 255),
-        ],
-    },
-    "Peach": {
-        "sun": (106, 141, 210, 255),
-        "sky": (226, 235, 244, 255),
-        "land": [
-            (147, 183, 217, 255),
-            (118, 136, 190, 255),
-            (106, 141, 210, 255),
-            (110, 125, 169, 255),
-        ],
-    },
-    "Summer": {
-        "sun": (95, 139, 234, 255),
-        "sky": (245, 240, 255, 255),
-        "land": [(147, 166, 87, 255)],
-    },
-    "Tropical": {
-        "sun": (205, 186, 245, 255),
-        "sky": (226, 231, 235, 255),
-        "land": [(150, 196, 77, 255)],
-    },
-    "Mono": {
-        "sun": (101, 134, 197, 255),
-        "sky": (101, 134, 197, 255),
-        "land": [(101, 134, 197, 255), (101, 134, 197, 255)],
-    },
-}
-
-# Combobox options
-MARGIN_OPTIONS = ["None", "Circle", "Window"]
-SKY_ELEMENT_OPTIONS = ["Sun", "Moon"]
-
-# Textures
-TEX = "img/texture.jpg"
-TEX_LOW = "img/texture_low.jpg"
+# Preview resolution
+PREVIEW_SIZE = (496, 702)
+
+# Formats of the saved image, and their extension
+SAVE_FORMATS = {"PNG": ".png", "JPEG": ".jpg", "WebP": ".webp", "TIFF": ".tif"}
 
 # Buttons style
 STYLE = (
@@ -132,6 +48,276 @@ STYLE = (
 )
 
 
+class RenderSignals(QtCore.QObject):
+    """
+    The signals of the preview renders, emitted from the render thread and
+    received on the thread of the user interface.
+    """
+
+    # Request number, index of the frame, status message and stage report
+    finished = QtCore.pyqtSignal(int, int, str, str)
+
+    # Request number and error message
+    failed = QtCore.pyqtSignal(int, str)
+
+
+class RenderTask(QtCore.QRunnable):
+    """
+    Renders the preview of a config on a thread of a thread pool, into a
+    frame that is not on display.
+    """
+
+    def __init__(self, renderer, request, config, frame, index, signals):
+        """
+        Attributes:
+            __renderer (PreviewRenderer): The renderer of the preview.
+            __request (int): The number of the render request.
+            __config (LandscapeConfig): The settings to render, which nothing
+                else modifies.
+            __frame (PreviewFrame): The frame to render into.
+            __index (int): The index of the frame.
+            __signals (RenderSignals): The signals reporting the render.
+
+        Args:
+            renderer (PreviewRenderer): The renderer of the preview.
+            request (int): The number of the render request.
+            config (LandscapeConfig): The settings to render.
+            frame (PreviewFrame): The frame to render into.
+            index (int): The index of the frame.
+            signals (RenderSignals): The signals reporting the render.
+        """
+        super().__init__()
+        self.__renderer = renderer
+        self.__request = request
+        self.__config = config
+        self.__frame = frame
+        self.__index = index
+        self.__signals = signals
+
+    def run(self):
+        """
+        Renders the preview straight into the pixels of the frame.
+        """
+        try:
+            self.__renderer.render(self.__config, self.__frame)
+        except Exception as error:
+            self.__signals.failed.emit(self.__request, str(error))
+            return
+
+        self.__signals.finished.emit(
+            self.__request, self.__index, *self.__renderer.stats()
+        )
+
+
+class ExportCancelled(Exception):
+    """
+    Raised from the progress callback of an export to stop it.
+    """
+
+
+class ExportSignals(QtCore.QObject):
+    """
+    The signals of the exports, emitted from the export thread and received
+    on the thread of the user interface.
+    """
+
+    # Export number, stage, steps done and number of steps
+    progress = QtCore.pyqtSignal(int, str, int, int)
+
+    # Export number and status message
+    finished = QtCore.pyqtSignal(int, str)
+
+    # Export number and error message
+    failed = QtCore.pyqtSignal(int, str)
+
+    # Export number
+    cancelled = QtCore.pyqtSignal(int)
+
+
+class ExportTask(QtCore.QRunnable):
+    """
+    Renders and saves an export and its copies on a thread of a thread pool.
+    The files are written under a temporary name first, so that a cancelled
+    or failed export never leaves a file that looks finished.
+    """
+
+    def __init__(
+        self, export, config, path, copies, options, buffers, signals
+    ):
+        """
+        Attributes:
+            __export (int): The number of the export.
+            __config (LandscapeConfig): The settings to export, a snapshot
+                that later edits of the interface do not change.
+            __path (str): The path of the image.
+            __copies (List[Tuple[int, str]]): The width and the path of each
+                smaller copy of the image.
+            __options (EncodeOptions): The settings of the encoder.
+            __buffers (BufferPool): The reusable buffers of the exports,
+                only used by one export at a time.
+            __signals (ExportSignals): The signals reporting the export.
+            __cancelled (threading.Event): Set when the export is cancelled.
+
+        Args:
+            export (int): The number of the export.
+            config (LandscapeConfig): The settings to export.
+            path (str): The path of the image.
+            copies (List[Tuple[int, str]]): The width and the path of each
+                copy.
+            options (EncodeOptions): The settings of the encoder.
+            buffers (BufferPool): The reusable buffers of the exports.
+            signals (ExportSignals): The signals reporting the export.
+        """
+        super().__init__()
+        self.__export = export
+        self.__config = config
+        self.__path = path
+        self.__copies = copies
+        self.__options = options
+        self.__buffers = buffers
+        self.__signals = signals
+        self.__cancelled = threading.Event()
+
+    def cancel(self):
+        """
+        Stops the export before its next stage, or before it starts if it is
+        still queued.
+        """
+        self.__cancelled.set()
+
+    def run(self):
+        """
+        Saves the image and its copies from a single render, then gives the
+        files their final name.
+        """
+        paths = [self.__path] + [path for _, path in self.__copies]
+        partial_paths = []
+        for path in paths:
+            root, extension = os.path.splitext(path)
+            partial_paths.append(root + ".partial" + extension)
+        try:
+            self.__progress("starting", 0, 1)
+            self.__buffers.begin_render()
+            stats = save_pyramid(
+                self.__config,
+                partial_paths[0],
+                [
+                    (width, partial_path)
+                    for (width, _), partial_path in zip(
+                        self.__copies, partial_paths[1:]
+                    )
+                ],
+                self.__buffers,
+                progress=self.__progress,
+                options=self.__options,
+            )
+            self.__buffers.end_render()
+            if self.__cancelled.is_set():
+                raise ExportCancelled()
+            for partial_path, path in zip(partial_paths, paths):
+                os.replace(partial_path, path)
+        except ExportCancelled:
+            self.__remove(partial_paths)
+            self.__signals.cancelled.emit(self.__export)
+            return
+        except Exception as error:
+            self.__remove(partial_paths)
+            self.__signals.failed.emit(self.__export, str(error))
+            return
+
+        message = (
+            "Saved {}x{} image to {}{}, new buffers {:.1f} MB, encoded {} "
+            "in {:.2f} s, {:.1f} MB".format(
+                self.__config.width,
+                self.__config.height,
+                self.__path,
+                " with {} copies".format(len(self.__copies))
+                if self.__copies
+                else "",
+                self.__buffers.allocated_bytes / 2**20,
+                stats[0].format,
+                sum(file_stats.seconds for file_stats in stats),
+                sum(file_stats.bytes for file_stats in stats) / 2**20,
+            )
+        )
+        if self.__buffers.peak_bytes is not None:
+            message += ", peak {:.1f} MB".format(
+                self.__buffers.peak_bytes / 2**20
+            )
+        self.__signals.finished.emit(self.__export, message)
+
+    def __progress(self, stage, step, steps):
+        """
+        Reports the stage about to run, or stops the export if it was
+        cancelled.
+
+        Args:
+            stage (str): The name of the stage.
+            step (int): The number of steps done.
+            steps (int): The number of steps of the export.
+        """
+        if self.__cancelled.is_set():
+            raise ExportCancelled()
+        self.__signals.progress.emit(self.__export, stage, step, steps)
+
+    def __remove(self, paths):
+        """
+        Removes incomplete files, those that were created.
+
+        Args:
+            paths (List[str]): The paths of the files.
+        """
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class PreviewWidget(QtWidgets.QWidget):
+    """
+    Displays the preview by painting a QImage directly, without converting
+    it to a pixmap first.
+    """
+
+    def __init__(self, width, height):
+        """
+        Attributes:
+            __image (QtGui.QImage): The image on display, None before the
+                first preview.
+
+        Args:
+            width (int): The width of the preview.
+            height (int): The height of the preview.
+        """
+        super().__init__()
+        self.__image = None
+        self.setFixedSize(width, height)
+
+    def set_image(self, image):
+        """
+        Displays an image, painted with the next paint event.
+
+        Args:
+            image (QtGui.QImage): The image to display, which must stay
+                unchanged while on display.
+        """
+        self.__image = image
+        self.update()
+
+    def paintEvent(self, event):
+        """
+        Paints the area of the image that needs to be painted.
+
+        Args:
+            event (QtGui.QPaintEvent): The paint event.
+        """
+        if self.__image is None:
+            return
+
+        painter = QtGui.QPainter(self)
+        painter.drawImage(event.rect(), self.__image, event.rect())
+        painter.end()
+
+
 class CreateLandscapeGUI(QtWidgets.QMainWindow):
     """
     A graphical user interface for generating landscape images with
@@ -146,15 +332,24 @@ class CreateLandscapeGUI(QtWidgets.QMainWindow):
     def __init__(self):
         """
         Attributes:
-            __image (np.ndarray): The current landscape image as a numpy array.
+            __frames (List[Tuple[QtGui.QImage, PreviewFrame]]): The two
+                images of the preview, which own their pixels, and the frames
+                over the same pixels that the renders draw into. One is on
+                display while the next preview is rendered into the other.
+            __front (int): The index of the frame on display, None before
+                the first preview.
             __sky_color (Tuple[): The RGB color of the sky background.
             __sun_color (Tuple): The RGB color of the sun.
             __sun_radius (int): The radius of the sun in pixels.
             __white_contour (bool): Whether to draw a white contour around the
                 sun.
             __sky_element (bool): Whether to draw an element in the sky.
-            __mountains (List[float]): The initial generated mountain heights.
-            __smoothed_mountains (List[float]): The smoothed mountain heights.
+            __seed (int): The seed the current mountains were generated with.
+            __engine (str): The terrain engine used to generate the mountains.
+            __generation (Tuple): The number of layers, the roughness, the
+                decrease roughness flag and the terrain engine the current
+                mountains were generated with, None before any generation.
+            __smoothing_kernel (str): The kernel used to smooth the mountains.
             __land_color (List): The colors of the land gradient.
             __gradient_color (Tuple): The current selected color for the land.
             __color_palette (str): The current selected color palette.
@@ -165,13 +360,45 @@ class CreateLandscapeGUI(QtWidgets.QMainWindow):
             __smooth (bool): Whether to use the smoothed mountains or the
                 initial mountains for rendering.
             __margin (str): The type of margin to apply to the final image.
+            __renderer (str): The renderer used to draw the mountains.
+            __buffers (BufferPool): The reusable buffers of the exports,
+                only used by the export thread.
+            __export_pool (QtCore.QThreadPool): The pool running the
+                exports, one after another in the order they were requested.
+            __export_signals (ExportSignals): The signals of the exports.
+            __exports (Dict[int, ExportTask]): The exports queued or running,
+                by export number.
+            __export_count (int): The number of the last export.
+            __export_progress (QtWidgets.QProgressBar): The progress of the
+                running export, hidden without exports.
+            __cancel_export_button (QtWidgets.QPushButton): The button
+                cancelling the exports, hidden without exports.
+            __preview_renderer (PreviewRenderer): The renderer of the
+                preview, only used by the render thread.
+            __render_pool (QtCore.QThreadPool): The pool running the preview
+                renders, one at a time.
+            __render_signals (RenderSignals): The signals of the renders.
+            __requested (int): The number of the last render request.
+            __displayed (int): The number of the request on display.
+            __pending (LandscapeConfig): The settings of the next render,
+                replaced by every request made while a render runs, None if
+                no request is waiting.
+            __rendering (bool): Whether a render is running.
+            __paper (str): The paper size of the exported image.
+            __dpi (int): The resolution of the exported image.
+            __quality (int): The quality of JPEG and WebP exports.
+            __compression_level (int): The deflate level of PNG and TIFF
+                exports.
+            __alpha (bool): Whether exports keep their alpha channel.
+            __save_copies (bool): Whether exports are saved with a web
+                version and a thumbnail.
             __currentMarginIndex (int): The index of the current margin option
                 in the menu.
             __center_x (int): The x-coordinate of the center of the image.
             __center_y (int): The y-coordinate of the center of the image.
             __image_name_edit (QtWidgets.QLineEdit): The line edit for entering
                 the image name.
-            __image_frame (QtWidgets.QLabel): The label for displaying the
+            __image_frame (PreviewWidget): The widget displaying the
                 landscape image preview.
         """
         super().__init__()
@@ -263,6 +490,18 @@ class CreateLandscapeGUI(QtWidgets.QMainWindow):
         generate_mountains_layout.addWidget(generate_mountains_button)
         mountains_layout.addLayout(generate_mountains_layout)
 
+        # Terrain Engine
+        engine_combobox = QtWidgets.QComboBox()
+        engine_combobox.addItems(ENGINES.keys())
+        engine_combobox.setCurrentIndex(list(ENGINES).index(self.__engine))
+        engine_combobox.currentIndexChanged[int].connect(
+            self.on_engine_changed
+        )
+        engine_layout = QtWidgets.QHBoxLayout()
+        engine_layout.addWidget(QtWidgets.QLabel("Engine"))
+        engine_layout.addWidget(engine_combobox)
+        mountains_layout.addLayout(engine_layout)
+
         padding_layout = QtWidgets.QHBoxLayout()
         padding_layout.addWidget(QtWidgets.QLabel("Padding: "))
         # Upper padding
@@ -310,6 +549,17 @@ class CreateLandscapeGUI(QtWidgets.QMainWindow):
         self.__smooth_slider.valueChanged[int].connect(self.on_smooth_changed)
         mountain_modifier_layout.addWidget(QtWidgets.QLabel("Smooth"))
         mountain_modifier_layout.addWidget(self.__smooth_slider)
+
+        # Smoothing kernel
+        smoothing_kernel_combobox = QtWidgets.QComboBox()
+        smoothing_kernel_combobox.addItems(SMOOTHING_KERNELS)
+        smoothing_kernel_combobox.setCurrentIndex(
+            SMOOTHING_KERNELS.index(self.__smoothing_kernel)
+        )
+        smoothing_kernel_combobox.currentIndexChanged[int].connect(
+            self.on_smoothing_kernel_changed
+        )
+        mountain_modifier_layout.addWidget(smoothing_kernel_combobox)
         mountains_layout.addLayout(mountain_modifier_layout)
         mountain_group.setLayout(mountains_layout)
 
@@ -422,16 +672,87 @@ class CreateLandscapeGUI(QtWidgets.QMainWindow):
         margin_layout.addWidget(label)
         margin_layout.addWidget(margin_combobox)
         details_layout.addLayout(margin_layout)
+
+        # Mountain Renderer
+        renderer_combobox = QtWidgets.QComboBox()
+        renderer_combobox.addItems(MOUNTAIN_RENDERERS)
+        renderer_combobox.setCurrentIndex(
+            MOUNTAIN_RENDERERS.index(self.__renderer)
+        )
+        renderer_combobox.currentIndexChanged[int].connect(
+            self.on_renderer_changed
+        )
+        renderer_layout = QtWidgets.QHBoxLayout()
+        label = QtWidgets.QLabel("Renderer")
+        label.setFixedWidth(60)
+        renderer_layout.addWidget(label)
+        renderer_layout.addWidget(renderer_combobox)
+        details_layout.addLayout(renderer_layout)
         details_group.setLayout(details_layout)
 
         # Save Image
         save_image_layout = QtWidgets.QHBoxLayout()
         self.__image_name_edit = QtWidgets.QLineEdit(self.__image_name)
         save_image_layout.addWidget(self.__image_name_edit)
+
+        # Paper size and resolution of the exported image
+        paper_combobox = QtWidgets.QComboBox()
+        paper_combobox.addItems(PAPER_SIZES.keys())
+        paper_combobox.setCurrentIndex(list(PAPER_SIZES).index(self.__paper))
+        paper_combobox.currentIndexChanged[int].connect(self.on_paper_changed)
+        save_image_layout.addWidget(paper_combobox)
+        dpi_spinbox = QtWidgets.QSpinBox()
+        dpi_spinbox.setRange(MIN_DPI, MAX_DPI)
+        dpi_spinbox.setSuffix(" DPI")
+        dpi_spinbox.setValue(self.__dpi)
+        dpi_spinbox.valueChanged[int].connect(self.on_dpi_changed)
+        save_image_layout.addWidget(dpi_spinbox)
+
         save_image_button = QtWidgets.QPushButton("Save")
         save_image_button.clicked.connect(self.on_save_image_button_clicked)
         save_image_layout.addWidget(save_image_button)
 
+        # Format and encoder settings of the exported image
+        encoder_layout = QtWidgets.QHBoxLayout()
+        format_combobox = QtWidgets.QComboBox()
+        format_combobox.addItems(SAVE_FORMATS)
+        extension = os.path.splitext(self.__image_name)[1].lower()
+        format_combobox.setCurrentIndex(
+            list(SAVE_FORMATS.values()).index(extension)
+        )
+        format_combobox.currentIndexChanged[int].connect(
+            self.on_format_changed
+        )
+        encoder_layout.addWidget(format_combobox)
+        quality_spinbox = QtWidgets.QSpinBox()
+        quality_spinbox.setRange(0, 100)
+        quality_spinbox.setPrefix("Quality ")
+        quality_spinbox.setToolTip("Quality of JPEG and WebP images")
+        quality_spinbox.setValue(self.__quality)
+        quality_spinbox.valueChanged[int].connect(self.on_quality_changed)
+        encoder_layout.addWidget(quality_spinbox)
+        compression_spinbox = QtWidgets.QSpinBox()
+        compression_spinbox.setRange(0, 9)
+        compression_spinbox.setPrefix("Compression ")
+        compression_spinbox.setToolTip("Compression of PNG and TIFF images")
+        compression_spinbox.setValue(self.__compression_level)
+        compression_spinbox.valueChanged[int].connect(
+            self.on_compression_level_changed
+        )
+        encoder_layout.addWidget(compression_spinbox)
+        alpha_checkbox = QtWidgets.QCheckBox("Alpha")
+        alpha_checkbox.setToolTip("Keep the opaque alpha channel")
+        alpha_checkbox.setChecked(self.__alpha)
+        alpha_checkbox.stateChanged[int].connect(self.on_alpha_changed)
+        encoder_layout.addWidget(alpha_checkbox)
+        copies_checkbox = QtWidgets.QCheckBox("Web and thumbnail")
+        copies_checkbox.setToolTip(
+            "Also save smaller copies, named after the image with a suffix"
+        )
+        copies_checkbox.setChecked(self.__save_copies)
+        copies_checkbox.stateChanged[int].connect(self.on_save_copies_changed)
+        encoder_layout.addWidget(copies_checkbox)
+
         # Parameters Layout
         parameters_layout = QtWidgets.QVBoxLayout()
         parameters_layout.addWidget(sky_element_group)
@@ -439,22 +760,11 @@ class CreateLandscapeGUI(QtWidgets.QMainWindow):
         parameters_layout.addWidget(colors_group)
         parameters_layout.addWidget(details_group)
         parameters_layout.addLayout(save_image_layout)
+        parameters_layout.addLayout(encoder_layout)
 
         # Image
-        self.__image_frame = QtWidgets.QLabel()
-        self.__image = np.zeros((HEIGHT, WIDTH, 4), np.uint8)
-        self.__image[:, :] = COLOR_PALETTES[self.__color_palette]["sky"]
-        resized = cv2.resize(
-            self.__image, (496, 702), interpolation=cv2.INTER_LINEAR
-        )
-        resized = apply_texture(resized, TEX_LOW, 0.5)
-        qImage = QtGui.QImage(
-            resized.data,
-            resized.shape[1],
-            resized.shape[0],
-            QtGui.QImage.Format_ARGB32,
-        )
-        self.__image_frame.setPixmap(QtGui.QPixmap.fromImage(qImage))
+        self.__image_frame = PreviewWidget(*PREVIEW_SIZE)
+        self.__update_display()
 
         # Main Layout
         layout = QtWidgets.QHBoxLayout()
@@ -465,6 +775,18 @@ class CreateLandscapeGUI(QtWidgets.QMainWindow):
         widget.setLayout(layout)
         self.setCentralWidget(widget)
 
+        # Progress of the exports, shown while exports are queued
+        self.__export_progress = QtWidgets.QProgressBar()
+        self.__export_progress.setMaximumWidth(200)
+        self.__export_progress.hide()
+        self.statusBar().addPermanentWidget(self.__export_progress)
+        self.__cancel_export_button = QtWidgets.QPushButton("Cancel")
+        self.__cancel_export_button.clicked.connect(
+            self.on_cancel_export_button_clicked
+        )
+        self.__cancel_export_button.hide()
+        self.statusBar().addPermanentWidget(self.__cancel_export_button)
+
         self.setWindowTitle("Minimalist Landscape Generator")
 
     def __initialize_defaults(self):
@@ -479,12 +801,13 @@ class CreateLandscapeGUI(QtWidgets.QMainWindow):
         self.__mountain_layers = 3
         self.__roughness = 300
         self.__decrease_roughness = 2
-        self.__mountains = []
+        self.__seed = new_seed()
+        self.__engine = DEFAULT_ENGINE
         self.__upper_padding = 100
         self.__lower_padding = 100
         self.__mountain_intersection = 0
-        self.__smoothed_mountains = []
         self.__smooth = 0
+        self.__smoothing_kernel = "Box"
         self.__color_palette = "Desert"
         self.__sky_color = COLOR_PALETTES[self.__color_palette]["sky"]
         self.__sun_color = COLOR_PALETTES[self.__color_palette]["sun"]
@@ -492,7 +815,37 @@ class CreateLandscapeGUI(QtWidgets.QMainWindow):
         self.__land_color = COLOR_PALETTES[self.__color_palette]["land"]
         self.__white_contour = 0
         self.__margin = "None"
+        self.__renderer = "Polygon"
+        self.__buffers = BufferPool()
+        self.__export_pool = QtCore.QThreadPool()
+        self.__export_pool.setMaxThreadCount(1)
+        self.__export_signals = ExportSignals()
+        self.__export_signals.progress.connect(self.__on_export_progress)
+        self.__export_signals.finished.connect(self.__on_export_finished)
+        self.__export_signals.failed.connect(self.__on_export_failed)
+        self.__export_signals.cancelled.connect(self.__on_export_cancelled)
+        self.__exports = {}
+        self.__export_count = 0
+        self.__preview_renderer = PreviewRenderer()
+        self.__render_pool = QtCore.QThreadPool()
+        self.__render_pool.setMaxThreadCount(1)
+        self.__render_signals = RenderSignals()
+        self.__render_signals.finished.connect(self.__on_render_finished)
+        self.__render_signals.failed.connect(self.__on_render_failed)
+        self.__frames = [self.__create_frame() for _ in range(2)]
+        self.__front = None
+        self.__requested = 0
+        self.__displayed = 0
+        self.__pending = None
+        self.__rendering = False
         self.__image_name = "myLandscape.png"
+        self.__paper = DEFAULT_PAPER
+        self.__dpi = DEFAULT_DPI
+        self.__quality = DEFAULT_QUALITY
+        self.__compression_level = COMPRESSION_LEVEL
+        self.__alpha = True
+        self.__save_copies = False
+        self.__generation = None
 
     def on_sky_element_changed(self, value):
         """
@@ -550,18 +903,27 @@ class CreateLandscapeGUI(QtWidgets.QMainWindow):
         self.__decrease_roughness = value
         self.__update_display()
 
+    def on_engine_changed(self, value):
+        """
+        Updates the terrain engine used the next time the mountains are
+        generated.
+
+        Args:
+            value (int): The index of the selected terrain engine.
+        """
+        self.__engine = list(ENGINES)[value]
+
     def on_generate_mountains_button_clicked(self):
         """
         Generate new mountains based on the current parameters and update the
         display.
         """
-        self.__mountains = generate_mountains(
-            self.__image,
+        self.__seed = new_seed()
+        self.__generation = (
             int(self.__mountain_layers_edit.text()),
             int(self.__roughness_edit.text()),
             self.__decrease_roughness,
-            WIDTH,
-            HEIGHT,
+            self.__engine,
         )
         self.__smooth = 0
         self.__smooth_slider.setValue(0)
@@ -611,16 +973,24 @@ class CreateLandscapeGUI(QtWidgets.QMainWindow):
 
     def on_smooth_changed(self, value):
         """
-        Updates the smooth value, smooths the mountains with the new smooth
-        value, and updates the display.
+        Updates the smooth value and updates the display, which smooths the
+        mountains with the new smooth value.
 
         Args:
             value (float): The new value of the smoothness slider.
         """
         self.__smooth = value
-        self.__smoothed_mountains = smooth_mountains(
-            self.__mountains, self.__smooth
-        )
+        self.__update_display()
+
+    def on_smoothing_kernel_changed(self, value):
+        """
+        Updates the kernel used to smooth the mountains and updates the
+        display, which smooths them again.
+
+        Args:
+            value (int): The index of the selected smoothing kernel.
+        """
+        self.__smoothing_kernel = SMOOTHING_KERNELS[value]
         self.__update_display()
 
     def on_color_palette_changed(self, value):
@@ -764,85 +1134,355 @@ class CreateLandscapeGUI(QtWidgets.QMainWindow):
         self.__margin = MARGIN_OPTIONS[self.__currentMarginIndex]
         self.__update_display()
 
+    def on_renderer_changed(self, value):
+        """
+        Updates the renderer used to draw the mountains and triggers an update
+        of the display.
+
+        Args:
+            value (int): The index of the selected renderer.
+        """
+        self.__renderer = MOUNTAIN_RENDERERS[value]
+        self.__update_display()
+
+    def on_paper_changed(self, value):
+        """
+        Updates the paper size of the exported image.
+
+        Args:
+            value (int): The index of the selected paper size.
+        """
+        self.__paper = list(PAPER_SIZES)[value]
+
+    def on_dpi_changed(self, value):
+        """
+        Updates the resolution of the exported image.
+
+        Args:
+            value (int): The resolution in dots per inch.
+        """
+        self.__dpi = value
+
+    def on_format_changed(self, value):
+        """
+        Changes the extension of the image name to the selected format.
+
+        Args:
+            value (int): The index of the selected format.
+        """
+        root = os.path.splitext(self.__image_name_edit.text())[0]
+        self.__image_name_edit.setText(
+            root + list(SAVE_FORMATS.values())[value]
+        )
+
+    def on_quality_changed(self, value):
+        """
+        Updates the quality of JPEG and WebP exports.
+
+        Args:
+            value (int): The quality, from 0 to 100.
+        """
+        self.__quality = value
+
+    def on_compression_level_changed(self, value):
+        """
+        Updates the compression level of PNG and TIFF exports.
+
+        Args:
+            value (int): The deflate level, from 0 to 9.
+        """
+        self.__compression_level = value
+
+    def on_alpha_changed(self, value):
+        """
+        Updates whether exports keep their alpha channel.
+
+        Args:
+            value (int): The state of the checkbox.
+        """
+        self.__alpha = bool(value)
+
+    def on_save_copies_changed(self, value):
+        """
+        Updates whether exports are saved with smaller copies.
+
+        Args:
+            value (int): The state of the checkbox.
+        """
+        self.__save_copies = bool(value)
+
     def on_save_image_button_clicked(self, value):
         """
         Saves the generated landscape image with the chosen file name and
-        format.
+        format. The scene is rasterized again at the resolution of the chosen
+        paper size and DPI, with mountains generated at that width from the
+        same seed. Exports too large for the memory budget are rendered and
+        written by strips.
+
+        The export runs on the export thread with a snapshot of the current
+        settings, so the settings can be edited while it runs. Exports
+        requested while another one runs are queued. The web version and
+        the thumbnail, if asked, are derived from the same render.
 
         Args:
             value (str): The chosen file name and format for the saved image.
         """
-        image = self.__image
-        resized = cv2.resize(
-            image, (4960, 7016), interpolation=cv2.INTER_LINEAR
+        config = self.__config(*export_size(self.__paper, self.__dpi))
+        path = self.__image_name_edit.text()
+        copies = []
+        if self.__save_copies:
+            root, extension = os.path.splitext(path)
+            copies = [
+                (width, "{}_{}{}".format(root, name, extension))
+                for name, width in COPY_WIDTHS.items()
+                if width < config.width
+            ]
+
+        self.__export_count += 1
+        task = ExportTask(
+            self.__export_count,
+            config,
+            path,
+            copies,
+            EncodeOptions(
+                self.__quality, self.__compression_level, self.__alpha
+            ),
+            self.__buffers,
+            self.__export_signals,
         )
-        resized = apply_texture(resized, TEX, 0.5)
-        cv2.imwrite(self.__image_name_edit.text(), resized)
-
-    def __update_display(self):
+        self.__exports[self.__export_count] = task
+        self.__export_pool.start(task)
+        if len(self.__exports) == 1:
+            self.__export_progress.setRange(0, 1)
+            self.__export_progress.setValue(0)
+            self.__export_progress.setFormat("Queued")
+            self.__export_progress.show()
+            self.__cancel_export_button.show()
+
+    def on_cancel_export_button_clicked(self):
         """
-        Updates the display with the latest configuration.
-        This function generates an image using the current configuration
-        parameters and displays it in the GUI.
+        Cancels the running export and the queued ones.
         """
+        for task in self.__exports.values():
+            task.cancel()
+        self.statusBar().showMessage("Cancelling exports")
 
-        # Generate Image
-        self.__image = generate_image(WIDTH, HEIGHT, self.__sky_color)
+    def __on_export_progress(self, export, stage, step, steps):
+        """
+        Shows the stage of the running export.
 
-        # Draw sun
-        draw_sun(
-            self.__image,
-            self.__sun_radius,
-            self.__center_x,
-            self.__center_y,
-            self.__sun_color,
-            self.__white_contour,
-            self.__sky_element,
+        Args:
+            export (int): The number of the export.
+            stage (str): The name of the stage about to run.
+            step (int): The number of steps done.
+            steps (int): The number of steps of the export.
+        """
+        self.__export_progress.setRange(0, steps)
+        self.__export_progress.setValue(step)
+        queued = len(self.__exports) - 1
+        self.__export_progress.setFormat(
+            "{} %p%".format(stage)
+            + (", {} queued".format(queued) if queued else "")
         )
 
-        # Get mountains based on smooth flag
-        mountains = (
-            self.__smoothed_mountains if self.__smooth else self.__mountains
-        )
+    def __on_export_finished(self, export, message):
+        """
+        Shows that an export was saved.
+
+        Args:
+            export (int): The number of the export.
+            message (str): The description of the saved image.
+        """
+        self.__end_export(export)
+        self.statusBar().showMessage(message)
+
+    def __on_export_failed(self, export, error):
+        """
+        Shows the error of a failed export.
+
+        Args:
+            export (int): The number of the export.
+            error (str): The error message.
+        """
+        self.__end_export(export)
+        self.statusBar().showMessage("Export failed: {}".format(error))
+
+    def __on_export_cancelled(self, export):
+        """
+        Shows that an export was cancelled.
 
-        # Normalize mountains based on padding and intersection
-        normalize_mountains(
-            mountains,
-            HEIGHT,
-            self.__lower_padding,
-            self.__upper_padding,
-            self.__mountain_intersection,
+        Args:
+            export (int): The number of the export.
+        """
+        self.__end_export(export)
+        self.statusBar().showMessage("Export cancelled")
+
+    def __end_export(self, export):
+        """
+        Forgets a finished export, and hides the progress once no export is
+        left.
+
+        Args:
+            export (int): The number of the export.
+        """
+        del self.__exports[export]
+        if not self.__exports:
+            self.__export_progress.hide()
+            self.__cancel_export_button.hide()
+
+    def __update_display(self):
+        """
+        Requests a render of the preview with the latest configuration.
+        The preview is rendered on the render thread, so the interface never
+        waits for it. Requests made while a render runs are coalesced, only
+        the latest one is rendered once the running render finishes.
+        """
+        self.__requested += 1
+        self.__pending = self.__config(*PREVIEW_SIZE, TEX_LOW)
+        if not self.__rendering:
+            self.__start_render()
+
+    def __start_render(self):
+        """
+        Starts rendering the pending request on the render thread, into the
+        frame that is not on display.
+        """
+        back = 1 if self.__front == 0 else 0
+        task = RenderTask(
+            self.__preview_renderer,
+            self.__requested,
+            self.__pending,
+            self.__frames[back][1],
+            back,
+            self.__render_signals,
         )
+        self.__pending = None
+        self.__rendering = True
+        self.__render_pool.start(task)
 
-        # Draw mountains
-        draw_mountains(
-            self.__image,
-            mountains,
-            WIDTH,
-            HEIGHT,
-            self.__land_color,
-            self.__sky_color,
-            self.__white_contour,
+    def __on_render_finished(self, request, index, message, report):
+        """
+        Displays a finished preview, unless a newer one is on display, and
+        starts rendering the pending request into the other frame.
+
+        Args:
+            request (int): The number of the render request.
+            index (int): The index of the frame of the preview.
+            message (str): The stages run by the render and their time.
+            report (str): The counters of every stage.
+        """
+        if request > self.__displayed:
+            self.__displayed = request
+            self.__front = index
+            self.__image_frame.set_image(self.__frames[index][0])
+            self.statusBar().showMessage(message)
+            self.statusBar().setToolTip(report)
+        self.__finish_render()
+
+    def __on_render_failed(self, request, error):
+        """
+        Shows the error of a failed render and starts rendering the pending
+        request.
+
+        Args:
+            request (int): The number of the render request.
+            error (str): The error message.
+        """
+        self.__finish_render()
+        self.statusBar().showMessage("Preview failed: {}".format(error))
+
+    def __finish_render(self):
+        """
+        Marks the running render as finished and starts the pending one.
+        """
+        self.__rendering = False
+        if self.__pending is not None:
+            self.__start_render()
+
+    def __create_frame(self):
+        """
+        Creates an image of the size of the preview that owns its pixels,
+        and a frame over the same pixels for the renders to draw into.
+
+        Returns:
+            Tuple[QtGui.QImage, PreviewFrame]: The image and the frame.
+        """
+        width, height = PREVIEW_SIZE
+
+        # The preview is opaque, so its BGRA pixels are also premultiplied,
+        # which is the format Qt paints the fastest
+        image = QtGui.QImage(
+            width, height, QtGui.QImage.Format_ARGB32_Premultiplied
+        )
+        image.fill(QtCore.Qt.white)
+        bits = image.bits()
+        bits.setsize(image.sizeInBytes())
+        pixels = np.ndarray(
+            (height, width, 4),
+            np.uint8,
+            bits,
+            strides=(image.bytesPerLine(), 4, 1),
         )
 
-        # Draw margin if specified
-        if not self.__margin == "None":
-            self.__image = draw_margin(
-                self.__image, self.__margin, WIDTH, HEIGHT
-            )
+        return image, PreviewFrame(pixels)
 
-        # Resize and apply texture to image
-        resized = cv2.resize(
-            self.__image, (496, 702), interpolation=cv2.INTER_LINEAR
+    def closeEvent(self, event):
+        """
+        Cancels the exports and waits for the running render and export
+        before closing the window.
+
+        Args:
+            event (QtGui.QCloseEvent): The close event.
+        """
+        self.__pending = None
+        for task in self.__exports.values():
+            task.cancel()
+        self.__render_pool.waitForDone()
+        self.__export_pool.waitForDone()
+        super().closeEvent(event)
+
+    def __config(self, width, height, texture=TEX):
+        """
+        Gathers the current settings into a config of the given size.
+
+        Args:
+            width (int): The width of the image.
+            height (int): The height of the image.
+            texture (str): The path of the texture applied to the image.
+
+        Returns:
+            LandscapeConfig: The settings of the landscape.
+        """
+        # Without any generation, the landscape has no mountains
+        layers, roughness, decrease_roughness, engine = (
+            self.__generation
+            or (0, self.__roughness, self.__decrease_roughness, self.__engine)
         )
-        resized = apply_texture(resized, TEX_LOW, 0.5)
 
-        # Convert image to QImage and set it as pixmap for display
-        qImage = QtGui.QImage(
-            resized.data,
-            resized.shape[1],
-            resized.shape[0],
-            QtGui.QImage.Format_ARGB32,
+        return LandscapeConfig(
+            width=width,
+            height=height,
+            seed=self.__seed,
+            layers=layers,
+            roughness=roughness,
+            decrease_roughness=decrease_roughness,
+            engine=engine,
+            upper_padding=self.__upper_padding,
+            lower_padding=self.__lower_padding,
+            mountain_intersection=self.__mountain_intersection,
+            smooth=self.__smooth,
+            smoothing_kernel=self.__smoothing_kernel,
+            sky_element=self.__sky_element,
+            sun_radius=self.__sun_radius,
+            center_x=self.__center_x,
+            center_y=self.__center_y,
+            palette=self.__color_palette,
+            sky_color=self.__sky_color,
+            sun_color=self.__sun_color,
+            land_color=self.__land_color,
+            white_contour=self.__white_contour,
+            margin=self.__margin,
+            renderer=self.__renderer,
+            texture=texture,
+            texture_alpha=TEX_ALPHA,
         )
-        self.__image_frame.setPixmap(QtGui.QPixmap.fromImage(qImage))
-        self.__image_frame.repaint()
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class Heightmap:
+    """
+    A stack of mountain layers stored as a single contiguous array.
+
+    The heights of every layer live in one `(num_layers, width)` float32
+    array, ordered from the top layer to the bottom layer, and the minimum and
+    maximum height of each layer are computed once and cached so that the
+    normalization does not need to scan the layers again.
+    """
+
+    def __init__(self, heights, minimums=None, maximums=None):
+        """
+        Attributes:
+            heights (np.ndarray): The heights of the layers, with shape
+                (num_layers, width).
+            minimums (np.ndarray): The minimum height of each layer.
+            maximums (np.ndarray): The maximum height of each layer.
+
+        Args:
+            heights (np.ndarray): The heights of the layers, with shape
+                (num_layers, width).
+            minimums (np.ndarray, optional): The known minimum height of each
+                layer. Computed from the heights if None.
+            maximums (np.ndarray, optional): The known maximum height of each
+                layer. Computed from the heights if None.
+        """
+        self.heights = np.ascontiguousarray(heights, np.float32)
+        if minimums is None:
+            minimums = self.heights.min(axis=1)
+        if maximums is None:
+            maximums = self.heights.max(axis=1)
+        self.minimums = np.asarray(minimums, np.float32)
+        self.maximums = np.asarray(maximums, np.float32)
+
+    @classmethod
+    def empty(cls, width):
+        """
+        Creates a heightmap without any layer.
+
+        Args:
+            width (int): The width of the heightmap.
+
+        Returns:
+            Heightmap: A heightmap with zero layers.
+        """
+        return cls(np.zeros((0, width), np.float32))
+
+    @property
+    def num_layers(self):
+        """
+        int: The number of mountain layers.
+        """
+        return self.heights.shape[0]
+
+    @property
+    def width(self):
+        """
+        int: The number of heights of each layer.
+        """
+        return self.heights.shape[1]
+
+    def __len__(self):
+        return self.num_layers
+
+    def __getitem__(self, layer):
+        return self.heights[layer]
@@ -0,0 +1,1146 @@
+import argparse
+import inspect
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from export import (
+    DEFAULT_DPI,
+    MEMORY_BUDGET,
+    PAPER_SIZES,
+    STRIP_HEIGHT,
+    export_size,
+    iter_strips,
+    use_strips,
+)
+from heightmap import Heightmap
+from midpoint_displacement import new_seed
+from smoothing import SMOOTHING_KERNELS
+from terrain_engines import DEFAULT_ENGINE, ENGINES
+from writers import (
+    COMPRESSION_LEVEL,
+    DEFAULT_QUALITY,
+    EncodeOptions,
+    EncodeStats,
+    compare_encoders,
+    encode_image,
+    encode_report,
+    image_format,
+    open_image_writer,
+)
+from drawing_utils import (
+    MOUNTAIN_RENDERERS,
+    StripDownsampler,
+    apply_texture,
+    band_overlap,
+    colorize,
+    draw_margin,
+    generate_mountains,
+    normalize_mountains,
+    palette_lut,
+    rasterize_scene,
+    rasterize_sky_element,
+    resample_mountains,
+    smooth_mountains,
+)
+
+# Image Resolution, which is the resolution of the reference canvas. Sizes
+# and positions of the scene are given in pixels of this canvas
+WIDTH = 2480
+HEIGHT = 3508
+
+# Color Palettes
+COLOR_PALETTES = {
+    "Terracotta": {
+        "sun": (60, 83, 147, 255),
+        "sky": (163, 196, 220, 255),
+        "land": [
+            (106, 122, 171, 255),
+            (100, 100, 100, 255),
+            (25, 34, 44, 255),
+        ],
+    },
+    "Desert": {
+        "sun": (125, 187, 227, 255),
+        "sky": (175, 206, 229, 255),
+        "land": [(44, 67, 129, 255)],
+    },
+    "Retro": {
+        "sun": (201, 222, 237, 255),
+        "sky": (210, 182, 88, 255),
+        "land": [
+            (50, 59, 222, 255),
+            (38, 87, 228, 255),
+            (26, 138, 232, 255),
+            (60, 166, 237, 255),
+        ],
+    },
+    "Candy": {
+        "sun": (194, 176, 187, 255),
+        "sky": (169, 143, 209, 255),
+        "land": [
+            (55, 96, 168, 255),
+            (102, 138, 215, 255),
+            (144, 170, 206, 255),
+            (93, 104, 214, 255),
+            (84, 82, 189, 255),
+        ],
+    },
+    "Gold": {
+        "sun": (58, 148, 201, 255),
+        "sky": (179, 201, 206, 255),
+        "land": [(66, 59, 116, 255), (45, 90, 163, 255), (101, 124, 180, 255)],
+    },
+    "Night": {
+        "sun": (239, 249, 237, 255),
+        "sky": (30, 25, 27, 255),
+        "land": [
+            (149, 140, 142, 255),
+            (207, 220, 246, 255),
+            (74, 76, 86, 255),
+            (138, 150, 206, 255),
+            (240, 245, 248, 255),
+            (207, 215, 186, 255),
+        ],
+    },
+    "Forest": {
+        "sun": (181, 263, 245, 255),
+        "sky": (148, 230, 201, 255),
+        "land": [(37, 30, 15, 255)],
+    },
+    "Vintage": {
+        "sun": (171, 189, 220, 255),
+        "sky": (71, 63, 63, 255),
+        "land": [
+            (60, 170, 242, 255),
+            (171, 189, 220, 255),
+            (74, 88, 82, 255),
+            (103, 141, 173, 255),
+            (57, 114, 196, 255),
+        ],
+    },
+    "Peach": {
+        "sun": (106, 141, 210, 255),
+        "sky": (226, 235, 244, 255),
+        "land": [
+            (147, 183, 217, 255),
+            (118, 136, 190, 255),
+            (106, 141, 210, 255),
+            (110, 125, 169, 255),
+        ],
+    },
+    "Summer": {
+        "sun": (95, 139, 234, 255),
+        "sky": (245, 240, 255, 255),
+        "land": [(147, 166, 87, 255)],
+    },
+    "Tropical": {
+        "sun": (205, 186, 245, 255),
+        "sky": (226, 231, 235, 255),
+        "land": [(150, 196, 77, 255)],
+    },
+    "Mono": {
+        "sun": (101, 134, 197, 255),
+        "sky": (101, 134, 197, 255),
+        "land": [(101, 134, 197, 255), (101, 134, 197, 255)],
+    },
+}
+
+# Options of the landscape
+MARGIN_OPTIONS = ["None", "Circle", "Window"]
+SKY_ELEMENT_OPTIONS = ["Sun", "Moon"]
+
+# Textures, found next to this file so that renders work from any directory
+IMAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "img")
+TEX = os.path.join(IMAGE_DIR, "texture.jpg")
+TEX_LOW = os.path.join(IMAGE_DIR, "texture_low.jpg")
+TEX_ALPHA = 1.0
+
+# Stages of a whole render, reported to the progress callbacks
+RENDER_STAGES = ("terrain", "rasterize", "colors", "texture")
+
+
+class LandscapeConfig:
+    """
+    Every setting of a landscape, which is all a render needs.
+
+    Positions and sizes of the scene are given in pixels of the reference
+    canvas, whatever the size of the image, and colors are BGRA tuples. The
+    same config always renders the same landscape.
+    """
+
+    def __init__(
+        self,
+        width=WIDTH,
+        height=HEIGHT,
+        seed=None,
+        layers=3,
+        roughness=300,
+        decrease_roughness=True,
+        engine=DEFAULT_ENGINE,
+        upper_padding=100,
+        lower_padding=100,
+        mountain_intersection=0,
+        smooth=0,
+        smoothing_kernel="Box",
+        sky_element="Sun",
+        sun_radius=0,
+        center_x=0,
+        center_y=0,
+        palette="Desert",
+        sky_color=None,
+        sun_color=None,
+        land_color=None,
+        white_contour=False,
+        margin="None",
+        renderer="Polygon",
+        texture=TEX,
+        texture_alpha=TEX_ALPHA,
+    ):
+        """
+        Attributes:
+            width (int): The width of the image in pixels.
+            height (int): The height of the image in pixels.
+            seed (int): The seed of the mountains.
+            layers (int): The number of mountain layers, none if 0.
+            roughness (int): The roughness of the mountains.
+            decrease_roughness (bool): Whether to decrease the roughness of
+                each successive layer.
+            engine (str): The terrain engine generating the mountains.
+            upper_padding (int): The padding above the mountains.
+            lower_padding (int): The padding below the mountains.
+            mountain_intersection (float): The intersection of the mountain
+                layers, in percent.
+            smooth (int): The smoothing range of the mountains, not smoothed
+                if 0.
+            smoothing_kernel (str): The kernel smoothing the mountains.
+            sky_element (str): Either "Sun" or "Moon".
+            sun_radius (int): The radius of the sky element, none if 0.
+            center_x (int): The x-coordinate of the center of the sky element.
+            center_y (int): The y-coordinate of the center of the sky element.
+            palette (str): The color palette, a key of COLOR_PALETTES.
+            sky_color (Tuple): The color of the sky.
+            sun_color (Tuple): The color of the sky element.
+            land_color (List[Tuple]): The colors of the land gradient.
+            white_contour (bool): Whether to draw a white contour around the
+                sky element and the mountains.
+            margin (str): The margin of the image, one of MARGIN_OPTIONS.
+            renderer (str): The renderer drawing the mountains.
+            texture (str): The path of the texture applied to the image.
+            texture_alpha (float): The opacity of the texture, between 0
+                and 1.
+
+        Args:
+            The attributes. A fresh seed is drawn if the seed is None, and
+            the colors default to those of the palette.
+        """
+        for name, value, options in (
+            ("engine", engine, ENGINES),
+            ("smoothing kernel", smoothing_kernel, SMOOTHING_KERNELS),
+            ("sky element", sky_element, SKY_ELEMENT_OPTIONS),
+            ("palette", palette, COLOR_PALETTES),
+            ("margin", margin, MARGIN_OPTIONS),
+            ("mountain renderer", renderer, MOUNTAIN_RENDERERS),
+        ):
+            if value not in options:
+                raise ValueError("Unknown {}: {}".format(name, value))
+        if not 0 <= texture_alpha <= 1:
+            raise ValueError(
+                "Texture alpha must be between 0 and 1: {}".format(
+                    texture_alpha
+                )
+            )
+
+        colors = COLOR_PALETTES[palette]
+        self.width = width
+        self.height = height
+        self.seed = new_seed() if seed is None else seed
+        self.layers = layers
+        self.roughness = roughness
+        self.decrease_roughness = bool(decrease_roughness)
+        self.engine = engine
+        self.upper_padding = upper_padding
+        self.lower_padding = lower_padding
+        self.mountain_intersection = mountain_intersection
+        self.smooth = smooth
+        self.smoothing_kernel = smoothing_kernel
+        self.sky_element = sky_element
+        self.sun_radius = sun_radius
+        self.center_x = center_x
+        self.center_y = center_y
+        self.palette = palette
+        self.sky_color = tuple(sky_color or colors["sky"])
+        self.sun_color = tuple(sun_color or colors["sun"])
+        self.land_color = [
+            tuple(color) for color in land_color or colors["land"]
+        ]
+        self.white_contour = bool(white_contour)
+        self.margin = margin
+        self.renderer = renderer
+        self.texture = texture
+        self.texture_alpha = texture_alpha
+
+    @classmethod
+    def from_dict(cls, values):
+        """
+        Creates a config from a dictionary of settings, such as a JSON file.
+
+        Args:
+            values (Dict[str, Any]): The attributes to set, the others keep
+                their default value.
+
+        Returns:
+            LandscapeConfig: The config.
+        """
+        unknown = set(values) - set(inspect.signature(cls).parameters)
+        if unknown:
+            raise ValueError(
+                "Unknown settings: {}".format(", ".join(sorted(unknown)))
+            )
+
+        return cls(**values)
+
+    def to_dict(self):
+        """
+        Returns:
+            Dict[str, Any]: The attributes of the config, which `from_dict`
+            turns back into the same config.
+        """
+        return dict(vars(self))
+
+    @property
+    def scale(self):
+        """
+        float: The scale of the image relative to the reference canvas.
+        """
+        return self.width / WIDTH
+
+
+def generate_terrain(config, width=None):
+    """
+    Generates the mountains of a config, without smoothing them. The engines
+    only add detail with the width, so every width has the same mountains.
+
+    Args:
+        config (LandscapeConfig): The settings of the landscape.
+        width (int, optional): The width of the mountains. The width of the
+            image if None.
+
+    Returns:
+        Heightmap: The generated mountain heights.
+    """
+    if width is None:
+        width = config.width
+    if config.layers == 0:
+        return Heightmap.empty(width)
+
+    return generate_mountains(
+        None,
+        config.layers,
+        config.roughness,
+        config.decrease_roughness,
+        width,
+        HEIGHT,
+        config.seed,
+        config.engine,
+    )
+
+
+def smooth_terrain(config, mountains):
+    """
+    Smooths mountains with the smoothing range of a config, scaled from the
+    reference canvas to the width of the mountains.
+
+    Args:
+        config (LandscapeConfig): The settings of the landscape.
+        mountains (Heightmap): The mountains to smooth.
+
+    Returns:
+        Heightmap: The smoothed mountains, the given ones if the config does
+        not smooth them.
+    """
+    if not config.smooth:
+        return mountains
+
+    return smooth_mountains(
+        mountains,
+        round(config.smooth * mountains.width / WIDTH),
+        config.smoothing_kernel,
+    )
+
+
+def fit_terrain(config, mountains):
+    """
+    Normalizes mountains with the padding and intersection of a config, and
+    scales them from the reference canvas to the image.
+
+    Args:
+        config (LandscapeConfig): The settings of the landscape.
+        mountains (Heightmap): The mountains to draw, generated at any width
+            and smoothed.
+
+    Returns:
+        Heightmap: The mountains to rasterize.
+    """
+    mountains = normalize_mountains(
+        mountains,
+        HEIGHT,
+        config.lower_padding,
+        config.upper_padding,
+        config.mountain_intersection,
+    )
+
+    return resample_mountains(
+        mountains, config.width, config.height / HEIGHT
+    )
+
+
+def scene_sky_element(config):
+    """
+    Scales the sky element of a config from the reference canvas to the
+    image.
+
+    Args:
+        config (LandscapeConfig): The settings of the landscape.
+
+    Returns:
+        Tuple[int, int, int]: The radius and the center of the sky element.
+    """
+    return (
+        round(config.sun_radius * config.scale),
+        round(config.center_x * config.scale),
+        round(config.center_y * config.height / HEIGHT),
+    )
+
+
+def rasterize_sky(config):
+    """
+    Rasterizes the sky element of a config, to share it between bands.
+
+    Args:
+        config (LandscapeConfig): The settings of the landscape.
+
+    Returns:
+        Tuple: The sky element, as returned by `rasterize_sky_element`.
+    """
+    return rasterize_sky_element(
+        config.width,
+        config.height,
+        *scene_sky_element(config),
+        config.white_contour,
+        config.sky_element,
+        config.scale,
+    )
+
+
+def rasterize_landscape(
+    config, mountains, out=None, top=0, rows=None, sky_element_raster=None
+):
+    """
+    Rasterizes the geometry of a landscape, or a band of it.
+
+    Args:
+        config (LandscapeConfig): The settings of the landscape.
+        mountains (Heightmap): The mountains returned by `fit_terrain`.
+        out (np.ndarray, optional): The buffer to rasterize into.
+        top (int): The first row to rasterize.
+        rows (int, optional): The number of rows to rasterize. The rows of
+            the buffer, or up to the bottom of the image, if None.
+        sky_element_raster (Tuple, optional): The sky element shared by
+            several bands, rasterized from the config if None.
+
+    Returns:
+        np.ndarray: The raster of labels.
+    """
+    if rows is None and out is not None:
+        rows = out.shape[0]
+
+    return rasterize_scene(
+        config.width,
+        config.height,
+        *scene_sky_element(config),
+        config.sky_element,
+        mountains,
+        config.white_contour,
+        config.renderer,
+        out,
+        config.scale,
+        top,
+        rows,
+        sky_element_raster,
+    )
+
+
+def landscape_lut(config, num_layers):
+    """
+    Creates the lookup table of the colors of a config.
+
+    Args:
+        config (LandscapeConfig): The settings of the landscape.
+        num_layers (int): The number of mountain layers.
+
+    Returns:
+        np.ndarray: The table of BGRA colors indexed by label.
+    """
+    return palette_lut(
+        config.sky_color, config.sun_color, config.land_color, num_layers
+    )
+
+
+def colorize_landscape(config, labels, num_layers, out=None, top=0):
+    """
+    Colors a raster of labels with the colors of a config and draws its
+    margin.
+
+    Args:
+        config (LandscapeConfig): The settings of the landscape.
+        labels (np.ndarray): The raster of labels to color, which can be a
+            band of the image.
+        num_layers (int): The number of mountain layers.
+        out (np.ndarray, optional): The buffer to color into.
+        top (int): The row of the image where the band starts.
+
+    Returns:
+        np.ndarray: The colored image.
+    """
+    image = colorize(labels, landscape_lut(config, num_layers), out)
+
+    # Draw margin if specified
+    if not config.margin == "None":
+        draw_margin(
+            image,
+            config.margin,
+            config.width,
+            config.height,
+            config.scale,
+            top,
+        )
+
+    return image
+
+
+def render_landscape(config, buffers=None, progress=None):
+    """
+    Renders a whole landscape, with mountains generated at the width of the
+    image.
+
+    Args:
+        config (LandscapeConfig): The settings of the landscape.
+        buffers (BufferPool, optional): The pool to render into. New arrays
+            are allocated if None.
+        progress (Callable, optional): Called with the name of each stage of
+            RENDER_STAGES, the number of stages done and the number of
+            stages, before the stage runs.
+
+    Returns:
+        np.ndarray: The BGRA image, which is a buffer of the pool if given.
+    """
+    return __render(config, buffers, progress, len(RENDER_STAGES))
+
+
+def save_landscape(
+    config,
+    path,
+    buffers=None,
+    memory_budget=MEMORY_BUDGET,
+    progress=None,
+    options=None,
+    sample=None,
+):
+    """
+    Renders a landscape and saves it, in the format of the extension of the
+    path. Images too large for the memory budget are rendered and written by
+    strips.
+
+    Args:
+        config (LandscapeConfig): The settings of the landscape.
+        path (str): The path of the image.
+        buffers (BufferPool, optional): The pool to render into.
+        memory_budget (int): The memory a whole render may use, in bytes.
+        progress (Callable, optional): Called with the name of each stage,
+            the number of steps done and the number of steps, before the
+            stage runs. An exception raised by the callback stops the
+            export, leaving the file incomplete.
+        options (EncodeOptions, optional): The settings of the encoder.
+        sample (Callable, optional): Called once the file is saved with the
+            BGRA image, or with the strip across the middle of the image if
+            it was rendered by strips, to encode it again without another
+            render.
+
+    Returns:
+        EncodeStats: The time spent encoding and the size of the file.
+    """
+    image_format(path)
+    if use_strips(config.width, config.height, memory_budget):
+        return __save_strips(
+            config, path, buffers, progress, options, sample
+        )[0]
+
+    steps = len(RENDER_STAGES) + 1
+    image = __render(config, buffers, progress, steps)
+    __report(progress, "encode", steps - 1, steps)
+    stats = encode_image(image, path, options)
+    if sample is not None:
+        sample(image)
+
+    return stats
+
+
+def save_pyramid(
+    config,
+    path,
+    copies,
+    buffers=None,
+    memory_budget=MEMORY_BUDGET,
+    progress=None,
+    options=None,
+    sample=None,
+):
+    """
+    Renders a landscape once and saves it with smaller copies of it, such
+    as a web version and a thumbnail. Each copy is downsampled from the
+    next larger one before the texture is applied, then the texture is
+    applied at the size of each file so that its grain is not blurred. The
+    files are encoded concurrently while the next copies are downsampled.
+
+    Sizes too large for the memory budget are rendered and written by
+    strips on their own. The smaller sizes are downsampled from the strips
+    of the smallest of them, and encoded while its file is finished, or
+    come from a render at the largest size that fits if every size does.
+
+    Args:
+        config (LandscapeConfig): The settings of the landscape, at the size
+            of the largest image.
+        path (str): The path of the largest image.
+        copies (List[Tuple[int, str]]): The width and the path of each copy,
+            narrower than the image. Copies keep the aspect ratio of the
+            image.
+        buffers (BufferPool, optional): The pool to render into.
+        memory_budget (int): The memory a whole render may use, in bytes.
+        progress (Callable, optional): Called with the name of each stage,
+            the number of steps done and the number of steps, as with
+            `save_landscape`. Each size rendered by strips reports its own
+            steps.
+        options (EncodeOptions, optional): The settings of the encoders.
+        sample (Callable, optional): Called with the largest image, or a
+            strip of it, once it is saved, as with `save_landscape`. The
+            copies are not sampled.
+
+    Returns:
+        List[EncodeStats]: The cost of the image, then of each copy in the
+        given order.
+    """
+    levels = __pyramid_levels(config, path, copies)
+
+    # Sizes too large for the memory budget are rendered by strips on their
+    # own, except the smallest of them, whose strips are downsampled into
+    # the sizes that fit
+    stats = [None] * len(levels)
+    while len(levels) > 1 and use_strips(*levels[1][:2], memory_budget):
+        width, height, level_path, index = levels.pop(0)
+        stats[index] = save_landscape(
+            __resize_config(config, width, height),
+            level_path,
+            buffers,
+            memory_budget,
+            progress,
+            options,
+            sample if index == 0 else None,
+        )
+    if use_strips(*levels[0][:2], memory_budget):
+        width, height, level_path, index = levels.pop(0)
+        level_stats = __save_strips(
+            __resize_config(config, width, height),
+            level_path,
+            buffers,
+            progress,
+            options,
+            sample if index == 0 else None,
+            levels,
+        )
+        indices = [index] + [level[3] for level in levels]
+        for level_index, encode_stats in zip(indices, level_stats):
+            stats[level_index] = encode_stats
+        return stats
+
+    # The stages of the render before its texture, a step per size, then
+    # the end of the encoding
+    config = __resize_config(config, *levels[0][:2])
+    rendered = len(RENDER_STAGES) - 1
+    steps = rendered + len(levels) + 1
+    image = __render_colors(config, buffers, progress, steps)
+    sampled = image if levels[0][3] == 0 else None
+    with ThreadPoolExecutor(len(levels)) as executor:
+        encodes = __encode_levels(
+            executor, image, levels, config, options, progress, rendered, steps
+        )
+        __report(progress, "encode", steps - 1, steps)
+        for index, encode in encodes.items():
+            stats[index] = encode.result()
+
+    # Sample the image once every file is encoded, so that the sample is
+    # not encoded at the same time as them
+    if sample is not None and sampled is not None:
+        sample(sampled)
+
+    return stats
+
+
+def __encode_levels(
+    executor, image, levels, config, options, progress, step, steps
+):
+    """
+    Applies the texture to the sizes of a pyramid and submits their encoding.
+    Each size is downsampled from the next larger one before the texture is
+    applied to it, then the texture is applied at the size of each file so
+    that its grain is not blurred.
+
+    Args:
+        executor (ThreadPoolExecutor): The executor encoding the files.
+        image (np.ndarray): The BGRA uint8 image at the first size, without
+            its texture. The texture is applied to it in place.
+        levels (List[Tuple[int, int, str, int]]): The width, the height, the
+            path and the index of each size, from the largest.
+        config (LandscapeConfig): The settings of the landscape.
+        options (EncodeOptions): The settings of the encoders, or None.
+        progress (Callable): The progress callback, or None. Each size is a
+            step.
+        step (int): The number of steps done before the first size.
+        steps (int): The number of steps of the task.
+
+    Returns:
+        Dict[int, Future]: The encoding of each size, by index.
+    """
+    encodes = {}
+    for position, (width, height, level_path, index) in enumerate(levels):
+        __report(
+            progress,
+            "size {}x{}".format(width, height),
+            step + position,
+            steps,
+        )
+
+        # Downsample the next size before the texture is applied
+        following = None
+        if position + 1 < len(levels):
+            following = cv2.resize(
+                image, levels[position + 1][:2], interpolation=cv2.INTER_AREA
+            )
+        apply_texture(image, config.texture, config.texture_alpha)
+        encodes[index] = executor.submit(
+            encode_image, image, level_path, options
+        )
+        image = following
+
+    return encodes
+
+
+def __pyramid_levels(config, path, copies):
+    """
+    Checks the files of a pyramid and sorts them from the largest to the
+    smallest.
+
+    Args:
+        config (LandscapeConfig): The settings of the landscape.
+        path (str): The path of the largest image.
+        copies (List[Tuple[int, str]]): The width and the path of each copy.
+
+    Returns:
+        List[Tuple[int, int, str, int]]: The width, the height, the path and
+        the index of each file, the image being the first one.
+    """
+    image_format(path)
+    levels = [(config.width, config.height, path, 0)]
+    for index, (width, copy_path) in enumerate(copies, 1):
+        image_format(copy_path)
+        if not 0 < width < config.width:
+            raise ValueError(
+                "Copies must be narrower than the image, got {}".format(width)
+            )
+        height = max(1, round(config.height * width / config.width))
+        levels.append((width, height, copy_path, index))
+
+    return sorted(levels, key=lambda level: -level[0])
+
+
+def __resize_config(config, width, height):
+    """
+    Copies a config with another size.
+
+    Args:
+        config (LandscapeConfig): The settings of the landscape.
+        width (int): The width of the copy.
+        height (int): The height of the copy.
+
+    Returns:
+        LandscapeConfig: The settings at the new size, the same config if
+        the size did not change.
+    """
+    if (width, height) == (config.width, config.height):
+        return config
+
+    return LandscapeConfig.from_dict(
+        dict(config.to_dict(), width=width, height=height)
+    )
+
+
+def __render(config, buffers, progress, steps):
+    """
+    Renders a whole landscape, reporting its stages as the first steps of a
+    longer task.
+
+    Args:
+        config (LandscapeConfig): The settings of the landscape.
+        buffers (BufferPool): The pool to render into, or None.
+        progress (Callable): The progress callback, or None.
+        steps (int): The number of steps of the task.
+
+    Returns:
+        np.ndarray: The BGRA image.
+    """
+    image = __render_colors(config, buffers, progress, steps)
+
+    __report(progress, "texture", 3, steps)
+    return apply_texture(image, config.texture, config.texture_alpha)
+
+
+def __render_colors(config, buffers, progress, steps):
+    """
+    Renders a whole landscape without its texture, reporting its stages as
+    the first steps of a longer task.
+
+    Args:
+        config (LandscapeConfig): The settings of the landscape.
+        buffers (BufferPool): The pool to render into, or None.
+        progress (Callable): The progress callback, or None.
+        steps (int): The number of steps of the task.
+
+    Returns:
+        np.ndarray: The BGRA image, without texture.
+    """
+    shape = (config.height, config.width)
+    __report(progress, "terrain", 0, steps)
+    mountains = fit_terrain(
+        config, smooth_terrain(config, generate_terrain(config))
+    )
+
+    __report(progress, "rasterize", 1, steps)
+    labels = rasterize_landscape(
+        config,
+        mountains,
+        None if buffers is None else buffers.get("labels", shape),
+    )
+    __report(progress, "colors", 2, steps)
+    return colorize_landscape(
+        config,
+        labels,
+        mountains.num_layers,
+        None if buffers is None else buffers.get("image", shape + (4,)),
+    )
+
+
+def __save_strips(
+    config, path, buffers, progress, options, sample=None, copies=()
+):
+    """
+    Renders a landscape one strip at a time and streams the strips into the
+    file, so that the memory used is bounded by the strip height and the
+    size of the copies.
+
+    Args:
+        config (LandscapeConfig): The settings of the landscape.
+        path (str): The path of the image. JPEG and WebP files are gathered
+            whole before they are encoded.
+        buffers (BufferPool, optional): The pool to render into.
+        progress (Callable): The progress callback, or None. Each strip is
+            a step, and so are the copies if any.
+        options (EncodeOptions): The settings of the encoder, or None.
+        sample (Callable, optional): Called with a copy of the strip across
+            the middle of the image once the file is saved.
+        copies (List[Tuple[int, int, str, int]]): The width, the height,
+            the path and the index in the pyramid of smaller copies, from the
+            largest. Each strip is downsampled into the largest copy before
+            the texture is applied, and the copies are encoded as with
+            `save_pyramid` while the file is finished.
+
+    Returns:
+        List[EncodeStats]: The time spent encoding and the size of the file,
+        then of each copy.
+    """
+    width, height = config.width, config.height
+    strips = list(iter_strips(height))
+    middle = None
+    steps = len(strips) + 1 + len(copies)
+    downsampler = None
+    if copies:
+        downsampler = StripDownsampler(width, height, *copies[0][:2])
+    __report(progress, "terrain", 0, steps)
+    mountains = fit_terrain(
+        config, smooth_terrain(config, generate_terrain(config))
+    )
+
+    # The sky element is shared by the strips it crosses
+    sky_element_raster = rasterize_sky(config)
+
+    # Strips are rasterized with overlapping rows above and below
+    overlap = band_overlap(config.scale)
+    labels_shape = (STRIP_HEIGHT + 2 * overlap, width)
+    image_shape = (STRIP_HEIGHT, width, 4)
+    if buffers is None:
+        labels_buffer = None
+        image_buffer = None
+    else:
+        labels_buffer = buffers.get("strip labels", labels_shape)
+        image_buffer = buffers.get("strip", image_shape)
+
+    # The copies are encoded while the writer finishes the file
+    with ThreadPoolExecutor(max(len(copies), 1)) as executor:
+        with open_image_writer(path, width, height, options) as writer:
+            for step, (top, rows) in enumerate(strips, 1):
+                __report(progress, "strips", step, steps)
+                above = min(overlap, top)
+                below = min(overlap, height - top - rows)
+                labels = rasterize_landscape(
+                    config,
+                    mountains,
+                    labels_buffer,
+                    top - above,
+                    above + rows + below,
+                    sky_element_raster,
+                )
+                image = colorize_landscape(
+                    config,
+                    labels[above : above + rows],
+                    mountains.num_layers,
+                    None if image_buffer is None else image_buffer[:rows],
+                    top,
+                )
+                if downsampler is not None:
+                    downsampler.write(image)
+                apply_texture(
+                    image, config.texture, config.texture_alpha, top, height
+                )
+                writer.write(image)
+
+                # Keep the strip across the middle, since the buffer is reused
+                if sample is not None and top <= height // 2 < top + rows:
+                    middle = image.copy()
+
+            encodes = {}
+            if copies:
+                encodes = __encode_levels(
+                    executor,
+                    downsampler.image,
+                    copies,
+                    config,
+                    options,
+                    progress,
+                    len(strips) + 1,
+                    steps,
+                )
+
+        stats = [
+            EncodeStats(
+                image_format(path),
+                writer.encode_seconds,
+                os.path.getsize(path),
+            )
+        ]
+        stats.extend(encode.result() for encode in encodes.values())
+
+    if sample is not None:
+        sample(middle)
+
+    return stats
+
+
+def __report(progress, stage, step, steps):
+    """
+    Reports the progress of a task to its callback, if any.
+
+    Args:
+        progress (Callable): The progress callback, or None.
+        stage (str): The name of the stage about to run.
+        step (int): The number of steps done.
+        steps (int): The number of steps of the task.
+    """
+    if progress is not None:
+        progress(stage, step, steps)
+
+
+def __parse_value(text):
+    """
+    Parses a command line value as JSON, or as a plain string if it is not
+    valid JSON.
+
+    Args:
+        text (str): The value.
+
+    Returns:
+        Any: The parsed value.
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def main(argv=None):
+    """
+    Renders a landscape from the command line, with the settings of a JSON
+    file overridden by the options.
+
+    Args:
+        argv (List[str], optional): The arguments. Those of the process if
+            None.
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m landscape",
+        description="Renders a landscape without the GUI.",
+    )
+    parser.add_argument("output", help="The path of the image.")
+    parser.add_argument(
+        "--config", help="A JSON file with the settings of the landscape."
+    )
+    parser.add_argument(
+        "--paper",
+        choices=PAPER_SIZES,
+        help="Sets the size of the image from a paper size and --dpi.",
+    )
+    parser.add_argument("--dpi", type=int, default=DEFAULT_DPI)
+    parser.add_argument(
+        "--copy",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("WIDTH", "PATH"),
+        help="Also saves a smaller copy of the image, derived from the same "
+        "render. Can be given several times.",
+    )
+    parser.add_argument(
+        "--quality",
+        type=int,
+        default=DEFAULT_QUALITY,
+        help="The quality of JPEG and WebP images, from 0 to 100.",
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        default=COMPRESSION_LEVEL,
+        help="The deflate level of PNG and TIFF images, from 0 to 9.",
+    )
+    parser.add_argument(
+        "--no-alpha",
+        action="store_true",
+        help="Writes the image without its alpha channel, which is opaque.",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        help="Threads compressing PNG and TIFF images, one per CPU.",
+    )
+    parser.add_argument(
+        "--compare-formats",
+        action="store_true",
+        help="Also encodes the render in every format and prints the time "
+        "and size of each one.",
+    )
+    parser.add_argument(
+        "--save-config",
+        help="Writes the settings of the render, with its seed, to a JSON "
+        "file.",
+    )
+
+    # Every setting of the config is also an option, given as JSON
+    for name in inspect.signature(LandscapeConfig).parameters:
+        parser.add_argument(
+            "--" + name.replace("_", "-"),
+            dest=name,
+            type=__parse_value,
+            default=argparse.SUPPRESS,
+        )
+    args = vars(parser.parse_args(argv))
+    output = args.pop("output")
+    config_path = args.pop("config")
+    paper = args.pop("paper")
+    dpi = args.pop("dpi")
+    save_config = args.pop("save_config")
+    compare_formats = args.pop("compare_formats")
+    copies = args.pop("copy")
+    encoder_settings = {
+        name: args.pop(name)
+        for name in ("quality", "compression_level", "threads")
+    }
+    encoder_settings["alpha"] = not args.pop("no_alpha")
+
+    values = {}
+    if config_path is not None:
+        with open(config_path) as file:
+            values = json.load(file)
+    values.update(args)
+    if paper is not None:
+        values["width"], values["height"] = export_size(paper, dpi)
+
+    try:
+        config = LandscapeConfig.from_dict(values)
+        options = EncodeOptions(**encoder_settings)
+        copies = [(int(width), path) for width, path in copies]
+        __pyramid_levels(config, output, copies)
+    except (TypeError, ValueError) as error:
+        parser.error(str(error))
+    # Compare the formats on the image just saved rather than on another
+    # render, which could exceed the memory budget
+    samples = []
+    stats, *copy_stats = save_pyramid(
+        config,
+        output,
+        copies,
+        options=options,
+        sample=samples.append if compare_formats else None,
+    )
+    if save_config is not None:
+        with open(save_config, "w") as file:
+            json.dump(config.to_dict(), file, indent=4)
+    print(
+        "Saved {}x{} landscape with seed {} to {}, encoded {} in {:.2f} s, "
+        "{:.2f} MB".format(
+            config.width,
+            config.height,
+            config.seed,
+            output,
+            stats.format,
+            stats.seconds,
+            stats.bytes / 2**20,
+        )
+    )
+    for (width, path), file_stats in zip(copies, copy_stats):
+        print(
+            "Saved {} pixels wide copy to {}, encoded {} in {:.2f} s, "
+            "{:.2f} MB".format(
+                width,
+                path,
+                file_stats.format,
+                file_stats.seconds,
+                file_stats.bytes / 2**20,
+            )
+        )
+
+    if compare_formats:
+        sample = samples[0]
+        if sample.shape[0] < config.height:
+            print(
+                "Comparing formats on the middle {} rows, as the image was "
+                "rendered by strips".format(sample.shape[0])
+            )
+        with tempfile.TemporaryDirectory() as directory:
+            print(
+                encode_report(compare_encoders(sample, directory, options))
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
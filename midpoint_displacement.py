@@ -1,134 +1,261 @@
-import random
 import numpy as np
-from collections import deque
 
+# Number of displacements drawn from each random stream of a progressive
+# terrain level
+BLOCK_SIZE = 4096
 
-def run_midpoint_displacement(roughness, width, height):
+# Default number of heights of each chunk of a streamed terrain
+CHUNK_SIZE = 4096
+
+
+def new_seed():
+    """
+    Draws a fresh seed from the operating system entropy.
+
+    Returns:
+        int: A seed that can be stored to reproduce a render.
+    """
+    return np.random.SeedSequence().entropy
+
+
+def run_midpoint_displacement(roughness, width, height, seed=None, layer=0):
     """
     Generates a 1D height map using the midpoint displacement algorithm.
 
+    The heights are those of `iter_midpoint_displacement`, gathered into a
+    single array, so the same seed and layer always give the same terrain.
+
     Args:
         roughness (float): The initial roughness of the terrain. Smaller values
             produce smoother terrain.
         width (int): The width of the terrain.
         height (int): The height of the terrain.
+        seed (int, optional): The seed of the landscape. If None, fresh
+            entropy is used.
+        layer (int): The index of the layer within the landscape.
 
     Returns:
-        A 1D list representing the heights of the terrain.
+        np.ndarray: A contiguous float array of `width + 1` terrain heights.
     """
-    # Initialize the heights and points to process queue
-    heights, points_to_process = __initialize_data(width, height, roughness)
+    if seed is None:
+        seed = new_seed()
 
-    # Loop until all points have been processed
-    while points_to_process:
-        # Get the next segment to process
-        previous, next, roughness = points_to_process.popleft()
+    chunks = iter_midpoint_displacement(
+        roughness, width + 1, height, seed, layer
+    )
 
-        # Compute the midpoint of the segment
-        midpoint_x = __find_horizontal_midpoint(previous, next)
-        midpoint_y = __compute_midpoint_height(
-            previous, next, heights, roughness
-        )
+    return np.concatenate(list(chunks))
+
+
+def iter_midpoint_displacement(
+    roughness, width, height, seed, layer=0, chunk_size=CHUNK_SIZE
+):
+    """
+    Generates a progressive midpoint displacement terrain in fixed-size
+    chunks, without computing the knots of the whole width.
+
+    The knots of the terrain are evenly spread on a dyadic grid: level `n`
+    has `2 ** n + 1` knots, and only the levels the width needs are
+    computed. Each chunk only computes the knots it covers and their
+    ancestors in the coarser levels, so memory is bounded by the chunk size.
+    The displacements only depend on the seed, the layer and the level, so
+    consecutive chunks join seamlessly and the same seed always gives the
+    same terrain.
 
-        # Update the heights list with the new midpoint
-        heights[midpoint_x] = midpoint_y
+    Args:
+        roughness (float): The initial roughness of the terrain. Smaller values
+            produce smoother terrain.
+        width (int): The total width of the terrain.
+        height (int): The height of the terrain.
+        seed (int): The seed of the landscape.
+        layer (int): The index of the layer within the landscape.
+        chunk_size (int): The number of heights of each chunk.
 
-        # Add new segments to process if the current segment can be subdivided
-        if next - previous > 2:
-            # Decrease the roughness by half
-            roughness /= 2
-            points_to_process.append((previous, midpoint_x, roughness))
-            points_to_process.append((midpoint_x, next, roughness))
+    Yields:
+        np.ndarray: The heights of the next chunk, from left to right. The
+        last chunk may be shorter.
+    """
+    levels = levels_for_width(width)
+    for start in range(0, width, chunk_size):
+        stop = min(start + chunk_size, width)
+        positions = sample_positions(levels, width, start, stop)
+
+        # Compute only the knots surrounding the positions of the chunk
+        first_knot = min(int(positions[0]), 2**levels - 1)
+        last_knot = min(int(positions[-1]) + 1, 2**levels)
+        knots = __knots_in_range(
+            roughness, height, seed, layer, levels, first_knot, last_knot
+        )
 
-    return heights
+        yield interpolate_knots(knots, positions - first_knot)
 
 
-def __initialize_data(width, height, roughness):
+def __knots_in_range(roughness, height, seed, layer, levels, first, last):
     """
-    Initializes the heights and points to process queue for the midpoint
-    displacement algorithm.
+    Computes a range of knots of a progressive terrain level by refining only
+    the knots they descend from.
 
     Args:
-        width (int): The width of the terrain.
-        height (int): The height of the terrain.
         roughness (float): The initial roughness of the terrain.
+        height (int): The height of the terrain.
+        seed (int): The seed of the landscape.
+        layer (int): The index of the layer within the landscape.
+        levels (int): The subdivision level of the knots.
+        first (int): The index of the first knot of the range.
+        last (int): The index of the last knot of the range, included.
 
     Returns:
-        A tuple containing the initialized heights and points to process queue.
+        np.ndarray: The heights of the knots in [first, last].
     """
-    # Initialize the heights list with the left and right endpoints set to 0
-    heights = [0] * (width + 1)
-    heights[0] = heights[width] = height // 2
+    # Find the range of knots needed at each coarser level
+    ranges = [(first, last)]
+    for _ in range(levels):
+        first, last = first // 2, (last + 1) // 2
+        ranges.append((first, last))
+    ranges.reverse()
+
+    # Refine the ranges from the endpoints of the terrain downwards
+    first, last = ranges[0]
+    knots = np.full(2, height // 2, np.float64)[first : last + 1]
+    for level in range(1, levels + 1):
+        parent_first, parent_last = ranges[level - 1]
+        displacements = level_displacements(
+            roughness, seed, layer, level, parent_first, parent_last
+        )
+        refined = np.empty(2 * knots.size - 1, np.float64)
+        refined[::2] = knots
+        refined[1::2] = (knots[:-1] + knots[1:]) / 2 + displacements
 
-    # Initialize the queue with the left and right endpoints
-    points_to_process = deque([(0, width, roughness)])
+        first, last = ranges[level]
+        offset = 2 * parent_first
+        knots = refined[first - offset : last - offset + 1]
 
-    return heights, points_to_process
+    return knots
 
 
-def __find_horizontal_midpoint(previous, next):
+def sample_positions(levels, width, start, stop):
     """
-    Computes the x-coordinate of the midpoint of a segment.
+    Computes the positions, in knot units, of a range of samples of a
+    progressive terrain level spread over the given width.
 
     Args:
-        previous (int): The left endpoint of the segment.
-        next (int): The right endpoint of the segment.
+        levels (int): The subdivision level that is sampled.
+        width (int): The total number of samples.
+        start (int): The index of the first sample of the range.
+        stop (int): The index after the last sample of the range.
 
     Returns:
-        The x-coordinate of the midpoint of the segment.
+        np.ndarray: The positions of the samples in [start, stop).
     """
-    return (previous + next) // 2
+    step = 2**levels / max(width - 1, 1)
 
+    return np.minimum(np.arange(start, stop) * step, 2**levels)
 
-def __compute_midpoint_height(point1, point2, heights, roughness):
+
+def levels_for_width(width):
     """
-    Compute the midpoint height between two points and apply random
-    displacement.
+    Computes the number of subdivision levels needed so that the knots of a
+    progressive terrain are at most one pixel apart.
 
     Args:
-        point1 (int): The index of the first point.
-        point2 (int): The index of the second point.
-        heights (list): The list of heights to compute from.
-        roughness (int): The intensity of the roughness.
+        width (int): The number of heights to sample.
 
     Returns:
-        int: The computed midpoint height.
+        int: The number of subdivision levels.
+    """
+    return max(width - 2, 0).bit_length()
+
+
+def level_displacements(roughness, seed, layer, level, start, stop):
     """
-    # Compute the mean height of the two points
-    mean_height = (heights[point1] + heights[point2]) // 2
+    Draws the displacements of a range of midpoints of a subdivision level.
+
+    The displacements of a level are drawn in blocks of `BLOCK_SIZE`, each one
+    from its own random stream, so any range of midpoints can be drawn
+    without drawing the ones before it.
+
+    Args:
+        roughness (float): The initial roughness of the terrain.
+        seed (int): The seed of the landscape.
+        layer (int): The index of the layer within the landscape.
+        level (int): The subdivision level, starting at 1.
+        start (int): The index of the first midpoint of the range.
+        stop (int): The index after the last midpoint of the range.
 
-    # Apply a random displacement based on the roughness parameter
-    roughness_int = int(roughness)
-    displacement = random.randint(-roughness_int, roughness_int)
-    midpoint_height = mean_height + displacement
+    Returns:
+        np.ndarray: The displacements of the midpoints in [start, stop).
+    """
+    # The roughness is halved after each level
+    level_roughness = roughness / 2 ** (level - 1)
+
+    if stop <= start:
+        return np.zeros(0, np.float64)
+
+    first_block = start // BLOCK_SIZE
+    last_block = (stop - 1) // BLOCK_SIZE
+    blocks = []
+    for block in range(first_block, last_block + 1):
+        rng = np.random.default_rng(
+            np.random.SeedSequence(seed, spawn_key=(layer, level, block))
+        )
+        blocks.append(
+            rng.uniform(-level_roughness, level_roughness, BLOCK_SIZE)
+        )
+    offset = first_block * BLOCK_SIZE
 
-    return midpoint_height
+    return np.concatenate(blocks)[start - offset : stop - offset]
 
 
-def normalize(data, lower_bound, upper_bound):
+def interpolate_knots(knots, positions):
+    """
+    Linearly interpolates evenly spaced knots at fractional positions.
+
+    Args:
+        knots (np.ndarray): The heights of at least two knots.
+        positions (np.ndarray): The positions to sample, in knot units.
+
+    Returns:
+        np.ndarray: The interpolated heights.
+    """
+    # The last segment also covers the position of the last knot
+    indices = np.clip(positions.astype(np.int64), 0, knots.size - 2)
+    fractions = positions - indices
+
+    return knots[indices] * (1 - fractions) + knots[indices + 1] * fractions
+
+
+def normalize(data, lower_bound, upper_bound, data_min=None, data_max=None):
     """
     Normalize data to the given bounds.
 
+    All of the arguments broadcast against each other, so a whole stack of
+    layers can be normalized at once by passing one bound per row.
+
     Args:
-        data (list[float]): The data to be normalized.
-        lower_bound (float): The lower bound of the new range.
-        upper_bound (float): The upper bound of the new range.
+        data (np.ndarray): The data to be normalized.
+        lower_bound (float, np.ndarray): The lower bound of the new range.
+        upper_bound (float, np.ndarray): The upper bound of the new range.
+        data_min (float, np.ndarray, optional): The known minimum of the data.
+            Computed from the data if None.
+        data_max (float, np.ndarray, optional): The known maximum of the data.
+            Computed from the data if None.
 
     Returns:
-        list[float]: The normalized data.
+        np.ndarray: The normalized data.
     """
     # Calculate the min and max values of the data
-    data_min = np.min(data)
-    data_max = np.max(data)
-
-    # Calculate the ranges
-    data_range = data_max - data_min
+    if data_min is None:
+        data_min = np.min(data)
+    if data_max is None:
+        data_max = np.max(data)
+
+    # Calculate the ranges, flat data is mapped to the lower bound
+    data_range = np.asarray(data_max - data_min, np.float32)
+    data_range = np.where(data_range == 0, 1, data_range)
     new_range = upper_bound - lower_bound
 
     # Normalize the data
-    normalized_data = [
-        (value - data_min) * new_range / data_range + lower_bound
-        for value in data
-    ]
+    scale = np.asarray(new_range / data_range, np.float32)
+    normalized_data = (data - data_min) * scale + lower_bound
 
     return normalized_data
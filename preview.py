@@ -0,0 +1,332 @@
+import numpy as np
+
+from drawing_utils import (
+    BufferPool,
+    apply_texture,
+    colorize,
+    draw_margin,
+    draw_sun_behind,
+    rasterize_scene,
+    sky_element_rect,
+    union_rect,
+)
+from landscape import (
+    WIDTH,
+    fit_terrain,
+    generate_terrain,
+    landscape_lut,
+    rasterize_sky,
+)
+from render_pipeline import RenderPipeline
+from smoothing import Smoother
+
+
+class PreviewFrame:
+    """
+    An image the preview is composited into, which remembers what it holds
+    so that the next render only draws what changed since. The pixels can
+    be memory owned by the display, such as the pixels of a QImage.
+    """
+
+    def __init__(self, pixels):
+        """
+        Attributes:
+            pixels (np.ndarray): The BGRA pixels of the frame, with any
+                strides.
+            background_version (int): The version of the background the
+                frame was composited over, None before the first render.
+            sky_rect (Tuple[int, int, int, int]): The bounding box of the
+                sky element in the frame, None without a sky element.
+
+        Args:
+            pixels (np.ndarray): The BGRA pixels of the frame.
+        """
+        self.pixels = pixels
+        self.background_version = None
+        self.sky_rect = None
+
+
+class PreviewRenderer:
+    """
+    Renders the preview of a landscape in cached stages, so that a change of
+    the config only runs the stages depending on it.
+
+    The landscape is first drawn without its sun or moon, which is then
+    composited over it. When only the sky element changes, only the union
+    of its old and new bounding boxes is composited again.
+
+    The renderer only reads the config it is given, so it can run on any
+    thread, as long as it runs one render at a time. The preview is
+    composited into a frame given by the caller, so that a display can show
+    one frame while the next one is rendered into another, or into a frame
+    of the renderer otherwise, overwritten by the next render.
+    """
+
+    def __init__(self):
+        """
+        Attributes:
+            buffers (BufferPool): The reusable buffers of every stage, so
+                that renders do not allocate full frames.
+            pipeline (RenderPipeline): The cached stages of the preview.
+            dirty_rect (Tuple[int, int, int, int]): The (x0, y0, x1, y1)
+                corners of the rectangle of the frame changed by the last
+                render, None if nothing changed.
+            __frame (PreviewFrame): The frame of the renders without a frame.
+        """
+        self.buffers = BufferPool()
+        self.pipeline = RenderPipeline()
+        self.dirty_rect = None
+        self.__frame = None
+
+    def render(self, config, frame=None):
+        """
+        Renders the preview of a config, rasterizing the scene directly at
+        the size of the config.
+
+        Args:
+            config (LandscapeConfig): The settings of the preview.
+            frame (PreviewFrame, optional): The frame to composite into, of
+                the size of the config. A frame of the renderer if None.
+
+        Returns:
+            np.ndarray: The BGRA preview, the pixels of the frame.
+        """
+        if frame is None:
+            shape = (config.height, config.width, 4)
+            if self.__frame is None or self.__frame.pixels.shape != shape:
+                self.__frame = PreviewFrame(np.empty(shape, np.uint8))
+            frame = self.__frame
+
+        self.buffers.begin_render()
+        self.pipeline.begin_render()
+        pipeline = self.pipeline
+        width, height = config.width, config.height
+
+        # Generate the mountains at the width of the preview, so that only
+        # the levels of detail it shows are computed, smooth them with the
+        # smoothing range scaled to that width, then normalize them based on
+        # padding and intersection and scale them to the preview
+        pipeline.run(
+            "terrain",
+            (
+                width,
+                config.seed,
+                config.layers,
+                config.roughness,
+                config.decrease_roughness,
+                config.engine,
+            ),
+            lambda: Smoother(generate_terrain(config)),
+        )
+        pipeline.run(
+            "smoothed terrain",
+            (config.smooth, config.smooth and config.smoothing_kernel),
+            lambda smoother: smoother.smooth(
+                round(config.smooth * width / WIDTH), config.smoothing_kernel
+            ),
+            ("terrain",),
+        )
+        pipeline.run(
+            "normalized terrain",
+            (
+                width,
+                height,
+                config.lower_padding,
+                config.upper_padding,
+                config.mountain_intersection,
+            ),
+            lambda mountains: fit_terrain(config, mountains),
+            ("smoothed terrain",),
+        )
+
+        # Rasterize the mountains with their contours, without the sky
+        # element since the scene has no sky element without a radius
+        pipeline.run(
+            "mountain raster",
+            (config.white_contour, config.renderer),
+            lambda mountains: rasterize_scene(
+                width,
+                height,
+                0,
+                0,
+                0,
+                config.sky_element,
+                mountains,
+                config.white_contour,
+                config.renderer,
+                self.buffers.get("mountain labels", (height, width)),
+                config.scale,
+            ),
+            ("normalized terrain",),
+        )
+
+        # Draw the landscape without the sky element: color the raster with
+        # a lookup table, draw margin if specified, then apply the texture
+        pipeline.run(
+            "background",
+            (
+                config.layers,
+                config.sky_color,
+                config.sun_color,
+                tuple(config.land_color),
+                config.margin,
+                config.texture,
+                config.texture_alpha,
+            ),
+            lambda labels: self.__background(config, labels),
+            ("mountain raster",),
+        )
+
+        # Rasterize the sky element and composite it behind the mountains,
+        # straight into the frame
+        self.dirty_rect = None
+        pipeline.run(
+            "sky element",
+            (
+                width,
+                height,
+                config.sun_radius,
+                config.center_x,
+                config.center_y,
+                config.white_contour,
+                config.sky_element,
+            ),
+            lambda: rasterize_sky(config),
+        )
+
+        pixels = pipeline.run(
+            "composite",
+            (id(frame),),
+            lambda *results: self.__composite(config, frame, *results),
+            ("mountain raster", "background", "sky element"),
+        )
+        self.buffers.end_render()
+
+        return pixels
+
+    def stats(self):
+        """
+        Describes the last render for the status bar.
+
+        Returns:
+            Tuple[str, str]: The stages run by the last render, their time
+            and the memory used, then the counters of every stage.
+        """
+        message = (
+            "Ran {} in {:.1f} ms, new buffers {:.1f} MB, "
+            "pooled {:.1f} MB".format(
+                ", ".join(self.pipeline.ran) or "nothing",
+                self.pipeline.last_seconds * 1000,
+                self.buffers.allocated_bytes / 2**20,
+                self.buffers.pooled_bytes / 2**20,
+            )
+        )
+        if self.buffers.peak_bytes is not None:
+            message += ", peak {:.1f} MB".format(
+                self.buffers.peak_bytes / 2**20
+            )
+
+        return message, self.pipeline.report()
+
+    def __background(self, config, labels):
+        """
+        Colors the raster of the mountains, draws the margin and applies the
+        texture.
+
+        Args:
+            config (LandscapeConfig): The settings of the preview.
+            labels (np.ndarray): The raster of the mountains.
+
+        Returns:
+            np.ndarray: The preview without its sky element.
+        """
+        background = self.buffers.get("background", labels.shape + (4,))
+
+        return self.__draw_labels(config, labels, background, 0, 0)
+
+    def __composite(self, config, frame, mountain_labels, background, sky):
+        """
+        Composites the sky element over the background into a frame. When
+        the frame holds the same background, only the union of the old and
+        the new bounding boxes of the sky element is drawn again.
+
+        Args:
+            config (LandscapeConfig): The settings of the preview.
+            frame (PreviewFrame): The frame to composite into.
+            mountain_labels (np.ndarray): The raster of the mountains.
+            background (np.ndarray): The preview without its sky element.
+            sky (Tuple): The rasterized sky element.
+
+        Returns:
+            np.ndarray: The preview, the pixels of the frame.
+        """
+        image = frame.pixels
+        rect = sky_element_rect(sky)
+        version = self.pipeline.version("background")
+        if version != frame.background_version:
+            np.copyto(image, background)
+            frame.background_version = version
+            self.dirty_rect = (0, 0, config.width, config.height)
+            dirty = rect
+        else:
+            dirty = union_rect(frame.sky_rect, rect)
+            self.dirty_rect = dirty
+        frame.sky_rect = rect
+        if dirty is None:
+            return image
+
+        # Draw the rectangle again from the labels of the mountains, which
+        # tell where the sky element is hidden. The rectangle is drawn into
+        # the start of buffers of the size of the preview, to keep it
+        # contiguous without allocating buffers for every size
+        x0, y0, x1, y1 = dirty
+        rows, columns = y1 - y0, x1 - x0
+        labels = self.buffers.get("dirty labels", mountain_labels.shape)
+        labels = labels.reshape(-1)[: rows * columns].reshape(rows, columns)
+        np.copyto(labels, mountain_labels[y0:y1, x0:x1])
+        draw_sun_behind(labels, sky, y0, x0)
+        pixels = self.buffers.get("dirty pixels", image.shape)
+        pixels = pixels.reshape(-1)[: rows * columns * 4]
+        pixels = pixels.reshape(rows, columns, 4)
+        self.__draw_labels(config, labels, pixels, y0, x0)
+        np.copyto(image[y0:y1, x0:x1], pixels)
+
+        return image
+
+    def __draw_labels(self, config, labels, image, top, left):
+        """
+        Colors a raster of labels, or a rectangle of it, draws the margin and
+        applies the texture.
+
+        Args:
+            config (LandscapeConfig): The settings of the preview.
+            labels (np.ndarray): The labels to draw.
+            image (np.ndarray): The contiguous buffer to draw into.
+            top (int): The row of the preview where the labels start.
+            left (int): The column of the preview where the labels start.
+
+        Returns:
+            np.ndarray: The drawn image, which is the given buffer.
+        """
+        colorize(labels, landscape_lut(config, config.layers), image)
+        if not config.margin == "None":
+            draw_margin(
+                image,
+                config.margin,
+                config.width,
+                config.height,
+                config.scale,
+                top,
+                left,
+            )
+
+        return apply_texture(
+            image,
+            config.texture,
+            config.texture_alpha,
+            top,
+            config.height,
+            left,
+            config.width,
+        )
+
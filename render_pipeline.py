@@ -0,0 +1,140 @@
+import time
+
+
+class StageStats:
+    """
+    The cache counters and timings of a render stage.
+    """
+
+    def __init__(self):
+        """
+        Attributes:
+            hits (int): The number of runs that reused the cached result.
+            misses (int): The number of runs that computed the result.
+            seconds (float): The total time spent computing the result.
+            last_seconds (float): The time of the last computation.
+        """
+        self.hits = 0
+        self.misses = 0
+        self.seconds = 0.0
+        self.last_seconds = 0.0
+
+
+class RenderPipeline:
+    """
+    Runs the stages of a render and caches their results.
+
+    Each stage declares its inputs, plain values compared by equality, and
+    the stages it depends on. A stage only runs again when one of its inputs
+    changed or when a stage it depends on produced a new result since its
+    last run, otherwise its cached result is reused.
+    """
+
+    def __init__(self):
+        """
+        Attributes:
+            __results (Dict[str, Tuple]): The key, the version and the result
+                of the last run of each stage.
+            __ran (List[str]): The stages computed since the render began.
+            stats (Dict[str, StageStats]): The counters of each stage, in the
+                order the stages first ran.
+        """
+        self.__results = {}
+        self.__ran = []
+        self.stats = {}
+
+    def begin_render(self):
+        """
+        Starts tracking the stages computed by a new render.
+        """
+        self.__ran = []
+
+    def run(self, name, inputs, compute, depends=()):
+        """
+        Returns the result of a stage, computing it only if its inputs or the
+        results of the stages it depends on changed.
+
+        Args:
+            name (str): The name of the stage.
+            inputs (Tuple): The values the stage depends on.
+            compute (Callable): The function computing the result, called
+                with the results of the stages the stage depends on.
+            depends (Tuple[str]): The names of the stages the stage depends
+                on, which must have run before.
+
+        Returns:
+            Any: The result of the stage.
+        """
+        stats = self.stats.setdefault(name, StageStats())
+        key = (
+            tuple(inputs),
+            tuple(self.__results[stage][1] for stage in depends),
+        )
+
+        cached = self.__results.get(name)
+        if cached is not None and cached[0] == key:
+            stats.hits += 1
+            return cached[2]
+
+        start = time.perf_counter()
+        result = compute(*(self.__results[stage][2] for stage in depends))
+        stats.last_seconds = time.perf_counter() - start
+        stats.seconds += stats.last_seconds
+        stats.misses += 1
+
+        version = 0 if cached is None else cached[1] + 1
+        self.__results[name] = (key, version, result)
+        self.__ran.append(name)
+
+        return result
+
+    def version(self, name):
+        """
+        Returns how many times a stage computed a new result, to tell whether
+        its result changed since it was last used.
+
+        Args:
+            name (str): The name of the stage.
+
+        Returns:
+            int: The version of the last result of the stage, None if the
+            stage never ran.
+        """
+        cached = self.__results.get(name)
+
+        return None if cached is None else cached[1]
+
+    @property
+    def ran(self):
+        """
+        List[str]: The stages computed since the render began.
+        """
+        return list(self.__ran)
+
+    @property
+    def last_seconds(self):
+        """
+        float: The time spent computing stages since the render began.
+        """
+        return sum(self.stats[name].last_seconds for name in self.__ran)
+
+    def report(self):
+        """
+        Formats the counters of every stage as a table.
+
+        Returns:
+            str: One line per stage with its hits, misses and total time.
+        """
+        row = "{:<20}{:>8}{:>8}{:>12}"
+        lines = [row.format("Stage", "Hits", "Misses", "ms")]
+        for name, stats in self.stats.items():
+            lines.append(
+                row.format(
+                    name,
+                    stats.hits,
+                    stats.misses,
+                    "{:.1f}".format(stats.seconds * 1000),
+                )
+            )
+
+        return "\n".join(lines)
@@ -0,0 +1,174 @@
+import numpy as np
+
+from heightmap import Heightmap
+
+# Smoothing kernels
+SMOOTHING_KERNELS = ["Box", "Gaussian"]
+
+# Kernel size above which the Gaussian convolution is done through the FFT
+FFT_KERNEL_SIZE = 64
+
+
+class Smoother:
+    """
+    Smooths a heightmap with different neighborhood ranges.
+
+    The prefix sums and the spectrum of the heights only depend on the
+    heightmap, so they are computed once and reused every time the smoothing
+    range changes. Edges are handled like a shrinking window: each height is
+    averaged only with the neighbors that fall inside the heightmap.
+    """
+
+    def __init__(self, mountains):
+        """
+        Attributes:
+            __mountains (Heightmap): The heightmap to smooth.
+            __prefix_sums (np.ndarray): The cumulative sums of every layer,
+                with a leading column of zeros.
+            __spectra (Tuple): The FFT size and the spectra of the zero padded
+                heights and of a window of ones.
+
+        Args:
+            mountains (Heightmap): The heightmap to smooth.
+        """
+        self.__mountains = mountains
+        self.__prefix_sums = None
+        self.__spectra = None
+
+    def smooth(self, smoothing_range, kernel="Box"):
+        """
+        Smooths the heightmap with the given neighborhood range.
+
+        Args:
+            smoothing_range (int): The radius of the neighborhood to consider
+                when smoothing the mountain heights.
+            kernel (str): The smoothing kernel, either "Box" or "Gaussian".
+
+        Returns:
+            Heightmap: The smoothed height values of the mountain layers.
+        """
+        if smoothing_range <= 0 or self.__mountains.width == 0:
+            return self.__mountains
+
+        if kernel == "Box":
+            smoothed = self.__box(smoothing_range)
+        elif kernel == "Gaussian":
+            smoothed = self.__gaussian(smoothing_range)
+        else:
+            raise ValueError("Unknown smoothing kernel: {}".format(kernel))
+
+        return Heightmap(smoothed)
+
+    def __box(self, smoothing_range):
+        """
+        Averages each height with its neighbors using the prefix sums.
+
+        Args:
+            smoothing_range (int): The radius of the neighborhood.
+
+        Returns:
+            np.ndarray: The smoothed heights.
+        """
+        if self.__prefix_sums is None:
+            heights = self.__mountains.heights
+            self.__prefix_sums = np.zeros(
+                (heights.shape[0], heights.shape[1] + 1), np.float64
+            )
+            np.cumsum(heights, axis=1, out=self.__prefix_sums[:, 1:])
+
+        # Bounds of the shrinking window of every height
+        width = self.__mountains.width
+        indices = np.arange(width)
+        lower_bounds = np.maximum(indices - smoothing_range, 0)
+        upper_bounds = np.minimum(indices + smoothing_range + 1, width)
+
+        sums = (
+            self.__prefix_sums[:, upper_bounds]
+            - self.__prefix_sums[:, lower_bounds]
+        )
+
+        return sums / (upper_bounds - lower_bounds)
+
+    def __gaussian(self, smoothing_range):
+        """
+        Averages each height with its neighbors weighted by a Gaussian whose
+        standard deviation is half the smoothing range. Large kernels are
+        convolved through the FFT.
+
+        Args:
+            smoothing_range (int): The radius of the neighborhood.
+
+        Returns:
+            np.ndarray: The smoothed heights.
+        """
+        kernel = gaussian_kernel(smoothing_range, self.__mountains.width)
+        if kernel.size > min(FFT_KERNEL_SIZE, self.__mountains.width):
+            sums, weights = self.__fft_convolve(kernel)
+        else:
+            heights = self.__mountains.heights
+            sums = np.array(
+                [np.convolve(layer, kernel, "same") for layer in heights]
+            )
+            weights = np.convolve(np.ones(heights.shape[1]), kernel, "same")
+
+        # Normalize by the weights that fall inside the heightmap
+        return sums / weights
+
+    def __fft_convolve(self, kernel):
+        """
+        Convolves the heights and a window of ones with a centered kernel
+        using the cached spectra of the heights.
+
+        Args:
+            kernel (np.ndarray): A centered kernel of odd size, no wider than
+                twice the heightmap.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The convolved heights and the
+            convolved window of ones.
+        """
+        heights = self.__mountains.heights
+        width = heights.shape[1]
+
+        if self.__spectra is None:
+            # Zero padding wide enough to avoid any wrap around
+            size = 1 << (2 * width).bit_length()
+            self.__spectra = (
+                size,
+                np.fft.rfft(heights, size, axis=1),
+                np.fft.rfft(np.ones(width), size),
+            )
+        size, heights_spectrum, ones_spectrum = self.__spectra
+
+        # Place the kernel centered at the origin of the circular buffer
+        radius = kernel.size // 2
+        circular_kernel = np.zeros(size)
+        circular_kernel[: radius + 1] = kernel[radius:]
+        circular_kernel[size - radius :] = kernel[:radius]
+        kernel_spectrum = np.fft.rfft(circular_kernel)
+
+        sums = np.fft.irfft(heights_spectrum * kernel_spectrum, size, axis=1)
+        weights = np.fft.irfft(ones_spectrum * kernel_spectrum, size)
+
+        return sums[:, :width], weights[:width]
+
+
+def gaussian_kernel(smoothing_range, width):
+    """
+    Creates a normalized Gaussian kernel truncated at three standard
+    deviations, with a standard deviation of half the smoothing range.
+
+    Args:
+        smoothing_range (int): The radius of the neighborhood.
+        width (int): The width of the heightmap, which bounds the kernel
+            radius.
+
+    Returns:
+        np.ndarray: The kernel, of odd size.
+    """
+    sigma = smoothing_range / 2
+    radius = min(int(np.ceil(3 * sigma)), width)
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+
+    return kernel / kernel.sum()
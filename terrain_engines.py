@@ -0,0 +1,337 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import midpoint_displacement as md
+from heightmap import Heightmap
+
+# A terrain engine, whose generate function takes the number of layers, the
+# roughness, the decrease roughness flag, the width, the height and the seed,
+# and returns a Heightmap of shape (num_layers, width)
+Engine = namedtuple("Engine", ["name", "generate", "description"])
+
+# Registered engines, by name
+ENGINES = {}
+
+DEFAULT_ENGINE = "Midpoint Displacement"
+
+# Number of sines of the sum of sines engine
+NUM_SINES = 24
+
+
+def register_engine(name, description):
+    """
+    Decorator that registers a terrain generation function as an engine.
+
+    Args:
+        name (str): The name of the engine, as shown in the GUI.
+        description (str): A short description of the engine.
+
+    Returns:
+        Callable: The decorator, which returns the function unchanged.
+    """
+
+    def decorator(generate):
+        ENGINES[name] = Engine(name, generate, description)
+        return generate
+
+    return decorator
+
+
+def get_engine(name):
+    """
+    Returns the registered engine with the given name.
+
+    Args:
+        name (str): The name of the engine.
+
+    Returns:
+        Engine: The engine.
+    """
+    if name not in ENGINES:
+        raise ValueError("Unknown terrain engine: {}".format(name))
+
+    return ENGINES[name]
+
+
+def layer_roughness(roughness, decrease_roughness, layer):
+    """
+    Computes the roughness of a mountain layer.
+
+    Args:
+        roughness (int): The roughness of the mountain terrain.
+        decrease_roughness (bool): If True, decreases the roughness of each
+            successive layer by a factor of 1/(layer + 1).
+        layer (int): The index of the layer.
+
+    Returns:
+        int: The roughness of the layer.
+    """
+    if not decrease_roughness:
+        return roughness
+
+    return roughness // (layer + 1)
+
+
+def iter_mountains(
+    num_layers,
+    roughness,
+    decrease_roughness,
+    width,
+    height,
+    seed,
+    chunk_size=md.CHUNK_SIZE,
+):
+    """
+    Generates the layers of mountain heights in fixed-size chunks, so that
+    panoramas much wider than the image can be produced with bounded memory.
+
+    The midpoint displacement engine stitches these chunks, so they are
+    identical to the same range of its mountains with the same seed and
+    parameters. To normalize the chunks, gather the extremes of every layer
+    in a first pass and wrap each chunk in a `Heightmap` with those
+    extremes.
+
+    Args:
+        num_layers (int): The number of mountain layers to generate.
+        roughness (int): The roughness of the mountain terrain. A higher
+            roughness value produces more jagged mountains.
+        decrease_roughness (bool): If True, decreases the roughness of each
+            successive layer by a factor of 1/(layer + 1).
+        width (int): The total width of the mountains.
+        height (int): The height of the image.
+        seed (int): The seed of the landscape.
+        chunk_size (int): The number of heights of each chunk.
+
+    Yields:
+        np.ndarray: The heights of the next chunk, with shape
+        (num_layers, chunk_size). The last chunk may be narrower.
+    """
+    streams = []
+    for layer in range(num_layers):
+        streams.append(
+            md.iter_midpoint_displacement(
+                layer_roughness(roughness, decrease_roughness, layer),
+                width,
+                height,
+                seed,
+                layer,
+                chunk_size,
+            )
+        )
+
+    for start in range(0, width, chunk_size):
+        chunk = np.empty(
+            (num_layers, min(chunk_size, width - start)), np.float32
+        )
+        for layer, stream in enumerate(streams):
+            chunk[layer] = next(stream)
+        yield chunk
+
+
+def layer_seed(seed, layer, *keys):
+    """
+    Creates the seed sequence of a random stream of a mountain layer.
+
+    Args:
+        seed (int): The seed of the landscape.
+        layer (int): The index of the layer.
+        *keys (int): Extra keys identifying the stream within the layer.
+
+    Returns:
+        np.random.SeedSequence: The seed sequence of the stream.
+    """
+    return np.random.SeedSequence(seed, spawn_key=(layer,) + keys)
+
+
+@register_engine(
+    "Midpoint Displacement",
+    "Progressive midpoint displacement, refined to the needed resolution.",
+)
+def midpoint_displacement_engine(
+    num_layers, roughness, decrease_roughness, width, height, seed
+):
+    """
+    Generates the mountain layers with progressive midpoint displacement.
+
+    Args:
+        num_layers (int): The number of mountain layers to generate.
+        roughness (int): The roughness of the mountain terrain.
+        decrease_roughness (bool): If True, decreases the roughness of each
+            successive layer by a factor of 1/(layer + 1).
+        width (int): The width of the image.
+        height (int): The height of the image.
+        seed (int): The seed of the landscape.
+
+    Returns:
+        Heightmap: The layers of mountain heights.
+    """
+    heights = np.empty((num_layers, width), np.float32)
+    start = 0
+    for chunk in iter_mountains(
+        num_layers, roughness, decrease_roughness, width, height, seed
+    ):
+        heights[:, start : start + chunk.shape[1]] = chunk
+        start += chunk.shape[1]
+
+    return Heightmap(heights)
+
+
+@register_engine(
+    "Fractal Noise",
+    "Fractional Brownian motion of value noise octaves.",
+)
+def fractal_noise_engine(
+    num_layers, roughness, decrease_roughness, width, height, seed
+):
+    """
+    Generates the mountain layers as fractional Brownian motion: a sum of
+    value noise octaves where each octave doubles the frequency and halves
+    the amplitude, matching the roughness decay of midpoint displacement. The
+    lattice of each octave only depends on the seed, so the terrain keeps its
+    shape at any resolution and only gains octaves of detail.
+
+    Args:
+        num_layers (int): The number of mountain layers to generate.
+        roughness (int): The roughness of the mountain terrain.
+        decrease_roughness (bool): If True, decreases the roughness of each
+            successive layer by a factor of 1/(layer + 1).
+        width (int): The width of the image.
+        height (int): The height of the image.
+        seed (int): The seed of the landscape.
+
+    Returns:
+        Heightmap: The layers of mountain heights.
+    """
+    positions = np.linspace(0, 1, width)
+    octaves = md.levels_for_width(width)
+
+    heights = np.empty((num_layers, width), np.float32)
+    for layer in range(num_layers):
+        amplitude = layer_roughness(roughness, decrease_roughness, layer)
+        layer_heights = np.full(width, height // 2, np.float64)
+        for octave in range(octaves):
+            # Random lattice values, interpolated with a smoothstep
+            frequency = 2**octave
+            rng = np.random.default_rng(layer_seed(seed, layer, octave))
+            lattice = rng.uniform(-amplitude, amplitude, frequency + 1)
+            scaled = positions * frequency
+            cells = np.minimum(scaled.astype(np.int64), frequency - 1)
+            fractions = scaled - cells
+            fractions = fractions * fractions * (3 - 2 * fractions)
+            layer_heights += (
+                lattice[cells] * (1 - fractions)
+                + lattice[cells + 1] * fractions
+            )
+            amplitude /= 2
+        heights[layer] = layer_heights
+
+    return Heightmap(heights)
+
+
+@register_engine(
+    "Sum of Sines",
+    "A fixed number of sines with random phases and decaying amplitudes.",
+)
+def sum_of_sines_engine(
+    num_layers, roughness, decrease_roughness, width, height, seed
+):
+    """
+    Generates the mountain layers as a sum of sines with geometrically
+    spaced frequencies, random phases and amplitudes inversely proportional to
+    their frequencies. Its cost grows with the number of sines times the
+    width, which makes it the slowest engine at the reference width, and it
+    has no detail beyond its highest frequency.
+
+    Args:
+        num_layers (int): The number of mountain layers to generate.
+        roughness (int): The roughness of the mountain terrain.
+        decrease_roughness (bool): If True, decreases the roughness of each
+            successive layer by a factor of 1/(layer + 1).
+        width (int): The width of the image.
+        height (int): The height of the image.
+        seed (int): The seed of the landscape.
+
+    Returns:
+        Heightmap: The layers of mountain heights.
+    """
+    positions = np.linspace(0, 2 * np.pi, width)
+
+    heights = np.empty((num_layers, width), np.float32)
+    for layer in range(num_layers):
+        rng = np.random.default_rng(layer_seed(seed, layer))
+        frequencies = np.geomspace(0.5, 512, NUM_SINES)
+        frequencies *= rng.uniform(0.8, 1.25, NUM_SINES)
+        phases = rng.uniform(0, 2 * np.pi, NUM_SINES)
+        amplitudes = (
+            layer_roughness(roughness, decrease_roughness, layer)
+            / frequencies
+            * rng.uniform(0.5, 1, NUM_SINES)
+        )
+
+        # Evaluate every sine at once and add them up
+        sines = np.sin(np.outer(frequencies, positions) + phases[:, None])
+        heights[layer] = height // 2 + amplitudes @ sines
+
+    return Heightmap(heights)
+
+
+def spectral_slope(mountains):
+    """
+    Estimates the slope of the power spectrum of the mountain layers in a
+    log-log scale. Natural terrain profiles, like midpoint displacement, have
+    a slope close to -2.
+
+    Args:
+        mountains (Heightmap): The mountain layers.
+
+    Returns:
+        float: The mean slope of the layers.
+    """
+    heights = mountains.heights - mountains.heights.mean(axis=1, keepdims=True)
+    power = np.abs(np.fft.rfft(heights, axis=1)[:, 1:]) ** 2
+    frequencies = np.log(np.arange(1, power.shape[1] + 1))
+    slopes = [
+        np.polyfit(frequencies, np.log(layer_power + 1e-12), 1)[0]
+        for layer_power in power
+    ]
+
+    return float(np.mean(slopes))
+
+
+def benchmark_engines(width, height, num_layers=3, roughness=300, repeats=5):
+    """
+    Times every registered engine and measures the spectral slope of its
+    terrain, to choose the cheapest engine that meets a quality bar.
+
+    Args:
+        width (int): The width of the terrain.
+        height (int): The height of the terrain.
+        num_layers (int): The number of layers to generate.
+        roughness (int): The roughness of the terrain.
+        repeats (int): The number of timed runs, the best one is kept.
+
+    Returns:
+        Dict[str, Tuple[float, float]]: The best time in seconds and the
+        spectral slope of each engine, by name.
+    """
+    results = {}
+    for name, engine in ENGINES.items():
+        timings = []
+        for seed in range(repeats):
+            start = time.perf_counter()
+            mountains = engine.generate(
+                num_layers, roughness, True, width, height, seed
+            )
+            timings.append(time.perf_counter() - start)
+        results[name] = (min(timings), spectral_slope(mountains))
+
+    return results
+
+
+if __name__ == "__main__":
+    for name, (seconds, slope) in benchmark_engines(2480, 3508).items():
+        print(
+            "{:<24}{:>10.2f} ms{:>10.2f}".format(name, seconds * 1000, slope)
+        )
@@ -0,0 +1,32 @@
+from export import (
+    MEMORY_BUDGET,
+    STRIP_HEIGHT,
+    estimate_memory,
+    export_size,
+    use_strips,
+)
+
+
+def test_a4_600_dpi_uses_strips():
+    """
+    An A4 page at 600 DPI peaks above the default budget when rendered as a
+    whole, so it must be rendered by strips.
+    """
+    assert use_strips(*export_size("A4", 600))
+
+
+def test_a4_300_dpi_renders_whole():
+    """
+    An A4 page at 300 DPI, the reference canvas, fits in the default budget.
+    """
+    assert not use_strips(*export_size("A4", 300))
+
+
+def test_strips_fit_in_budget():
+    """
+    A strip of the largest paper at the highest resolution fits in the
+    default budget.
+    """
+    width, height = export_size("A1", 1200)
+
+    assert estimate_memory(width, height, STRIP_HEIGHT) <= MEMORY_BUDGET
@@ -0,0 +1,66 @@
+import cv2
+import numpy as np
+import pytest
+
+from export import estimate_memory
+from landscape import LandscapeConfig, save_landscape, save_pyramid
+
+
+@pytest.mark.parametrize("renderer", ["Polygon", "Columns"])
+@pytest.mark.parametrize("sky_element", ["Sun", "Moon"])
+@pytest.mark.parametrize("white_contour", [False, True])
+@pytest.mark.parametrize("margin", ["None", "Circle", "Window"])
+def test_strips_match_whole_render(
+    tmp_path, renderer, sky_element, white_contour, margin
+):
+    """
+    Rendering by strips gives the same image as rendering it whole, when the
+    texture, which is resized band by band, is not applied. The sky element
+    crosses the boundary between the first two strips.
+    """
+    config = LandscapeConfig(
+        width=620,
+        height=877,
+        seed=7,
+        layers=4,
+        sky_element=sky_element,
+        sun_radius=600,
+        center_x=1240,
+        center_y=1024,
+        white_contour=white_contour,
+        margin=margin,
+        renderer=renderer,
+        texture_alpha=0,
+    )
+    whole_path = str(tmp_path / "whole.png")
+    strips_path = str(tmp_path / "strips.png")
+    save_landscape(config, whole_path, memory_budget=2**40)
+    save_landscape(config, strips_path, memory_budget=0)
+
+    whole = cv2.imread(whole_path, cv2.IMREAD_UNCHANGED)
+    strips = cv2.imread(strips_path, cv2.IMREAD_UNCHANGED)
+    assert np.array_equal(whole, strips)
+
+
+def test_strip_copies_match_whole_render(tmp_path):
+    """
+    Copies downsampled from the strips of an image match the copies of a
+    whole render up to one level of rounding. The budget fits the copies
+    but not the image.
+    """
+    config = LandscapeConfig(width=620, height=877, seed=7, texture_alpha=0)
+    copies = [(300, "web.png"), (100, "thumbnail.png")]
+    budget = estimate_memory(300, 424)
+    for name, memory_budget in [("whole", 2**40), ("strips", budget)]:
+        save_pyramid(
+            config,
+            str(tmp_path / (name + ".png")),
+            [(width, str(tmp_path / (name + path))) for width, path in copies],
+            memory_budget=memory_budget,
+        )
+
+    for _, path in copies:
+        whole = cv2.imread(str(tmp_path / ("whole" + path)), -1)
+        strips = cv2.imread(str(tmp_path / ("strips" + path)), -1)
+        assert whole.shape == strips.shape
+        assert np.abs(whole.astype(int) - strips).max() <= 1
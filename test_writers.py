@@ -0,0 +1,71 @@
+import cv2
+import numpy as np
+import pytest
+
+from writers import (
+    PNG_CHUNK_BYTES,
+    TIFF_ROWS_PER_STRIP,
+    EncodeOptions,
+    encode_image,
+    open_image_writer,
+)
+
+
+def random_image(width, height):
+    """
+    Creates a BGRA image mixing noise, which deflate cannot compress, with
+    flat areas, which it compresses into back references. The alpha is
+    opaque like that of the renders, since OpenCV premultiplies the colors
+    of TIFF files by their alpha when it reads them.
+
+    Args:
+        width (int): The width of the image.
+        height (int): The height of the image.
+
+    Returns:
+        np.ndarray: The BGRA uint8 image.
+    """
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (height, width, 4), np.uint8)
+    image[..., 3] = 255
+    image[height // 3 : height // 2] = (40, 80, 120, 255)
+
+    return image
+
+
+@pytest.mark.parametrize("extension", [".png", ".tif"])
+@pytest.mark.parametrize("alpha", [True, False])
+@pytest.mark.parametrize("threads", [1, 3])
+def test_encode_round_trip(tmp_path, extension, alpha, threads):
+    """
+    PNG and TIFF files decode to the encoded image. The image spans several
+    deflate chunks and a height that is not a multiple of the TIFF strips.
+    """
+    height = 3 * TIFF_ROWS_PER_STRIP + 5
+    width = 2 * PNG_CHUNK_BYTES // (4 * height) + 1
+    image = random_image(width, height)
+    path = str(tmp_path / ("image" + extension))
+    encode_image(image, path, EncodeOptions(alpha=alpha, threads=threads))
+
+    decoded = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    assert np.array_equal(decoded, image if alpha else image[..., :3])
+
+
+@pytest.mark.parametrize("extension", [".png", ".tif", ".jpg", ".webp"])
+def test_bands_match_whole_image(tmp_path, extension):
+    """
+    Writing an image in bands of any height gives the same pixels as
+    encoding it whole.
+    """
+    image = random_image(300, 2 * TIFF_ROWS_PER_STRIP + 7)
+    height, width = image.shape[:2]
+    whole_path = str(tmp_path / ("whole" + extension))
+    bands_path = str(tmp_path / ("bands" + extension))
+    encode_image(image, whole_path)
+    with open_image_writer(bands_path, width, height) as writer:
+        for top in range(0, height, 50):
+            writer.write(image[top : top + 50])
+
+    whole = cv2.imread(whole_path, cv2.IMREAD_UNCHANGED)
+    bands = cv2.imread(bands_path, cv2.IMREAD_UNCHANGED)
+    assert np.array_equal(whole, bands)
@@ -0,0 +1,195 @@
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# Memory the resized texture masks may keep, in bytes. Masks larger than
+# this, such as those of exports close to the memory budget, are not kept
+MASK_CACHE_BYTES = 32 * 2**20
+
+# Number of rows blended at once, which bounds the temporary buffers
+BLEND_ROWS = 256
+
+# Decoded grayscale textures, by path
+__textures = {}
+
+# Resized texture masks, by (path, width, height), least recently used first
+__masks = OrderedDict()
+
+# Lock of the caches, which the preview and the exports use from different
+# threads
+__lock = threading.Lock()
+
+
+def load_texture(texture_path):
+    """
+    Decodes a texture file into a grayscale mask, only the first time it is
+    requested.
+
+    Args:
+        texture_path (str): Path to the texture file.
+
+    Returns:
+        np.ndarray: The read-only uint8 grayscale texture.
+    """
+    texture = __textures.get(texture_path)
+    if texture is None:
+        texture = cv2.imread(texture_path)
+        if texture is None:
+            raise FileNotFoundError(
+                "Could not read texture: {}".format(texture_path)
+            )
+        texture = cv2.cvtColor(texture, cv2.COLOR_BGR2GRAY)
+        texture.setflags(write=False)
+        __textures[texture_path] = texture
+
+    return texture
+
+
+def texture_mask(texture_path, width, height):
+    """
+    Returns the texture resized to the given size. The most recently used
+    sizes are cached up to MASK_CACHE_BYTES, so a texture is only resized
+    once per size.
+
+    Args:
+        texture_path (str): Path to the texture file.
+        width (int): The width of the mask.
+        height (int): The height of the mask.
+
+    Returns:
+        np.ndarray: The read-only uint8 mask of shape (height, width).
+    """
+    key = (texture_path, width, height)
+    with __lock:
+        mask = __masks.get(key)
+        if mask is not None:
+            __masks.move_to_end(key)
+            return mask
+
+    mask = cv2.resize(load_texture(texture_path), (width, height))
+    mask.setflags(write=False)
+    __cache_mask(key, mask)
+
+    return mask
+
+
+def __cache_mask(key, mask):
+    """
+    Caches a resized mask, forgetting the least recently used ones until
+    the cache fits in MASK_CACHE_BYTES. A mask larger than that is not
+    cached.
+
+    Args:
+        key (Tuple[str, int, int]): The path, width and height of the mask.
+        mask (np.ndarray): The read-only mask.
+    """
+    if mask.nbytes > MASK_CACHE_BYTES:
+        return
+
+    with __lock:
+        __masks[key] = mask
+        __masks.move_to_end(key)
+        cached_bytes = sum(cached.nbytes for cached in __masks.values())
+        while cached_bytes > MASK_CACHE_BYTES:
+            cached_bytes -= __masks.popitem(last=False)[1].nbytes
+
+
+def texture_band(texture_path, width, height, top, rows):
+    """
+    Computes a band of rows of the texture resized to the given size,
+    without resizing the whole texture. The band matches the same rows of
+    `texture_mask` up to one level of rounding.
+
+    Args:
+        texture_path (str): Path to the texture file.
+        width (int): The width of the resized texture.
+        height (int): The height of the resized texture.
+        top (int): The first row of the band.
+        rows (int): The number of rows of the band.
+
+    Returns:
+        np.ndarray: The uint8 band of shape (rows, width).
+    """
+    texture = load_texture(texture_path)
+    scale_x = texture.shape[1] / width
+    scale_y = texture.shape[0] / height
+
+    # Map the center of every pixel of the band to the texture, like a
+    # linear resize does
+    transform = np.float64(
+        [
+            [scale_x, 0, 0.5 * scale_x - 0.5],
+            [0, scale_y, (top + 0.5) * scale_y - 0.5],
+        ]
+    )
+
+    return cv2.warpAffine(
+        texture,
+        transform,
+        (width, rows),
+        flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+        borderMode=cv2.BORDER_REPLICATE,
+    )
+
+
+def share_texture(texture_path, texture, masks=()):
+    """
+    Puts an already decoded texture, and optionally some of its resized
+    masks, in the caches, so that they are used instead of decoding and
+    resizing the file. The arrays can live in memory shared between
+    processes.
+
+    Args:
+        texture_path (str): Path to the texture file.
+        texture (np.ndarray): The uint8 grayscale texture.
+        masks (List[np.ndarray]): Masks of the texture already resized, each
+            cached for its own size.
+    """
+    texture.setflags(write=False)
+    __textures[texture_path] = texture
+    for mask in masks:
+        mask.setflags(write=False)
+        __cache_mask((texture_path, mask.shape[1], mask.shape[0]), mask)
+
+
+def blend_texture(image, mask, alpha):
+    """
+    Blends white into an image in place, weighted by a mask, using 8.8 fixed
+    point arithmetic on bands of rows.
+
+    Args:
+        image (np.ndarray): The BGRA uint8 image to blend into.
+        mask (np.ndarray): The uint8 mask with the same height and width as
+            the image. White pixels of the mask turn the image white.
+        alpha (float): The opacity of the texture, between 0 and 1.
+
+    Returns:
+        np.ndarray: The blended image, which is the given image.
+    """
+    # Weight of each mask value, in 1/256 units. Beyond 256 the products
+    # would overflow the uint16 scratch, so the opacity is kept in range
+    alpha = min(max(alpha, 0.0), 1.0)
+    weights = np.round(np.arange(256) * alpha * 256 / 255).astype(np.uint16)
+
+    height = image.shape[0]
+    scratch = np.empty((min(BLEND_ROWS, height), image.shape[1]), np.uint16)
+    for top in range(0, height, BLEND_ROWS):
+        bottom = min(top + BLEND_ROWS, height)
+        band = image[top:bottom]
+        band_scratch = scratch[: bottom - top]
+        band_weights = weights[mask[top:bottom]]
+
+        # Move each channel towards white: c += (255 - c) * w / 256
+        for channel in range(3):
+            values = band[:, :, channel]
+            np.subtract(255, values, out=band_scratch)
+            band_scratch *= band_weights
+            band_scratch += 128
+            band_scratch >>= 8
+            np.add(values, band_scratch, out=values, casting="unsafe")
+
+    image[:, :, 3] = 255
+
+    return image
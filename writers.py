@@ -0,0 +1,775 @@
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from export import iter_strips
+
+# Compression level of the deflate streams, the fastest one like the
+# default of OpenCV
+COMPRESSION_LEVEL = 1
+
+# Quality of the JPEG and WebP files, from 0 to 100
+DEFAULT_QUALITY = 95
+
+# Uncompressed bytes of each chunk of a PNG deflate stream. Chunks are
+# compressed in parallel, each one primed with the window before it
+PNG_CHUNK_BYTES = 256 * 2**10
+
+# Size of the deflate window, the data a chunk can refer back to
+DEFLATE_WINDOW = 32 * 2**10
+
+# Chunks compressed ahead of the file, per thread
+CHUNKS_PER_THREAD = 2
+
+# Number of rows of each strip of a TIFF file
+TIFF_ROWS_PER_STRIP = 64
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# PNG filter type of the rows, which subtracts the row above
+PNG_UP_FILTER = 2
+
+# TIFF field types
+TIFF_SHORT = 3
+TIFF_LONG = 4
+
+# Image formats, by file extension
+FORMATS = {
+    ".png": "PNG",
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+    ".webp": "WebP",
+    ".tif": "TIFF",
+    ".tiff": "TIFF",
+}
+
+
+class EncodeOptions:
+    """
+    The settings of the encoders. Each format uses those that apply to it:
+    the quality for JPEG and WebP, the compression level and the threads for
+    PNG and TIFF.
+    """
+
+    def __init__(
+        self,
+        quality=DEFAULT_QUALITY,
+        compression_level=COMPRESSION_LEVEL,
+        alpha=True,
+        threads=None,
+    ):
+        """
+        Attributes:
+            quality (int): The quality of JPEG and WebP files, from 0 to 100.
+            compression_level (int): The deflate level of PNG and TIFF
+                files, from 0 to 9.
+            alpha (bool): Whether to write the alpha channel, which is always
+                opaque. JPEG files never have one.
+            threads (int): The number of threads compressing PNG and TIFF
+                files.
+
+        Args:
+            The attributes. One thread per CPU if threads is None.
+        """
+        if not 0 <= quality <= 100:
+            raise ValueError("The quality must be between 0 and 100")
+        if not 0 <= compression_level <= 9:
+            raise ValueError("The compression level must be between 0 and 9")
+
+        self.quality = quality
+        self.compression_level = compression_level
+        self.alpha = bool(alpha)
+        self.threads = max(1, threads or os.cpu_count() or 1)
+
+
+class EncodeStats:
+    """
+    What encoding an image cost.
+    """
+
+    def __init__(self, image_format, seconds, size):
+        """
+        Attributes:
+            format (str): The format of the image, a value of FORMATS.
+            seconds (float): The time spent encoding and writing the image,
+                including the time waiting for its compressing threads.
+            bytes (int): The size of the file.
+
+        Args:
+            image_format (str): The format of the image.
+            seconds (float): The time spent encoding the image.
+            size (int): The size of the file.
+        """
+        self.format = image_format
+        self.seconds = seconds
+        self.bytes = size
+
+
+class ImageWriter:
+    """
+    Writes an image to a file band by band, so that the whole image never
+    needs to be rendered at once. Bands of BGRA rows are written from the
+    top of the image to the bottom, and the writer checks that the image is
+    complete when it is closed. Writers are context managers.
+
+    Writers may compress their data on a pool of threads, which zlib runs
+    in parallel. The compressed pieces are written in the order they were
+    submitted, while the next bands arrive.
+    """
+
+    def __init__(self, path, width, height, options=None):
+        """
+        Attributes:
+            path (str): The path of the file.
+            width (int): The width of the image.
+            height (int): The height of the image.
+            options (EncodeOptions): The settings of the encoder.
+            channels (int): The number of channels written, 4 with alpha
+                and 3 without.
+            rows_written (int): The number of rows written so far.
+            encode_seconds (float): The time spent encoding and writing the
+                rows so far.
+            _file (BinaryIO): The open file.
+            __executor (ThreadPoolExecutor): The threads compressing the
+                data, None with a single thread.
+            __results (Deque[Future]): The compressed pieces not written
+                yet, in the order they were submitted.
+
+        Args:
+            path (str): The path of the file.
+            width (int): The width of the image.
+            height (int): The height of the image.
+            options (EncodeOptions, optional): The settings of the encoder.
+                The default settings if None.
+        """
+        self.path = path
+        self.width = width
+        self.height = height
+        self.options = options or EncodeOptions()
+        self.channels = 4 if self.options.alpha else 3
+        self.rows_written = 0
+        self.encode_seconds = 0.0
+        self._file = open(path, "wb")
+        self.__executor = None
+        if self.options.threads > 1:
+            self.__executor = ThreadPoolExecutor(self.options.threads)
+        self.__results = deque()
+
+    def write(self, band):
+        """
+        Writes the next band of the image.
+
+        Args:
+            band (np.ndarray): The BGRA uint8 rows, of shape (rows, width, 4).
+        """
+        rows = band.shape[0]
+        if band.shape[1] != self.width:
+            raise ValueError(
+                "Expected bands {} pixels wide, got {}".format(
+                    self.width, band.shape[1]
+                )
+            )
+        if self.rows_written + rows > self.height:
+            raise ValueError("Too many rows written to {}".format(self.path))
+
+        start = time.perf_counter()
+        self._write_band(band)
+        self.rows_written += rows
+        self.encode_seconds += time.perf_counter() - start
+
+    def close(self):
+        """
+        Finishes the file and closes it.
+        """
+        start = time.perf_counter()
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(
+                    "Only {} of {} rows written to {}".format(
+                        self.rows_written, self.height, self.path
+                    )
+                )
+            while self.__results:
+                self._write_compressed(self.__results.popleft().result())
+            self._finish()
+        finally:
+            self.__shutdown()
+            self.encode_seconds += time.perf_counter() - start
+
+    def _write_band(self, band):
+        """
+        Converts a band to RGB or RGBA pixels and writes them.
+
+        Args:
+            band (np.ndarray): The BGRA uint8 rows.
+        """
+        if self.options.alpha:
+            self._write_rows(cv2.cvtColor(band, cv2.COLOR_BGRA2RGBA))
+        else:
+            self._write_rows(cv2.cvtColor(band, cv2.COLOR_BGRA2RGB))
+
+    def _write_rows(self, rows):
+        """
+        Encodes and writes rows of RGB or RGBA pixels.
+
+        Args:
+            rows (np.ndarray): The uint8 rows, with `channels` channels.
+        """
+        raise NotImplementedError
+
+    def _compress(self, function, *args):
+        """
+        Compresses a piece of the file on the threads of the writer, or
+        right away with a single thread. The results are passed to
+        `_write_compressed` in the order the pieces were submitted.
+
+        Args:
+            function (Callable): The function compressing the piece, which
+                must not use the state of the writer.
+            *args: The arguments of the function, which must not be changed
+                afterwards.
+        """
+        if self.__executor is None:
+            self._write_compressed(function(*args))
+            return
+
+        self.__results.append(self.__executor.submit(function, *args))
+        while len(self.__results) > self.options.threads * CHUNKS_PER_THREAD:
+            self._write_compressed(self.__results.popleft().result())
+
+    def _write_compressed(self, data):
+        """
+        Writes a compressed piece of the file.
+
+        Args:
+            data (bytes): The result of the function given to `_compress`.
+        """
+        raise NotImplementedError
+
+    def _finish(self):
+        """
+        Writes the end of the file.
+        """
+        raise NotImplementedError
+
+    def __shutdown(self):
+        """
+        Stops the threads of the writer and closes the file.
+        """
+        if self.__executor is not None:
+            self.__executor.shutdown(cancel_futures=True)
+        self.__results.clear()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.__shutdown()
+
+
+class PngWriter(ImageWriter):
+    """
+    Writes an RGB or RGBA PNG file as a single deflate stream, compressed as
+    the bands arrive.
+
+    The stream is cut in chunks of PNG_CHUNK_BYTES compressed in parallel,
+    each one primed with the window of data before it and ended on a byte
+    boundary, so that their concatenation is one valid stream that
+    compresses nearly as well as a serial one.
+    """
+
+    def __init__(self, path, width, height, options=None):
+        """
+        Attributes:
+            __previous_row (np.ndarray): The last row written, which the first
+                row of the next band is filtered against.
+            __window (bytes): The last DEFLATE_WINDOW bytes of the stream.
+            __checksum (int): The Adler-32 checksum of the stream so far.
+
+        Args:
+            path (str): The path of the file.
+            width (int): The width of the image.
+            height (int): The height of the image.
+            options (EncodeOptions, optional): The settings of the encoder.
+        """
+        super().__init__(path, width, height, options)
+        self.__previous_row = np.zeros(width * self.channels, np.uint8)
+        self.__window = b""
+        self.__checksum = zlib.adler32(b"")
+
+        # 8 bit RGBA or RGB, without interlacing
+        color_type = 6 if self.options.alpha else 2
+        self._file.write(PNG_SIGNATURE)
+        self.__write_chunk(
+            b"IHDR",
+            struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0),
+        )
+
+        # Header of the zlib stream, whose level field is only informative
+        self.__write_chunk(b"IDAT", b"\x78\x01")
+
+    def _write_rows(self, rows):
+        """
+        Filters each row against the row above and compresses them in
+        chunks.
+
+        Args:
+            rows (np.ndarray): The uint8 rows.
+        """
+        rows = rows.reshape(rows.shape[0], -1)
+        scanlines = np.empty((rows.shape[0], rows.shape[1] + 1), np.uint8)
+        scanlines[:, 0] = PNG_UP_FILTER
+        np.subtract(rows[1:], rows[:-1], out=scanlines[1:, 1:])
+        np.subtract(rows[0], self.__previous_row, out=scanlines[0, 1:])
+        self.__previous_row = rows[-1].copy()
+
+        data = scanlines.reshape(-1)
+        self.__checksum = zlib.adler32(data, self.__checksum)
+        for start in range(0, len(data), PNG_CHUNK_BYTES):
+            window = self.__window + data[:start][-DEFLATE_WINDOW:].tobytes()
+            self._compress(
+                self.__deflate,
+                data[start : start + PNG_CHUNK_BYTES],
+                window[-DEFLATE_WINDOW:],
+                self.options.compression_level,
+            )
+        self.__window = (
+            self.__window + data[-DEFLATE_WINDOW:].tobytes()
+        )[-DEFLATE_WINDOW:]
+
+    def _write_compressed(self, data):
+        """
+        Writes a compressed chunk of the stream.
+
+        Args:
+            data (bytes): The compressed chunk.
+        """
+        if data:
+            self.__write_chunk(b"IDAT", data)
+
+    def _finish(self):
+        """
+        Writes the end of the deflate stream and the end of the file.
+        """
+        end = zlib.compressobj(
+            self.options.compression_level, zlib.DEFLATED, -zlib.MAX_WBITS
+        ).flush()
+        self.__write_chunk(b"IDAT", end + struct.pack(">I", self.__checksum))
+        self.__write_chunk(b"IEND", b"")
+
+    @staticmethod
+    def __deflate(data, window, level):
+        """
+        Compresses a chunk of the stream as raw deflate data, ended on a
+        byte boundary without ending the stream.
+
+        Args:
+            data (np.ndarray): The chunk.
+            window (bytes): The data before the chunk, which it may refer
+                to.
+            level (int): The compression level.
+
+        Returns:
+            bytes: The compressed chunk.
+        """
+        if window:
+            compressor = zlib.compressobj(
+                level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=window
+            )
+        else:
+            compressor = zlib.compressobj(
+                level, zlib.DEFLATED, -zlib.MAX_WBITS
+            )
+
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def __write_chunk(self, chunk_type, data):
+        """
+        Writes a PNG chunk with its length and checksum.
+
+        Args:
+            chunk_type (bytes): The four letter type of the chunk.
+            data (bytes): The content of the chunk.
+        """
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(chunk_type)
+        self._file.write(data)
+        self._file.write(
+            struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type)))
+        )
+
+
+class TiffWriter(ImageWriter):
+    """
+    Writes an RGB or RGBA baseline TIFF file in strips of
+    TIFF_ROWS_PER_STRIP rows, each one compressed with deflate after a
+    horizontal difference, in parallel. The directory of the strips is
+    written at the end of the file.
+    """
+
+    def __init__(self, path, width, height, options=None):
+        """
+        Attributes:
+            __pending (np.ndarray): The rows of the next strip received so
+                far.
+            __strip_offsets (List[int]): The position of each strip.
+            __strip_sizes (List[int]): The compressed size of each strip.
+
+        Args:
+            path (str): The path of the file.
+            width (int): The width of the image.
+            height (int): The height of the image.
+            options (EncodeOptions, optional): The settings of the encoder.
+        """
+        super().__init__(path, width, height, options)
+        self.__pending = np.empty((0, width, self.channels), np.uint8)
+        self.__strip_offsets = []
+        self.__strip_sizes = []
+
+        # Little endian header, with the offset of the directory written at
+        # the end
+        self._file.write(b"II*\x00\x00\x00\x00\x00")
+
+    def _write_rows(self, rows):
+        """
+        Groups the rows in strips and writes every complete strip.
+
+        Args:
+            rows (np.ndarray): The uint8 rows.
+        """
+        if len(self.__pending):
+            rows = np.concatenate([self.__pending, rows])
+
+        complete = len(rows) - len(rows) % TIFF_ROWS_PER_STRIP
+        if self.rows_written + len(rows) - len(self.__pending) == self.height:
+            complete = len(rows)
+        for top in range(0, complete, TIFF_ROWS_PER_STRIP):
+            self._compress(
+                self.__deflate_strip,
+                rows[top : top + TIFF_ROWS_PER_STRIP],
+                self.options.compression_level,
+            )
+        self.__pending = rows[complete:].copy()
+
+    def _write_compressed(self, data):
+        """
+        Writes a compressed strip.
+
+        Args:
+            data (bytes): The compressed strip.
+        """
+        self.__strip_offsets.append(self.__align())
+        self.__strip_sizes.append(len(data))
+        self._file.write(data)
+
+    @staticmethod
+    def __deflate_strip(rows, level):
+        """
+        Compresses one strip.
+
+        Args:
+            rows (np.ndarray): The uint8 rows of the strip.
+            level (int): The compression level.
+
+        Returns:
+            bytes: The compressed strip.
+        """
+        # Horizontal predictor: each sample minus the same sample of the
+        # previous pixel
+        differences = np.empty_like(rows)
+        differences[:, 0] = rows[:, 0]
+        np.subtract(rows[:, 1:], rows[:, :-1], out=differences[:, 1:])
+
+        return zlib.compress(differences, level)
+
+    def _finish(self):
+        """
+        Writes the directory of the image and points the header to it.
+        """
+        bits_offset = self.__write_values("<{}H", [8] * self.channels)
+        offsets = self.__write_values("<{}I", self.__strip_offsets)
+        sizes = self.__write_values("<{}I", self.__strip_sizes)
+        num_strips = len(self.__strip_offsets)
+
+        # Tags sorted by code: code, type, count and value or offset
+        tags = [
+            (256, TIFF_LONG, 1, self.width),
+            (257, TIFF_LONG, 1, self.height),
+            (258, TIFF_SHORT, self.channels, bits_offset),
+            # Adobe deflate compression
+            (259, TIFF_SHORT, 1, 8),
+            # RGB
+            (262, TIFF_SHORT, 1, 2),
+            (273, TIFF_LONG, num_strips, offsets),
+            (277, TIFF_SHORT, 1, self.channels),
+            (278, TIFF_LONG, 1, TIFF_ROWS_PER_STRIP),
+            (279, TIFF_LONG, num_strips, sizes),
+            # Interleaved samples
+            (284, TIFF_SHORT, 1, 1),
+            # Horizontal differencing
+            (317, TIFF_SHORT, 1, 2),
+        ]
+        if self.options.alpha:
+            # Unassociated alpha
+            tags.append((338, TIFF_SHORT, 1, 2))
+        directory_offset = self.__align()
+        if directory_offset >= 2**32:
+            raise ValueError("The image is too large for a TIFF file")
+        self._file.write(struct.pack("<H", len(tags)))
+        for code, field_type, count, value in tags:
+            # Single values are stored in the entry itself
+            if field_type == TIFF_SHORT and count == 1:
+                entry = struct.pack(
+                    "<HHIHH", code, field_type, count, value, 0
+                )
+            else:
+                entry = struct.pack("<HHII", code, field_type, count, value)
+            self._file.write(entry)
+        self._file.write(struct.pack("<I", 0))
+
+        self._file.seek(4)
+        self._file.write(struct.pack("<I", directory_offset))
+
+    def __write_values(self, value_format, values):
+        """
+        Writes the values of a tag that do not fit in its entry.
+
+        Args:
+            value_format (str): The struct format of the values, with a
+                placeholder for their count.
+            values (List[int]): The values.
+
+        Returns:
+            int: The offset of the values, or the value itself when there is
+            only one LONG value, which fits in the entry.
+        """
+        if len(values) == 1 and value_format.endswith("I"):
+            return values[0]
+
+        offset = self.__align()
+        value_format = value_format.format(len(values))
+        self._file.write(struct.pack(value_format, *values))
+
+        return offset
+
+    def __align(self):
+        """
+        Pads the file to an even position, where TIFF data must start.
+
+        Returns:
+            int: The position of the file.
+        """
+        position = self._file.tell()
+        if position % 2:
+            self._file.write(b"\x00")
+            position += 1
+
+        return position
+
+
+class OpenCvWriter(ImageWriter):
+    """
+    Writes a JPEG or WebP file, which OpenCV can only encode as a whole. The
+    bands are gathered into a whole BGRA image, encoded when the writer is
+    closed, so that images rendered by strips can be saved to these formats
+    with 4 bytes per pixel on top of the encoder.
+    """
+
+    def __init__(self, path, width, height, options=None):
+        """
+        Attributes:
+            __image (np.ndarray): The BGRA image the bands are gathered into.
+
+        Args:
+            path (str): The path of the file.
+            width (int): The width of the image.
+            height (int): The height of the image.
+            options (EncodeOptions, optional): The settings of the encoder.
+        """
+        super().__init__(path, width, height, options)
+        self.__image = np.empty((height, width, 4), np.uint8)
+
+    def _write_band(self, band):
+        """
+        Copies a band into the image, in the BGRA order OpenCV encodes.
+
+        Args:
+            band (np.ndarray): The BGRA uint8 rows.
+        """
+        top = self.rows_written
+        self.__image[top : top + band.shape[0]] = band
+
+    def _finish(self):
+        """
+        Encodes the whole image and writes it.
+        """
+        self._file.write(
+            encode_opencv(self.__image, image_format(self.path), self.options)
+        )
+
+
+# Image writers, by file extension
+WRITERS = {
+    ".png": PngWriter,
+    ".jpg": OpenCvWriter,
+    ".jpeg": OpenCvWriter,
+    ".webp": OpenCvWriter,
+    ".tif": TiffWriter,
+    ".tiff": TiffWriter,
+}
+
+
+def image_format(path):
+    """
+    Finds the format of an image file from its extension.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        str: The format, a value of FORMATS.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(
+            "Images can only be saved to {} files".format(", ".join(FORMATS))
+        )
+
+    return FORMATS[extension]
+
+
+def open_image_writer(path, width, height, options=None):
+    """
+    Opens a band by band writer for an image file, chosen by its extension.
+    PNG and TIFF files are encoded as the bands arrive, JPEG and WebP files
+    once they are all written.
+
+    Args:
+        path (str): The path of the file, in one of FORMATS.
+        width (int): The width of the image.
+        height (int): The height of the image.
+        options (EncodeOptions, optional): The settings of the encoder.
+
+    Returns:
+        ImageWriter: The writer of the file.
+    """
+    image_format(path)
+
+    return WRITERS[os.path.splitext(path)[1].lower()](
+        path, width, height, options
+    )
+
+
+def encode_image(image, path, options=None):
+    """
+    Encodes a whole image into a file, in the format of its extension. PNG
+    and TIFF files are written band by band by the writers of this module,
+    and JPEG and WebP files by OpenCV.
+
+    Args:
+        image (np.ndarray): The BGRA uint8 image.
+        path (str): The path of the file.
+        options (EncodeOptions, optional): The settings of the encoder.
+
+    Returns:
+        EncodeStats: The time spent encoding and the size of the file.
+    """
+    options = options or EncodeOptions()
+    name = image_format(path)
+    height, width = image.shape[:2]
+    start = time.perf_counter()
+    if name in ("JPEG", "WebP"):
+        # The image is already whole, so it is not gathered by a writer
+        data = encode_opencv(image, name, options)
+        with open(path, "wb") as file:
+            file.write(data)
+    else:
+        with open_image_writer(path, width, height, options) as writer:
+            for top, rows in iter_strips(height):
+                writer.write(image[top : top + rows])
+
+    return EncodeStats(
+        name, time.perf_counter() - start, os.path.getsize(path)
+    )
+
+
+def encode_opencv(image, name, options):
+    """
+    Encodes a whole image to JPEG or WebP with OpenCV.
+
+    Args:
+        image (np.ndarray): The BGRA uint8 image.
+        name (str): The format, "JPEG" or "WebP".
+        options (EncodeOptions): The settings of the encoder.
+
+    Returns:
+        np.ndarray: The bytes of the file.
+    """
+    if name == "JPEG":
+        extension = ".jpg"
+        params = [cv2.IMWRITE_JPEG_QUALITY, options.quality]
+    else:
+        extension = ".webp"
+        params = [cv2.IMWRITE_WEBP_QUALITY, max(1, options.quality)]
+    if name == "JPEG" or not options.alpha:
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    encoded, data = cv2.imencode(extension, image, params)
+    if not encoded:
+        raise OSError("Could not encode image as {}".format(name))
+
+    return data
+
+
+def compare_encoders(image, directory, options=None):
+    """
+    Encodes the same image in every format, to compare what each one costs.
+
+    Args:
+        image (np.ndarray): The BGRA uint8 image.
+        directory (str): The directory of the files, named after their
+            format.
+        options (EncodeOptions, optional): The settings of the encoders.
+
+    Returns:
+        List[EncodeStats]: The cost of each format.
+    """
+    stats = []
+    for extension in (".png", ".jpg", ".webp", ".tif"):
+        path = os.path.join(directory, "image" + extension)
+        stats.append(encode_image(image, path, options))
+
+    return stats
+
+
+def encode_report(stats):
+    """
+    Formats the cost of encoded images as a table.
+
+    Args:
+        stats (List[EncodeStats]): The cost of each image.
+
+    Returns:
+        str: One line per image with its format, time and size.
+    """
+    row = "{:<8}{:>12}{:>12}"
+    lines = [row.format("Format", "ms", "MB")]
+    for image_stats in stats:
+        lines.append(
+            row.format(
+                image_stats.format,
+                "{:.1f}".format(image_stats.seconds * 1000),
+                "{:.2f}".format(image_stats.bytes / 2**20),
+            )
+        )
+
+    return "\n".join(lines)